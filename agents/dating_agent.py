@@ -1,15 +1,18 @@
 """
 约会指南智能体模块
 """
-from typing import List, Dict, Any, Optional
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator
 from langchain.schema import Document
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
 
-from core.llm_manager import LLMManager
+from config.settings import settings
+from core.llm_manager import LLMManager, GenerationError
+from core.reranker import CrossEncoderReranker
+from core.semantic_cache import SemanticCache, plan_params
 from core.vector_store import VectorStore
 from tools.web_search import WebSearchTool
 from utils.logger import get_logger
+from utils.startup import timed
 
 logger = get_logger(__name__)
 
@@ -17,9 +20,30 @@ class DatingAgent:
     """约会指南智能体"""
     
     def __init__(self):
-        self.llm_manager = LLMManager()
-        self.vector_store = VectorStore()
-        self.web_search = WebSearchTool()
+        with timed("LLMManager"):
+            self.llm_manager = LLMManager()
+        with timed("VectorStore"):
+            self.vector_store = VectorStore()
+        with timed("WebSearchTool"):
+            self.web_search = WebSearchTool()
+        self.reranker = None
+        if settings.RERANK_ENABLED:
+            self.reranker = CrossEncoderReranker(
+                settings.RERANK_MODEL,
+                cache_dir=settings.MODEL_CACHE_DIR,
+                batch_size=settings.RERANK_BATCH_SIZE,
+                max_length=settings.RERANK_MAX_LENGTH,
+                cache_size=settings.RERANK_CACHE_SIZE,
+                latency_budget_ms=settings.RERANK_LATENCY_BUDGET_MS,
+                max_concurrency=settings.RERANK_MAX_CONCURRENCY
+            )
+        self.semantic_cache = None
+        if settings.SEMANTIC_CACHE_ENABLED:
+            self.semantic_cache = SemanticCache(
+                settings.SEMANTIC_CACHE_SIZE,
+                settings.SEMANTIC_CACHE_THRESHOLD,
+                ttl_seconds=settings.SEMANTIC_CACHE_TTL
+            )
         self.qa_chain = None
         self._initialize()
     
@@ -27,10 +51,14 @@ class DatingAgent:
         """初始化智能体"""
         try:
             # 创建问答链
-            self._create_qa_chain()
+            with timed("qa_chain"):
+                self._create_qa_chain()
+            # 问答链的检索器持有vector_db对象，快照切换或删除片段后需要重建
+            self.vector_store.on_replaced = self._create_qa_chain
             
             # 初始化知识库
-            self._initialize_knowledge_base()
+            with timed("knowledge_base"):
+                self._initialize_knowledge_base()
             
             logger.info("约会指南智能体初始化完成")
             
@@ -41,6 +69,9 @@ class DatingAgent:
     def _create_qa_chain(self):
         """创建问答链"""
         try:
+            from langchain.chains import RetrievalQA
+            from langchain.prompts import PromptTemplate
+            
             # 创建提示模板
             prompt_template = """你是一个专业的七夕约会规划师。基于以下上下文信息，为用户提供详细、实用的约会建议。
 
@@ -193,8 +224,11 @@ class DatingAgent:
                     
                     # 添加到向量数据库
                     if documents:
-                        self.vector_store.add_documents(documents)
-                        logger.info(f"添加{len(documents)}个搜索结果到知识库")
+                        report = self.vector_store.add_documents(documents)
+                        logger.info(
+                            f"添加{len(documents) - report['skipped_documents']}个搜索结果到知识库，"
+                            f"跳过已收录{report['skipped_documents']}个"
+                        )
                 
         except Exception as e:
             logger.error(f"搜索并添加约会信息失败: {e}")
@@ -204,63 +238,24 @@ class DatingAgent:
         try:
             logger.info(f"收到用户查询: {user_query}")
             
+            # 与历史查询语义相近时直接返回之前的规划
+            lookup = self._semantic_lookup(user_query)
+            if lookup[3] is not None:
+                return lookup[3]
+            
             # 首先使用RAG系统检索相关知识
             logger.info("🔍 使用RAG系统检索相关知识...")
-            relevant_docs = self.vector_store.similarity_search(user_query, k=5)
+            relevant_docs = self._retrieve_context(user_query)
             
-            if relevant_docs:
-                logger.info(f"✅ 找到{len(relevant_docs)}个相关文档")
-                
-                # 构建包含检索内容的提示
-                context_info = "\n\n".join([doc.page_content for doc in relevant_docs])
-                enhanced_prompt = f"""
-基于以下检索到的约会知识，为用户提供详细的约会规划：
-
-检索到的知识：
-{context_info}
-
-用户需求：{user_query}
-
-请提供：
-1. 约会主题和氛围建议
-2. 具体活动安排
-3. 时间规划建议
-4. 地点推荐
-5. 注意事项和贴心提示
-
-请用温暖、专业的语气回答，确保建议实用且浪漫。
-"""
-                
-                # 使用LLM生成回答
-                logger.info("🤖 基于检索内容生成回答...")
-                answer = self.llm_manager.generate(enhanced_prompt)
-                
-                result = {
-                    "answer": answer,
-                    "source_documents": [],
-                    "search_results": [],
-                    "rag_used": True
-                }
-                
-                # 添加源文档信息
-                for doc in relevant_docs:
-                    result["source_documents"].append({
-                        "content": doc.page_content[:200] + "...",
-                        "metadata": doc.metadata
-                    })
-                
-                logger.info("✅ RAG系统回答生成完成")
-                
-            else:
-                logger.info("⚠️ 未找到相关文档，直接使用LLM生成...")
-                answer = self.llm_manager.generate(user_query)
-                
-                result = {
-                    "answer": answer,
-                    "source_documents": [],
-                    "search_results": [],
-                    "rag_used": False
-                }
+            # 生成失败时仍返回错误信息，但结果不写入语义缓存
+            failed = False
+            try:
+                answer = self.llm_manager.generate(
+                    self._build_plan_prompt(user_query, relevant_docs), raise_on_error=True
+                )
+            except GenerationError as e:
+                answer, failed = str(e), True
+            result = self._new_result(answer, relevant_docs)
             
             # 如果RAG结果不够详细，进行网络搜索补充
             if len(result["answer"]) < 300:
@@ -273,30 +268,261 @@ class DatingAgent:
                     enhanced_answer = self._enhance_answer_with_search(
                         result["answer"], search_results
                     )
-                    result["answer"] = enhanced_answer
+                    if enhanced_answer is None:
+                        failed = True
+                    else:
+                        result["answer"] = enhanced_answer
             
+            self._semantic_store(user_query, lookup, result, failed)
             logger.info("🎯 约会规划完成")
             return result
                 
         except Exception as e:
             logger.error(f"规划约会失败: {e}")
-            return {
-                "answer": f"抱歉，规划约会时出现错误: {str(e)}",
-                "source_documents": [],
-                "search_results": [],
-                "rag_used": False
+            return self._error_result(e)
+    
+    async def aplan_dating(self, user_query: str) -> Dict[str, Any]:
+        """异步规划约会：检索和网络搜索在线程池中执行，LLM调用使用异步接口，不阻塞事件循环"""
+        try:
+            logger.info(f"收到用户查询: {user_query}")
+            loop = asyncio.get_running_loop()
+            
+            lookup = await loop.run_in_executor(None, self._semantic_lookup, user_query)
+            if lookup[3] is not None:
+                return lookup[3]
+            
+            logger.info("🔍 使用RAG系统检索相关知识...")
+            relevant_docs = await loop.run_in_executor(None, self._retrieve_context, user_query)
+            
+            failed = False
+            try:
+                answer = await self.llm_manager.agenerate(
+                    self._build_plan_prompt(user_query, relevant_docs), raise_on_error=True
+                )
+            except GenerationError as e:
+                answer, failed = str(e), True
+            result = self._new_result(answer, relevant_docs)
+            
+            if len(result["answer"]) < 300:
+                logger.info("🔍 RAG结果不够详细，进行网络搜索补充...")
+                search_results = await loop.run_in_executor(None, self.web_search.search_dating_ideas, user_query)
+                result["search_results"] = search_results[:3]
+                
+                if search_results:
+                    try:
+                        enhanced_answer = await self.llm_manager.agenerate(
+                            self._build_enhancement_prompt(result["answer"], search_results), raise_on_error=True
+                        )
+                        result["answer"] = f"{result['answer']}\n\n💡 补充建议：\n{enhanced_answer}"
+                    except Exception as e:
+                        logger.error(f"增强回答失败: {e}")
+                        failed = True
+            
+            self._semantic_store(user_query, lookup, result, failed)
+            logger.info("🎯 约会规划完成")
+            return result
+                
+        except Exception as e:
+            logger.error(f"规划约会失败: {e}")
+            return self._error_result(e)
+    
+    async def astream_plan_dating(self, user_query: str) -> AsyncIterator[Dict[str, Any]]:
+        """流式规划约会，依次产出事件：
+        
+        - retrieval: 检索到的源文档，在生成开始前发送
+        - token: 新生成的一段回答文本
+        - search: 回答过短时补充的网络搜索结果，之后继续产出补充建议的token
+        - done / error: 结束，done中的cached表示结果来自语义缓存
+        """
+        try:
+            logger.info(f"收到流式查询: {user_query}")
+            loop = asyncio.get_running_loop()
+            
+            lookup = await loop.run_in_executor(None, self._semantic_lookup, user_query)
+            cached = lookup[3]
+            if cached is not None:
+                yield {
+                    "event": "retrieval",
+                    "data": {"source_documents": cached["source_documents"], "rag_used": cached["rag_used"]}
+                }
+                if cached["search_results"]:
+                    yield {"event": "search", "data": {"search_results": cached["search_results"]}}
+                yield {"event": "token", "data": {"text": cached["answer"]}}
+                yield {"event": "done", "data": {"cached": True}}
+                return
+            
+            relevant_docs = await loop.run_in_executor(None, self._retrieve_context, user_query)
+            result = self._new_result("", relevant_docs)
+            yield {
+                "event": "retrieval",
+                "data": {"source_documents": result["source_documents"], "rag_used": result["rag_used"]}
             }
+            
+            # 已产出的token无法撤回：失败时把错误信息作为最后一段产出，结果不写入语义缓存
+            failed = False
+            answer = []
+            try:
+                async for token in self.llm_manager.astream(
+                    self._build_plan_prompt(user_query, relevant_docs), raise_on_error=True
+                ):
+                    answer.append(token)
+                    yield {"event": "token", "data": {"text": token}}
+            except GenerationError as e:
+                failed = True
+                answer.append(str(e))
+                yield {"event": "token", "data": {"text": str(e)}}
+            result["answer"] = "".join(answer)
+            
+            if len(result["answer"]) < 300:
+                logger.info("🔍 RAG结果不够详细，进行网络搜索补充...")
+                search_results = await loop.run_in_executor(None, self.web_search.search_dating_ideas, user_query)
+                if search_results:
+                    result["search_results"] = search_results[:3]
+                    yield {"event": "search", "data": {"search_results": result["search_results"]}}
+                    
+                    enhancement = ["\n\n💡 补充建议：\n"]
+                    yield {"event": "token", "data": {"text": enhancement[0]}}
+                    try:
+                        async for token in self.llm_manager.astream(
+                            self._build_enhancement_prompt(result["answer"], search_results), raise_on_error=True
+                        ):
+                            enhancement.append(token)
+                            yield {"event": "token", "data": {"text": token}}
+                    except GenerationError as e:
+                        failed = True
+                        enhancement.append(str(e))
+                        yield {"event": "token", "data": {"text": str(e)}}
+                    result["answer"] += "".join(enhancement)
+            
+            self._semantic_store(user_query, lookup, result, failed)
+            logger.info("🎯 流式约会规划完成")
+            yield {"event": "done", "data": {"cached": False}}
+            
+        except Exception as e:
+            logger.error(f"流式规划约会失败: {e}")
+            yield {"event": "error", "data": {"message": f"抱歉，规划约会时出现错误: {str(e)}"}}
+    
+    def _semantic_lookup(self, user_query: str) -> tuple:
+        """在语义缓存中查找相近的历史查询，返回(查询向量, 索引版本号, 规划参数, 缓存的结果或None)
+        
+        版本号在检索之前记录，生成期间知识库发生变更时结果按旧版本写入，随即失效。
+        查询中的城市、预算和日期必须与历史查询完全相同才会命中。
+        """
+        if self.semantic_cache is None:
+            return None, None, None, None
+        try:
+            version = self.vector_store.index_version
+            params = plan_params(user_query)
+            vector = self.vector_store.embed_query(user_query)
+            hit = self.semantic_cache.get(vector, version, params)
+        except Exception as e:
+            logger.error(f"语义缓存查找失败: {e}")
+            return None, None, None, None
+        
+        if hit is None:
+            return vector, version, params, None
+        result, similarity, cached_query = hit
+        logger.info(f"⚡ 命中语义缓存（相似度{similarity:.3f}）: {cached_query}")
+        return vector, version, params, dict(result, cached=True)
+    
+    def _semantic_store(self, user_query: str, lookup: tuple, result: Dict[str, Any], failed: bool) -> None:
+        """把规划写入语义缓存；主回答或补充建议任何一步生成失败时不写入"""
+        vector, version, params, _ = lookup
+        if vector is None or failed:
+            return
+        self.semantic_cache.put(user_query, vector, result, version, params)
+    
+    def _build_plan_prompt(self, user_query: str, relevant_docs: List[Document]) -> str:
+        """构建生成约会规划的提示；没有检索结果时直接使用用户查询"""
+        if not relevant_docs:
+            logger.info("⚠️ 未找到相关文档，直接使用LLM生成...")
+            return user_query
+            
+        logger.info(f"✅ 找到{len(relevant_docs)}个相关文档")
+        
+        # 构建包含检索内容的提示
+        context_info = "\n\n".join([doc.page_content for doc in relevant_docs])
+        logger.info("🤖 基于检索内容生成回答...")
+        return f"""
+基于以下检索到的约会知识，为用户提供详细的约会规划：
+
+检索到的知识：
+{context_info}
+
+用户需求：{user_query}
+
+请提供：
+1. 约会主题和氛围建议
+2. 具体活动安排
+3. 时间规划建议
+4. 地点推荐
+5. 注意事项和贴心提示
+
+请用温暖、专业的语气回答，确保建议实用且浪漫。
+"""
+    
+    @staticmethod
+    def _new_result(answer: str, relevant_docs: List[Document]) -> Dict[str, Any]:
+        """构建规划结果，附带源文档信息"""
+        return {
+            "answer": answer,
+            "source_documents": [
+                {
+                    "content": doc.page_content[:200] + "...",
+                    "metadata": doc.metadata
+                }
+                for doc in relevant_docs
+            ],
+            "search_results": [],
+            "rag_used": bool(relevant_docs),
+            "cached": False
+        }
+    
+    @staticmethod
+    def _error_result(error: Exception) -> Dict[str, Any]:
+        """规划失败时返回的结果"""
+        return {
+            "answer": f"抱歉，规划约会时出现错误: {str(error)}",
+            "source_documents": [],
+            "search_results": [],
+            "rag_used": False,
+            "cached": False
+        }
+    
+    def _retrieve_context(self, user_query: str) -> List[Document]:
+        """检索构建提示用的片段；启用重排序时多召回候选，用交叉编码器保留前几个"""
+        if self.reranker is None:
+            return self.vector_store.retrieve(user_query, k=5)
+        candidates = self.vector_store.retrieve(user_query, k=settings.RERANK_FETCH_K)
+        return self.reranker.rerank(user_query, candidates, settings.RERANK_TOP_N)
     
-    def _enhance_answer_with_search(self, original_answer: str, search_results: List[Dict[str, Any]]) -> str:
-        """基于搜索结果增强回答"""
+    def _enhance_answer_with_search(self, original_answer: str,
+                                    search_results: List[Dict[str, Any]]) -> Optional[str]:
+        """基于搜索结果增强回答，生成失败时返回None"""
         try:
-            # 构建增强提示
-            search_context = "\n\n".join([
-                f"搜索结果 {i+1}:\n标题: {result['title']}\n内容: {result['snippet']}"
-                for i, result in enumerate(search_results)
-            ])
+            # 使用LLM生成增强回答
+            enhanced_answer = self.llm_manager.generate(
+                self._build_enhancement_prompt(original_answer, search_results), raise_on_error=True
+            )
+            
+            # 合并原有回答和增强内容
+            final_answer = f"{original_answer}\n\n💡 补充建议：\n{enhanced_answer}"
+            
+            return final_answer
             
-            enhancement_prompt = f"""
+        except Exception as e:
+            logger.error(f"增强回答失败: {e}")
+            return None
+    
+    @staticmethod
+    def _build_enhancement_prompt(original_answer: str, search_results: List[Dict[str, Any]]) -> str:
+        """构建基于搜索结果补充回答的提示"""
+        search_context = "\n\n".join([
+            f"搜索结果 {i+1}:\n标题: {result['title']}\n内容: {result['snippet']}"
+            for i, result in enumerate(search_results)
+        ])
+        
+        return f"""
 基于以下搜索结果，请为原有的约会建议提供更详细、更实用的补充信息：
 
 原有建议：
@@ -313,18 +539,6 @@ class DatingAgent:
 
 请保持温暖、专业的语气，确保建议实用且浪漫。
 """
-            
-            # 使用LLM生成增强回答
-            enhanced_answer = self.llm_manager.generate(enhancement_prompt)
-            
-            # 合并原有回答和增强内容
-            final_answer = f"{original_answer}\n\n💡 补充建议：\n{enhanced_answer}"
-            
-            return final_answer
-            
-        except Exception as e:
-            logger.error(f"增强回答失败: {e}")
-            return original_answer
     
     def get_agent_status(self) -> Dict[str, Any]:
         """获取智能体状态"""
@@ -333,7 +547,9 @@ class DatingAgent:
                 "llm_ready": self.llm_manager.is_ready(),
                 "vector_db_stats": self.vector_store.get_collection_stats(),
                 "model_info": self.llm_manager.get_model_info(),
-                "rag_chain_ready": self.qa_chain is not None
+                "rag_chain_ready": self.qa_chain is not None,
+                "reranker": self.reranker.get_stats() if self.reranker is not None else None,
+                "semantic_cache": self.semantic_cache.get_stats() if self.semantic_cache is not None else None
             }
         except Exception as e:
             logger.error(f"获取智能体状态失败: {e}")
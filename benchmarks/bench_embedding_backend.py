@@ -0,0 +1,103 @@
+"""
+嵌入后端基准测试：PyTorch vs ONNX（fp32 / int8）
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_embedding_backend --texts 2000 --batch-size 32 --threads 4
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from config.settings import settings
+
+_SUBJECTS = ["七夕约会", "烛光晚餐", "电影约会", "户外野餐", "浪漫礼物", "周末短途旅行", "手工体验课", "夜景观光"]
+_DETAILS = [
+    "预算控制在一千元以内", "适合第一次约会的情侣", "需要提前预订座位", "推荐选择安静的餐厅",
+    "可以准备一份手写卡片", "注意查看当天的天气预报", "适合喜欢拍照的女生", "交通方便离地铁站近"
+]
+
+def make_texts(n: int) -> list:
+    """生成长度不一的合成中文文本，模拟知识库片段和用户查询"""
+    rng = random.Random(42)
+    texts = []
+    for _ in range(n):
+        sentences = [f"{rng.choice(_SUBJECTS)}：{rng.choice(_DETAILS)}。" for _ in range(rng.randint(1, 12))]
+        texts.append("".join(sentences))
+    return texts
+
+def measure(embeddings, texts: list) -> tuple:
+    """预热后计时，返回(向量矩阵, 每秒文本数)"""
+    embeddings.embed_documents(texts[:8])
+    start = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    return vectors, len(texts) / elapsed
+
+def cosine_agreement(reference: np.ndarray, vectors: np.ndarray) -> dict:
+    """逐条计算与PyTorch输出的余弦相似度"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    cosine = np.sum(reference * vectors, axis=1)
+    return {
+        "mean": round(float(cosine.mean()), 6),
+        "min": round(float(cosine.min()), 6),
+        "p01": round(float(np.percentile(cosine, 1)), 6)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入后端基准测试")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=settings.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=settings.EMBEDDING_NUM_THREADS)
+    parser.add_argument("--model", type=str, default=settings.EMBEDDING_MODEL)
+    args = parser.parse_args()
+    
+    import torch
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from core.onnx_embeddings import OnnxEmbeddings
+    
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    texts = make_texts(args.texts)
+    
+    torch_embeddings = HuggingFaceEmbeddings(
+        model_name=args.model,
+        cache_folder=str(settings.CACHE_DIR),
+        encode_kwargs={"batch_size": args.batch_size}
+    )
+    reference, torch_rate = measure(torch_embeddings, texts)
+    results = [{"backend": "torch", "texts_per_second": round(torch_rate, 2)}]
+    
+    for quantize in (False, True):
+        start = time.perf_counter()
+        onnx_embeddings = OnnxEmbeddings(
+            args.model,
+            settings.CACHE_DIR,
+            quantize=quantize,
+            batch_size=args.batch_size,
+            num_threads=args.threads
+        )
+        load_seconds = time.perf_counter() - start
+        vectors, rate = measure(onnx_embeddings, texts)
+        results.append({
+            "backend": f"onnx-{'int8' if quantize else 'fp32'}",
+            "texts_per_second": round(rate, 2),
+            "speedup": round(rate / torch_rate, 2),
+            "load_seconds": round(load_seconds, 2),
+            "cosine_vs_torch": cosine_agreement(reference, vectors)
+        })
+        
+    report = {
+        "model": args.model,
+        "texts": args.texts,
+        "batch_size": args.batch_size,
+        "threads": args.threads,
+        "results": results
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+FAISS加载方式基准测试：完整加载 vs 内存映射加载
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_faiss_load --vectors 200000 --workers 4
+"""
+import argparse
+import json
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+
+from core.faiss_mmap import export_serving_index
+
+def _read_memory_stats() -> dict:
+    """读取当前进程的RSS/PSS（KB），PSS按共享进程数分摊共享页"""
+    stats = {}
+    for path, keys in (("/proc/self/status", ("VmRSS",)), ("/proc/self/smaps_rollup", ("Pss",))):
+        try:
+            with open(path) as f:
+                for line in f:
+                    name = line.split(":")[0]
+                    if name in keys:
+                        stats[name.lower()] = int(line.split()[1])
+        except OSError:
+            pass
+    return stats
+
+def build_fixtures(directory: Path, n: int, dim: int) -> None:
+    """生成合成数据，分别以save_local格式和只读服务格式写出"""
+    rng = np.random.default_rng(42)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    
+    documents = [
+        (str(i), Document(page_content=f"合成文档 {i}", metadata={"type": "benchmark", "position": i}))
+        for i in range(n)
+    ]
+    
+    memory_dir = directory / "memory"
+    memory_dir.mkdir(parents=True)
+    faiss.write_index(index, str(memory_dir / "index.faiss"))
+    docstore = InMemoryDocstore({doc_id: doc for doc_id, doc in documents})
+    with open(memory_dir / "index.pkl", "wb") as f:
+        pickle.dump((docstore, {i: doc_id for i, (doc_id, _) in enumerate(documents)}), f)
+        
+    export_serving_index(index, documents, directory / "mmap")
+
+def run_worker(mode: str, directory: Path, dim: int, hold: float) -> dict:
+    """子进程：加载索引并执行一次搜索，报告加载耗时与内存占用"""
+    from langchain_community.vectorstores import FAISS
+    from core.faiss_mmap import load_serving_index
+    
+    before = _read_memory_stats()
+    start = time.perf_counter()
+    if mode == "memory":
+        vector_db = FAISS.load_local(str(directory / "memory"), None)
+    else:
+        vector_db = load_serving_index(directory / "mmap", None)
+    load_seconds = time.perf_counter() - start
+    
+    query = np.random.default_rng(0).standard_normal((1, dim)).astype(np.float32)
+    start = time.perf_counter()
+    vector_db.similarity_search_with_score_by_vector(query[0].tolist(), k=5)
+    first_search_seconds = time.perf_counter() - start
+    
+    # 等待其他工作进程也完成加载，使PSS反映页共享情况
+    time.sleep(hold)
+    after = _read_memory_stats()
+    return {
+        "mode": mode,
+        "load_seconds": round(load_seconds, 4),
+        "first_search_seconds": round(first_search_seconds, 4),
+        "rss_kb": after.get("vmrss"),
+        "rss_delta_kb": after.get("vmrss", 0) - before.get("vmrss", 0),
+        "pss_kb": after.get("pss")
+    }
+
+def run_mode(mode: str, directory: Path, dim: int, workers: int) -> list:
+    """并发启动多个工作进程，模拟同一主机上的多个Web worker"""
+    hold = 2.0 if workers > 1 else 0.0
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_faiss_load", "--worker", mode,
+             "--dir", str(directory), "--dim", str(dim), "--hold", str(hold)],
+            stdout=subprocess.PIPE,
+            text=True
+        )
+        for _ in range(workers)
+    ]
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS加载方式基准测试")
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--dir", type=str, default=None)
+    parser.add_argument("--worker", choices=["memory", "mmap"], default=None)
+    parser.add_argument("--hold", type=float, default=0.0)
+    args = parser.parse_args()
+    
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, Path(args.dir), args.dim, args.hold)))
+        return
+        
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(args.dir) if args.dir else Path(tmp)
+        if not (directory / "memory").exists():
+            build_fixtures(directory, args.vectors, args.dim)
+            
+        report = {"vectors": args.vectors, "dimension": args.dim, "workers": args.workers, "results": {}}
+        for mode in ("memory", "mmap"):
+            # 第一轮预热页缓存，第二轮为热启动结果
+            run_mode(mode, directory, args.dim, 1)
+            report["results"][mode] = run_mode(mode, directory, args.dim, args.workers)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
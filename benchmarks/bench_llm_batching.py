@@ -0,0 +1,165 @@
+"""
+本地模型动态批处理基准测试：不同并发数下的吞吐量与延迟
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_llm_batching --concurrency 1,2,4,8,16 --output batching.json
+    python -m benchmarks.bench_llm_batching --generator model --max-new-tokens 64 --requests 32
+
+默认使用合成生成器（每批固定开销 + 每个请求的边际开销，模拟GPU上批量生成的成本结构），
+只衡量调度本身；--generator model加载配置的本地模型，测量真实硬件上的收益。
+每个并发数分别以不合并（每批1个请求）和动态批处理两种模式运行，结果为JSON。
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Callable
+
+import numpy as np
+
+from config.settings import settings
+from core.llm_batching import BatchScheduler, hf_generate_batch
+
+_PROMPTS = [
+    "七夕节想给女朋友一个惊喜，有什么浪漫的约会建议？",
+    "预算五百元以内，周末在杭州怎么安排一次约会？",
+    "第一次约会去哪里比较合适，怎样避免尴尬？",
+    "下雨天有哪些适合情侣的室内约会活动？",
+    "异地恋的七夕节可以怎么过？",
+    "想在家里准备一顿烛光晚餐，需要注意什么？",
+    "适合喜欢拍照的女生的约会地点有哪些？",
+    "结婚纪念日想安排一次短途旅行，有什么推荐？"
+]
+
+def synthetic_generator(batch_ms: float, per_request_ms: float) -> Callable[[List[str], int, float], List[str]]:
+    """合成生成器：批量执行时固定开销只付一次"""
+    def generate_batch(prompts: List[str], max_new_tokens: int, temperature: float) -> List[str]:
+        time.sleep((batch_ms + per_request_ms * len(prompts)) / 1000)
+        return [f"回答{len(prompt)}" for prompt in prompts]
+    return generate_batch
+
+def model_generator(model_name: str) -> Callable[[List[str], int, float], List[str]]:
+    """加载本地模型，返回批量生成函数"""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=str(settings.MODEL_CACHE_DIR), trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        cache_dir=str(settings.MODEL_CACHE_DIR),
+        device_map="auto",
+        trust_remote_code=True,
+        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+    )
+    model.eval()
+    return lambda prompts, max_new_tokens, temperature: hf_generate_batch(
+        model, tokenizer, prompts, max_new_tokens, temperature
+    )
+
+def run_level(generate_batch, concurrency: int, requests: int, max_batch_size: int,
+              max_wait_ms: float, max_new_tokens: int) -> Dict[str, Any]:
+    """以固定并发数发送请求（每个客户端收到回答后立即发送下一个），报告吞吐量和延迟分位数"""
+    scheduler = BatchScheduler(generate_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+    
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            scheduler.generate(_PROMPTS[index % len(_PROMPTS)], max_new_tokens, 0.7)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                
+    # 预热一次，避免首批计入模型的惰性初始化
+    scheduler.generate(_PROMPTS[0], max_new_tokens, 0.7)
+    warmup = scheduler.get_stats()
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    wall_seconds = time.perf_counter() - start
+    
+    stats = scheduler.get_stats()
+    scheduler.stop()
+    batches = stats["batches"] - warmup["batches"]
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "max_batch_size": max_batch_size,
+        "requests": len(latencies),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 3),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies_ms, 50)), 2),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 2),
+            "max": round(float(latencies_ms.max()), 2)
+        },
+        "batches": batches,
+        "average_batch_size": round(len(latencies) / batches, 2) if batches else 0.0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="动态批处理基准测试")
+    parser.add_argument("--generator", choices=["synthetic", "model"], default="synthetic")
+    parser.add_argument("--model", type=str, default=settings.MODEL_NAME, help="--generator model时加载的模型")
+    parser.add_argument("--concurrency", type=str, default="1,2,4,8,16", help="并发客户端数，逗号分隔")
+    parser.add_argument("--requests", type=int, default=64, help="每个并发级别的请求总数")
+    parser.add_argument("--max-batch-size", type=int, default=settings.LLM_BATCH_MAX_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=settings.LLM_BATCH_MAX_WAIT_MS)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--batch-ms", type=float, default=200, help="合成生成器每批的固定耗时")
+    parser.add_argument("--per-request-ms", type=float, default=20, help="合成生成器每个请求的边际耗时")
+    parser.add_argument("--output", type=str, default=None, help="结果JSON的写入路径")
+    args = parser.parse_args()
+    
+    if args.generator == "model":
+        generate_batch = model_generator(args.model)
+    else:
+        generate_batch = synthetic_generator(args.batch_ms, args.per_request_ms)
+        
+    results = []
+    for concurrency in [int(level) for level in args.concurrency.split(",") if level]:
+        for mode, max_batch_size in (("unbatched", 1), ("batched", args.max_batch_size)):
+            print(f"运行用例: 并发{concurrency}，{mode}", file=sys.stderr)
+            result = run_level(
+                generate_batch, concurrency, args.requests, max_batch_size, args.max_wait_ms, args.max_new_tokens
+            )
+            result["mode"] = mode
+            results.append(result)
+            
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        },
+        "parameters": {
+            "generator": args.generator,
+            "model": args.model if args.generator == "model" else None,
+            "requests": args.requests,
+            "max_wait_ms": args.max_wait_ms,
+            "max_new_tokens": args.max_new_tokens
+        },
+        "results": results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+if __name__ == "__main__":
+    main()
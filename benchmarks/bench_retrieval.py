@@ -0,0 +1,322 @@
+"""
+检索基准测试：入库吞吐、索引构建耗时、磁盘占用、内存、稠密与BM25搜索延迟分位数与recall@k
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_retrieval --scales 1000,100000,1000000 --output bench.json
+    python -m benchmarks.bench_retrieval --scales 1000 --backends faiss --index-types flat,hnsw
+    python -m benchmarks.bench_retrieval --corpus data/dump.jsonl --embeddings model
+
+默认使用确定性的哈希嵌入，百万级规模的测试只衡量索引与存储本身；--embeddings model使用配置的嵌入模型。
+合成语料由种子决定，可用--dump-corpus导出为JSONL，再用--corpus在其他版本上重放。
+每个用例在独立子进程中运行，RSS互不干扰；结果为JSON，便于在版本之间对比回归。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import List, Dict, Any, Iterator, Optional
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+
+from benchmarks.bench_faiss_load import _read_memory_stats
+from config.settings import settings
+from core.lexical_index import tokenize
+
+_TOPICS = ["烛光晚餐", "电影约会", "户外野餐", "浪漫礼物", "周末短途旅行", "手工体验课", "夜景观光", "游乐园",
+           "音乐会", "博物馆", "咖啡馆", "海边散步", "温泉度假", "露营观星", "美食探店", "密室逃脱"]
+_DETAILS = ["预算控制在一千元以内", "适合第一次约会的情侣", "需要提前预订座位", "推荐选择安静的餐厅",
+            "可以准备一份手写卡片", "注意查看当天的天气预报", "适合喜欢拍照的女生", "交通方便离地铁站近",
+            "晚上八点以后人比较少", "记得带上充电宝和纸巾", "提前了解对方的口味偏好", "雨天可以改为室内活动",
+            "节日期间价格会上涨", "附近有停车场", "适合安排在下午", "可以顺路逛一逛夜市"]
+_CITIES = ["北京", "上海", "广州", "深圳", "杭州", "成都", "南京", "西安", "重庆", "苏州"]
+
+class HashingEmbeddings(Embeddings):
+    """确定性哈希嵌入：词元哈希到固定维度并归一化，词元重叠越多向量越相近"""
+    
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+    
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in tokenize(text):
+            code = zlib.crc32(token.encode("utf-8"))
+            vector[code % self.dimension] += 1.0 if code & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text).tolist() for text in texts]
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+def iter_synthetic_corpus(n: int, seed: int = 42) -> Iterator[Document]:
+    """按种子生成n篇互不相同的合成文档（短于分割长度，每篇恰好一个片段）"""
+    rng = random.Random(seed)
+    for i in range(n):
+        topic = rng.choice(_TOPICS)
+        city = rng.choice(_CITIES)
+        details = "，".join(rng.sample(_DETAILS, rng.randint(2, 6)))
+        yield Document(
+            page_content=f"{city}{topic}攻略（第{i}篇）：{details}。",
+            metadata={"type": "benchmark", "category": topic, "bench_id": i}
+        )
+
+def iter_jsonl_corpus(path: Path, limit: Optional[int] = None, text_field: str = "content") -> Iterator[Document]:
+    """重放JSONL语料（格式同main.py ingest --jsonl）"""
+    from core.ingest import JsonlSource
+    
+    for number, (doc, _) in enumerate(JsonlSource(path, text_field=text_field).read()):
+        if limit is not None and number >= limit:
+            return
+        doc.metadata.setdefault("bench_id", number)
+        yield doc
+
+def corpus_documents(case: Dict[str, Any]) -> Iterator[Document]:
+    """按用例配置产出语料文档"""
+    if case.get("corpus"):
+        return iter_jsonl_corpus(Path(case["corpus"]), case["scale"], case["text_field"])
+    return iter_synthetic_corpus(case["scale"], case["seed"])
+
+def make_queries(case: Dict[str, Any]) -> List[str]:
+    """从语料中按种子抽取文档，截取其中一段作为查询（近似真实的改写查询）"""
+    rng = random.Random(case["seed"] + 1)
+    wanted = set(rng.sample(range(case["scale"]), min(case["queries"], case["scale"])))
+    queries = []
+    for number, doc in enumerate(corpus_documents(case)):
+        if number in wanted:
+            text = doc.page_content
+            length = max(4, len(text) // 2)
+            start = rng.randint(0, max(0, len(text) - length))
+            queries.append(text[start:start + length])
+    return queries
+
+def directory_size(path: Path) -> int:
+    """目录占用的字节数"""
+    return sum(file.stat().st_size for file in Path(path).rglob("*") if file.is_file())
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """延迟分位数（毫秒）"""
+    values = np.asarray(samples) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 4),
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4)
+    }
+
+def exact_neighbors(store, embeddings, query_vectors: np.ndarray, k: int) -> List[set]:
+    """对库中全部片段做暴力搜索，得到每条查询的真实前k个片段（按内容标识）"""
+    texts = [doc.page_content for _, doc in store._iter_documents()]
+    index = faiss.IndexFlatL2(query_vectors.shape[1])
+    batch_size = 4096
+    for start in range(0, len(texts), batch_size):
+        index.add(np.asarray(embeddings.embed_documents(texts[start:start + batch_size]), dtype=np.float32))
+    _, positions = index.search(query_vectors, k)
+    return [{texts[position] for position in row if position >= 0} for row in positions]
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """子进程：入库、构建目标索引、重新加载后测量搜索延迟与召回率"""
+    from core.faiss_index import INDEX_FLAT, build_index, reconstruct_all
+    from core.ingest import IterableSource, StreamingIngestor
+    from core.vector_store import VectorStore
+    
+    workdir = Path(case["workdir"])
+    root = workdir / "store"
+    settings.VECTOR_DB_TYPE = case["backend"]
+    # 入库时统一写入flat索引，目标索引在入库后单独构建并计时
+    settings.FAISS_INDEX_TYPE = INDEX_FLAT
+    settings.VECTOR_STORAGE_DTYPE = case["dtype"]
+    settings.SNAPSHOT_POLL_SECONDS = 0
+    settings.RESULT_CACHE_ENABLED = False
+    settings.QUERY_CACHE_SIZE = max(settings.QUERY_CACHE_SIZE, case["queries"])
+    settings.EMBEDDING_CACHE_PATH = workdir / "embeddings.sqlite3"
+    embeddings = HashingEmbeddings(case["dim"]) if case["embeddings"] == "hash" else None
+    
+    store = VectorStore(root=root, embeddings=embeddings)
+    backend = store.get_collection_stats().get("type")
+    if backend != case["backend"]:
+        # Chroma初始化失败时VectorStore会回退到FAISS，此时结果不代表所测后端
+        raise RuntimeError(f"{case['backend']}后端不可用，实际为{backend}")
+    embeddings = store.embeddings
+    ingestor = StreamingIngestor(store, batch_size=case["batch_size"], checkpoint_dir=workdir / "checkpoints")
+    report = ingestor.run(IterableSource(corpus_documents(case)), resume=False)
+    
+    build_seconds = None
+    if case["backend"] == "faiss" and case["index_type"] != INDEX_FLAT:
+        with store._lock:
+            index = store.vector_db.index
+            start = time.perf_counter()
+            store.vector_db.index = build_index(reconstruct_all(index), case["index_type"], index.metric_type)
+            build_seconds = time.perf_counter() - start
+        settings.FAISS_INDEX_TYPE = case["index_type"]
+    start = time.perf_counter()
+    store.close(compact=True)
+    persist_seconds = time.perf_counter() - start
+    disk_bytes = directory_size(root)
+    del store
+    
+    start = time.perf_counter()
+    store = VectorStore(root=root, embeddings=embeddings)
+    load_seconds = time.perf_counter() - start
+    
+    queries = make_queries(case)
+    # 预先嵌入查询，延迟只反映索引与文档读取
+    query_vectors = np.asarray(store._embed_queries(queries), dtype=np.float32)
+    truth = exact_neighbors(store, embeddings, query_vectors, case["k"])
+    
+    for query in queries[:min(10, len(queries))]:
+        store.similarity_search_with_score(query, case["k"])
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = store.similarity_search_with_score(query, case["k"])
+        latencies.append(time.perf_counter() - start)
+        hits += len({doc.page_content for doc, _ in results} & expected)
+    lexical_latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.lexical_index.search(query, settings.HYBRID_LEXICAL_K)
+        lexical_latencies.append(time.perf_counter() - start)
+    memory = _read_memory_stats()
+    document_count = store.get_collection_stats().get("document_count")
+    store.close()
+    
+    return {
+        "scale": case["scale"],
+        "backend": case["backend"],
+        "index_type": case["index_type"],
+        "dtype": case["dtype"] if case["backend"] == "faiss" else "float32",
+        "embeddings": case["embeddings"],
+        "chunks": document_count,
+        "ingest_docs_per_second": report["docs_per_second"],
+        "ingest_seconds": report["elapsed_seconds"],
+        "build_seconds": round(build_seconds, 3) if build_seconds is not None else None,
+        "persist_seconds": round(persist_seconds, 3),
+        "load_seconds": round(load_seconds, 3),
+        "disk_bytes": disk_bytes,
+        "rss_kb": memory.get("vmrss"),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "queries": len(queries),
+        "k": case["k"],
+        "latency": percentiles(latencies),
+        "lexical_latency": percentiles(lexical_latencies),
+        "recall_at_k": round(hits / (len(queries) * case["k"]), 4) if queries else None
+    }
+
+def run_isolated(case: Dict[str, Any]) -> Dict[str, Any]:
+    """在独立子进程中运行用例；日志输出到标准输出，结果通过文件返回"""
+    with tempfile.TemporaryDirectory(prefix="bench-retrieval-") as tmp:
+        case = dict(case, workdir=tmp)
+        result_path = Path(tmp) / "result.json"
+        process = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_retrieval",
+             "--case", json.dumps(case), "--result-file", str(result_path)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        if process.returncode != 0 or not result_path.exists():
+            return {
+                "scale": case["scale"],
+                "backend": case["backend"],
+                "index_type": case["index_type"],
+                "error": process.stderr.strip().splitlines()[-1:] or [f"exit code {process.returncode}"]
+            }
+        return json.loads(result_path.read_text(encoding="utf-8"))
+
+def environment() -> Dict[str, Any]:
+    """记录运行环境，便于比较不同版本的结果"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent.parent
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "faiss": getattr(faiss, "__version__", None),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="检索基准测试")
+    parser.add_argument("--scales", type=str, default="1000,100000,1000000", help="片段数量，逗号分隔")
+    parser.add_argument("--backends", type=str, default="faiss,chroma,numpy")
+    parser.add_argument("--index-types", type=str, default="flat,ivf_flat,hnsw", help="FAISS索引类型，逗号分隔")
+    parser.add_argument("--dtype", type=str, default="float32", help="FAISS向量存储精度")
+    parser.add_argument("--embeddings", choices=["hash", "model"], default="hash")
+    parser.add_argument("--dim", type=int, default=384, help="哈希嵌入的维度")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1024, help="入库时每个嵌入/写入批次的片段数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--corpus", type=str, default=None, help="重放JSONL语料，规模不超过其行数")
+    parser.add_argument("--text-field", type=str, default="content")
+    parser.add_argument("--dump-corpus", type=str, default=None, help="把最大规模的合成语料导出为JSONL后退出")
+    parser.add_argument("--output", type=str, default=None, help="结果JSON的写入路径")
+    parser.add_argument("--case", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.case:
+        result = run_case(json.loads(args.case))
+        Path(args.result_file).write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        return
+        
+    scales = [int(scale) for scale in args.scales.split(",") if scale]
+    if args.dump_corpus:
+        with open(args.dump_corpus, "w", encoding="utf-8") as f:
+            for doc in iter_synthetic_corpus(max(scales), args.seed):
+                f.write(json.dumps({"content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False) + "\n")
+        return
+        
+    base_case = {
+        "dtype": args.dtype,
+        "embeddings": args.embeddings,
+        "dim": args.dim,
+        "queries": args.queries,
+        "k": args.k,
+        "batch_size": args.batch_size,
+        "seed": args.seed,
+        "corpus": str(Path(args.corpus).resolve()) if args.corpus else None,
+        "text_field": args.text_field
+    }
+    results = []
+    for scale in scales:
+        for backend in [backend for backend in args.backends.split(",") if backend]:
+            if backend == "faiss":
+                index_types = args.index_types.split(",")
+            else:
+                index_types = ["hnsw" if backend == "chroma" else "exact"]
+            for index_type in index_types:
+                case = dict(base_case, scale=scale, backend=backend, index_type=index_type)
+                print(f"运行用例: {backend}/{index_type}，{scale}个片段", file=sys.stderr)
+                results.append(run_isolated(case))
+                
+    report = {"environment": environment(), "parameters": base_case, "results": results}
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+if __name__ == "__main__":
+    main()
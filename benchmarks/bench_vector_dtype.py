@@ -0,0 +1,95 @@
+"""
+向量存储精度基准测试：float32 vs float16 vs int8
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_vector_dtype --vectors 100000 --queries 500 --k 5
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from core.faiss_index import (
+    DTYPE_FLOAT16, DTYPE_FLOAT32, DTYPE_INT8, INDEX_FLAT, INDEX_IVF_FLAT, build_index, rescore
+)
+
+def make_vectors(n: int, queries: int, dim: int, clusters: int = 256):
+    """生成带聚类结构的归一化向量，接近句向量模型的分布"""
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n + queries)
+    data = centers[labels] + 0.5 * rng.standard_normal((n + queries, dim)).astype(np.float32)
+    faiss.normalize_L2(data)
+    return data[:n], data[n:]
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray, k: int) -> float:
+    """结果与精确float32结果的前k交集比例"""
+    hits = sum(len(set(row[:k]) & set(expected[:k])) for row, expected in zip(found, truth))
+    return hits / (len(truth) * k)
+
+def run_case(vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, index_type: str,
+             dtype: str, k: int, rescore_factor: int) -> dict:
+    """构建一种索引，报告单向量字节数、搜索延迟和召回率（含精排与不含精排）"""
+    start = time.perf_counter()
+    index = build_index(vectors, index_type, dtype=dtype)
+    build_seconds = time.perf_counter() - start
+    bytes_per_vector = faiss.serialize_index(index).nbytes / len(vectors)
+    
+    start = time.perf_counter()
+    _, positions = index.search(queries, k)
+    search_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    
+    # 多取候选后用float32原始向量精排
+    start = time.perf_counter()
+    _, candidates = index.search(queries, k * rescore_factor)
+    reranked = []
+    for query, row in zip(queries, candidates):
+        row = row[row >= 0]
+        order, _ = rescore(query, vectors[row], k)
+        reranked.append(row[order])
+    rescore_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    
+    return {
+        "index_type": index_type,
+        "dtype": dtype,
+        "bytes_per_vector": round(bytes_per_vector, 1),
+        "build_seconds": round(build_seconds, 3),
+        "search_ms": round(search_ms, 4),
+        "recall_at_k": round(recall_at_k(positions, truth, k), 4),
+        "rescore_search_ms": round(rescore_ms, 4),
+        "rescore_recall_at_k": round(recall_at_k(reranked, truth, k), 4)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="向量存储精度基准测试")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+    
+    vectors, queries = make_vectors(args.vectors, args.queries, args.dim)
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+    
+    results = []
+    for index_type in (INDEX_FLAT, INDEX_IVF_FLAT):
+        for dtype in (DTYPE_FLOAT32, DTYPE_FLOAT16, DTYPE_INT8):
+            results.append(run_case(vectors, queries, truth, index_type, dtype, args.k, args.rescore_factor))
+            
+    report = {
+        "vectors": args.vectors,
+        "queries": args.queries,
+        "dimension": args.dim,
+        "k": args.k,
+        "rescore_factor": args.rescore_factor,
+        "results": results
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
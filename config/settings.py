@@ -3,7 +3,7 @@
 """
 import os
 from pathlib import Path
-from typing import Optional
+from typing import List, Dict, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -20,11 +20,78 @@ class Settings(BaseSettings):
     # LLM模型配置
     MODEL_NAME: str = "meta-llama/Llama-2-7b-chat-hf"
     MODEL_CACHE_DIR: Path = BASE_DIR / "models"
+    LLM_LOCAL_WORKERS: int = 1  # 异步接口中本地模型推理的线程数，同一模型上通常为1
+    LLM_BATCHING_ENABLED: bool = True  # 本地模型合并并发请求为一次批量生成
+    LLM_BATCH_MAX_SIZE: int = 8  # 每批最多的请求数
+    LLM_BATCH_MAX_WAIT_MS: float = 20  # 第一个请求到达后等待后续请求的最长毫秒数
+    
+    # LLM响应缓存配置（按后端、模型、规范化后的完整提示、温度、最大长度精确匹配）
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MEMORY_SIZE: int = 256  # 进程内缓存条数
+    LLM_CACHE_PATH: Path = CACHE_DIR / "llm_responses.sqlite3"
+    LLM_CACHE_MAX_ENTRIES: int = 20000  # 磁盘缓存条数上限，超过时LRU淘汰
+    LLM_CACHE_TTL: int = 24 * 3600  # 过期秒数，0表示不过期
     
     # 向量数据库配置
-    VECTOR_DB_TYPE: str = "chroma"  # chroma 或 faiss
+    VECTOR_DB_TYPE: str = "chroma"  # chroma / faiss / numpy（纯NumPy精确搜索，适合小语料）
     EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
     
+    # FAISS持久化配置
+    FAISS_PERSIST_MODE: str = "incremental"  # incremental（增量段）或 full（每次全量保存）
+    FAISS_COMPACT_THRESHOLD: int = 10000  # 增量段累计向量数达到该值时后台压缩
+    FAISS_TOMBSTONE_RATIO: float = 0.2  # 删除只做标记，已删除向量占比超过该值时才重建紧凑的索引
+    FAISS_LOAD_MODE: str = "memory"  # memory（完整加载）或 mmap（只读服务模式，内存映射加载）
+    FAISS_SERVING_EXPORT: bool = False  # 压缩后导出供mmap模式加载的只读服务索引
+    
+    # FAISS索引类型配置
+    FAISS_INDEX_TYPE: str = "auto"  # auto（按规模选择）/ flat / ivf_flat / hnsw / ivf_pq
+    FAISS_ANN_THRESHOLD: int = 50000  # 向量数达到该值时从flat切换为近似索引
+    FAISS_ANN_TYPE: str = "ivf_flat"  # 中等规模使用的近似索引：ivf_flat 或 hnsw
+    FAISS_PQ_THRESHOLD: int = 2000000  # 向量数达到该值时切换为ivf_pq
+    FAISS_NLIST: int = 0  # IVF聚类中心数，0表示自动（4*sqrt(n)）
+    FAISS_NPROBE: int = 16  # IVF默认搜索的聚类数
+    FAISS_HNSW_M: int = 32
+    FAISS_EF_CONSTRUCTION: int = 200
+    FAISS_EF_SEARCH: int = 64  # HNSW默认搜索宽度
+    FAISS_PQ_M: int = 48  # PQ子量化器数量（需整除向量维度）
+    
+    # 向量存储精度配置（仅FAISS后端）
+    VECTOR_STORAGE_DTYPE: str = "float32"  # float32 / float16 / int8（标量量化）
+    VECTOR_INT8_MIN_TRAIN: int = 1000  # int8量化训练所需的最少向量数
+    VECTOR_RESCORE: bool = True  # 压缩存储时用float32向量对候选精排
+    VECTOR_RESCORE_FACTOR: int = 4  # 精排候选数 = k * 该系数
+    
+    # 入库去重配置
+    DEDUP_ENABLED: bool = True
+    DEDUP_BLOOM_CAPACITY: int = 1000000  # 布隆过滤器设计容量，超出后自动扩容
+    DEDUP_BLOOM_ERROR_RATE: float = 0.001
+    
+    # 嵌入模型后端配置
+    EMBEDDING_BACKEND: str = "torch"  # torch（sentence-transformers）/ onnx（导出后由ONNX Runtime推理）
+    EMBEDDING_ONNX_QUANTIZE: bool = True  # ONNX导出时做动态int8量化
+    EMBEDDING_BATCH_SIZE: int = 32
+    EMBEDDING_NUM_THREADS: int = 0  # 推理线程数，0表示由运行时决定
+    
+    # 嵌入缓存配置
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: Path = CACHE_DIR / "embeddings.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 200000
+    
+    # 流式批量入库配置
+    INGEST_BATCH_SIZE: int = 256  # 每个嵌入/写入微批次的片段数
+    INGEST_READ_BATCH: int = 32  # 每次读取并分割的文档数
+    INGEST_CHECKPOINT_DIR: Path = DATA_DIR / "ingest_checkpoints"
+    
+    # 索引版本快照配置
+    SNAPSHOT_KEEP: int = 2  # 保留的已发布版本数（CURRENT指向的版本始终保留）
+    SNAPSHOT_POLL_SECONDS: float = 5  # 运行中的服务检查CURRENT指针的间隔，0表示不自动切换
+    SNAPSHOT_SWAP_GRACE_SECONDS: float = 30  # 切换后延迟关闭旧版本文件句柄的秒数
+    
+    # 并行分割配置
+    SPLIT_WORKERS: int = 0  # 分割进程数，0或1表示在当前进程中分割
+    SPLIT_QUEUE_SIZE: int = 8  # 分割结果队列容量（批次数）
+    SPLIT_PARALLEL_MIN_DOCS: int = 64  # add_documents启用并行分割的最少文档数
+    
     # 搜索配置
     SEARCH_ENGINE: str = "duckduckgo"
     MAX_SEARCH_RESULTS: int = 10
@@ -34,6 +101,54 @@ class Settings(BaseSettings):
     CHUNK_OVERLAP: int = 200
     TOP_K_RETRIEVAL: int = 5
     
+    # 检索模式配置
+    RETRIEVAL_MODE: str = "hybrid"  # vector（稠密）/ lexical（BM25）/ hybrid（融合）
+    HYBRID_VECTOR_K: int = 3  # 混合检索中稠密召回的数量
+    HYBRID_LEXICAL_K: int = 10  # 混合检索中BM25召回的数量
+    HYBRID_RRF_K: int = 60  # 倒数排名融合的平滑常数
+    LEXICAL_JOURNAL_LIMIT: int = 5000  # BM25日志条数达到该值时重写快照
+    LEXICAL_MAX_DF_RATIO: float = 0.5  # 出现在超过该比例片段中的高频词，查询还有其他词时不参与BM25打分
+    
+    # 检索结果多样化（MMR）配置
+    MMR_ENABLED: bool = True  # 按最大边际相关性去掉近似重复的片段（如同一网页相互重叠的分割片段）
+    MMR_FETCH_K: int = 20  # MMR的候选数量
+    MMR_LAMBDA: float = 0.5  # 相关性权重：1只看相关性，0只看多样性
+    
+    # 交叉编码器重排序配置
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "BAAI/bge-reranker-base"  # 支持中文的交叉编码器
+    RERANK_FETCH_K: int = 10  # 重排序前召回的候选数量
+    RERANK_TOP_N: int = 3  # 重排序后保留的片段数
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_MAX_LENGTH: int = 512
+    RERANK_CACHE_SIZE: int = 4096  # (查询, 片段)分数缓存条数
+    RERANK_LATENCY_BUDGET_MS: int = 300  # 已有重排序进行时，按实测耗时预计排队后超过该值则跳过，0表示不限制
+    RERANK_MAX_CONCURRENCY: int = 2  # 同时进行的重排序数达到该值时跳过，0表示不限制
+    
+    # 元数据过滤配置
+    METADATA_INDEX_FIELDS: List[str] = ["type", "category", "source", "relevance_score", "ingested_at"]  # 建立二级索引的字段
+    METADATA_FILTER_EXACT_MAX: int = 2048  # 过滤后候选不超过该数量时直接精确计算
+    
+    # 过期片段淘汰配置（片段入库时记录ingested_at时间戳）
+    EVICTION_TTL_BY_TYPE: Dict[str, float] = {"web_search": 7 * 24 * 3600}  # 按type设置的存活秒数
+    EVICTION_TTL_BY_CATEGORY: Dict[str, float] = {}  # 按category设置的存活秒数，优先于type
+    EVICTION_PINNED_TYPES: List[str] = ["basic_knowledge"]  # 永不淘汰的type
+    EVICTION_INTERVAL_SECONDS: float = 3600  # 后台淘汰任务的执行间隔，0表示关闭
+    
+    # 检索缓存配置（进程内）
+    QUERY_CACHE_SIZE: int = 1024  # 查询嵌入缓存条数
+    QUERY_CACHE_TTL: int = 3600  # 查询嵌入缓存过期秒数，0表示不过期
+    RESULT_CACHE_ENABLED: bool = True  # 缓存(查询, k, 过滤条件) → 结果ID，索引变更时失效
+    RESULT_CACHE_SIZE: int = 1024
+    RESULT_CACHE_TTL: int = 600
+    
+    # 语义缓存配置（相似且城市、预算、日期相同的用户查询直接复用之前的约会规划，知识库变更时失效）
+    # 默认关闭：阈值需要针对所用嵌入模型和中文查询评估后再开启
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # 查询嵌入的余弦相似度阈值，换用嵌入模型后需重新评估
+    SEMANTIC_CACHE_SIZE: int = 512  # 缓存的查询条数
+    SEMANTIC_CACHE_TTL: int = 6 * 3600  # 过期秒数，0表示不过期
+    
     # API配置
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_API_BASE: Optional[str] = None
@@ -58,7 +173,7 @@ settings = Settings()
 
 # 确保必要的目录存在
 def ensure_directories():
-    """确保必要的目录存在"""
+    """确保必要的目录存在（由程序入口调用，导入配置模块本身不产生副作用）"""
     directories = [
         settings.DATA_DIR,
         settings.VECTOR_DB_DIR,
@@ -69,6 +184,3 @@ def ensure_directories():
     
     for directory in directories:
         directory.mkdir(parents=True, exist_ok=True)
-
-# 初始化时创建目录
-ensure_directories()
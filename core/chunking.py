@@ -0,0 +1,128 @@
+"""
+文本分割模块
+"""
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Any, Iterable, Iterator, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 工作进程内的分割器，由进程池初始化函数创建
+_worker_splitter = None
+_DONE = object()
+
+def make_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """创建项目统一配置的文本分割器"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+def _init_worker(chunk_size: int, chunk_overlap: int) -> None:
+    """工作进程初始化"""
+    global _worker_splitter
+    _worker_splitter = make_text_splitter(chunk_size, chunk_overlap)
+
+def _split_documents(documents: List[Document]) -> List[Document]:
+    """在工作进程中分割一批文档"""
+    return _worker_splitter.split_documents(documents)
+
+class _Failure:
+    """把生产线程中的异常传递给消费方"""
+    
+    def __init__(self, error: BaseException):
+        self.error = error
+
+class ParallelSplitter:
+    """进程池并行分割
+    
+    文档批次按提交顺序分发到进程池，结果按原顺序放入有界队列，
+    调用方边读取边嵌入写入，分割与嵌入在多核机器上重叠进行；
+    队列满时暂停提交，内存占用不随输入规模增长。
+    """
+    
+    def __init__(self, chunk_size: int, chunk_overlap: int, workers: int, queue_size: int = 8):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.workers = workers
+        self.queue_size = queue_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """首次使用时创建进程池；使用spawn避免复制已加载模型的线程状态"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.chunk_size, self.chunk_overlap)
+                )
+                logger.info(f"并行分割进程池已启动，进程数: {self.workers}")
+            return self._pool
+    
+    def iter_split(self, batches: Iterable[Tuple[List[Document], Any]]) -> Iterator[Tuple[List[Document], Any]]:
+        """按输入顺序产出(片段列表, 附带信息)，附带信息原样透传"""
+        pool = self._get_pool()
+        results = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        
+        def put(item) -> bool:
+            # 消费方提前退出时停止阻塞，避免生产线程泄漏
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce():
+            try:
+                in_flight = deque()
+                for documents, tag in batches:
+                    in_flight.append((pool.submit(_split_documents, documents), tag))
+                    # 同时在途的批次数限制为进程数的两倍，按提交顺序取结果
+                    if len(in_flight) >= self.workers * 2:
+                        future, done_tag = in_flight.popleft()
+                        if not put((future.result(), done_tag)):
+                            return
+                while in_flight:
+                    future, done_tag = in_flight.popleft()
+                    if not put((future.result(), done_tag)):
+                        return
+                put(_DONE)
+            except BaseException as e:
+                put(_Failure(e))
+                
+        producer = threading.Thread(target=produce, name="parallel-splitter", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+    
+    def close(self) -> None:
+        """关闭进程池"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
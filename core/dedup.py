@@ -0,0 +1,205 @@
+"""
+入库去重模块
+"""
+import hashlib
+import math
+import sqlite3
+import struct
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Set, Tuple
+
+from core.record_log import write_atomic
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 布隆过滤器文件头：位数、哈希函数个数、已加入的键数
+_BLOOM_HEADER = struct.Struct("<QIQ")
+_SQLITE_BATCH = 500
+
+class BloomFilter:
+    """布隆过滤器：不存在的键可以确定排除，存在的键需要精确确认"""
+    
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.capacity = capacity
+        self.count = 0
+        self.bits = bytearray((self.num_bits + 7) // 8)
+    
+    def _positions(self, key: str):
+        """双重哈希生成k个位置"""
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+    
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+    
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+    
+    def to_bytes(self) -> bytes:
+        return _BLOOM_HEADER.pack(self.num_bits, self.num_hashes, self.count) + bytes(self.bits)
+    
+    @classmethod
+    def from_bytes(cls, data: bytes, error_rate: float) -> "BloomFilter":
+        num_bits, num_hashes, count = _BLOOM_HEADER.unpack_from(data)
+        bloom = cls.__new__(cls)
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        # 由位数和误判率反推设计容量
+        bloom.capacity = max(1, int(num_bits * (math.log(2) ** 2) / -math.log(error_rate)))
+        bloom.count = count
+        bloom.bits = bytearray(data[_BLOOM_HEADER.size:])
+        return bloom
+
+class SeenStore:
+    """已入库集合：布隆过滤器快速排除 + SQLite精确存储
+    
+    键为内容哈希（"c:"前缀）或规范化URL（"u:"前缀），每个键关联产生它的片段ID，
+    删除片段时只删除精确存储中的记录；布隆过滤器的残留位由精确存储兜底。
+    """
+    
+    def __init__(self, directory: Path, capacity: int = 1000000, error_rate: float = 0.001,
+                 flush_interval: int = 10000):
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.flush_interval = flush_interval
+        self.bloom = None
+        self._bloom_keys = 0
+        self.bloom_rejects = 0
+        self.exact_checks = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._initialize()
+    
+    @property
+    def bloom_path(self) -> Path:
+        return self.directory / "seen.bloom"
+    
+    def _initialize(self):
+        """打开精确存储并加载布隆过滤器"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.directory / "seen.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen (key TEXT NOT NULL, doc_id TEXT NOT NULL, "
+            "PRIMARY KEY (key, doc_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_doc ON seen(doc_id)")
+        # 累计写入次数，与布隆过滤器文件头中的计数比较，判断过滤器是否落后
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('adds', 0)")
+        self._conn.commit()
+        
+        if self.bloom_path.exists():
+            self.bloom = BloomFilter.from_bytes(self.bloom_path.read_bytes(), self.error_rate)
+            self.capacity = max(self.capacity, self.bloom.capacity)
+            self._bloom_keys = self._row_count()
+        # 布隆过滤器落后于精确存储（如进程崩溃）时必须重建，否则会漏判
+        if self.bloom is None or self.bloom.count < self._total_adds():
+            self._rebuild_bloom(max(self.capacity, self._row_count() * 2))
+    
+    def _total_adds(self) -> int:
+        """精确存储的累计写入次数"""
+        return self._conn.execute("SELECT value FROM meta WHERE name = 'adds'").fetchone()[0]
+    
+    def _row_count(self) -> int:
+        """精确存储的记录数"""
+        return self._conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT key) FROM seen").fetchone()[0]
+    
+    def _rebuild_bloom(self, capacity: int):
+        """从精确存储重建布隆过滤器"""
+        self.capacity = capacity
+        self.bloom = BloomFilter(capacity, self.error_rate)
+        self._bloom_keys = 0
+        for (key,) in self._conn.execute("SELECT key FROM seen"):
+            self.bloom.add(key)
+            self._bloom_keys += 1
+        # 计数与累计写入次数对齐，以便下次启动时判断是否落后
+        self.bloom.count = self._total_adds()
+        write_atomic(self.bloom_path, self.bloom.to_bytes())
+        self._unsaved = 0
+        logger.info(f"去重布隆过滤器已重建，容量: {capacity}")
+    
+    def contains_many(self, keys: Iterable[str]) -> Set[str]:
+        """返回已入库的键"""
+        candidates = []
+        with self._lock:
+            for key in set(keys):
+                if key in self.bloom:
+                    candidates.append(key)
+                else:
+                    self.bloom_rejects += 1
+                    
+            found = set()
+            self.exact_checks += len(candidates)
+            for start in range(0, len(candidates), _SQLITE_BATCH):
+                batch = candidates[start:start + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT key FROM seen WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(key for (key,) in rows)
+        return found
+    
+    def add_many(self, entries: List[Tuple[str, str]]) -> None:
+        """记录(键, 片段ID)"""
+        if not entries:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO seen (key, doc_id) VALUES (?, ?)", entries)
+            self._conn.execute("UPDATE meta SET value = value + ? WHERE name = 'adds'", (len(entries),))
+            self._conn.commit()
+            for key, _ in entries:
+                self.bloom.add(key)
+            self._unsaved += len(entries)
+            self._bloom_keys += len(entries)
+            
+            # 超出设计容量后误判率上升，扩容重建
+            if self._bloom_keys > self.capacity:
+                self._rebuild_bloom(max(self.capacity, self._bloom_keys) * 2)
+            elif self._unsaved >= self.flush_interval:
+                write_atomic(self.bloom_path, self.bloom.to_bytes())
+                self._unsaved = 0
+    
+    def remove_doc_ids(self, doc_ids: Iterable[str]) -> None:
+        """删除片段对应的记录"""
+        ids = list(doc_ids)
+        with self._lock:
+            for start in range(0, len(ids), _SQLITE_BATCH):
+                batch = ids[start:start + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM seen WHERE doc_id IN ({placeholders})", batch)
+            self._conn.commit()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取去重统计信息"""
+        return {
+            "bloom_bits": self.bloom.num_bits,
+            "bloom_hashes": self.bloom.num_hashes,
+            "bloom_capacity": self.capacity,
+            "bloom_rejects": self.bloom_rejects,
+            "exact_checks": self.exact_checks
+        }
+    
+    def close(self) -> None:
+        """保存布隆过滤器并关闭精确存储"""
+        with self._lock:
+            if self._conn is not None:
+                write_atomic(self.bloom_path, self.bloom.to_bytes())
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,172 @@
+"""
+嵌入向量缓存模块
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Any
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+from utils.text import content_hash
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# SQLite单条语句的参数上限是999，批量查询时按此分片
+_SQLITE_BATCH = 500
+
+class EmbeddingCacheStore:
+    """基于SQLite的磁盘嵌入缓存，按(模型名, 规范化文本哈希)寻址，LRU淘汰"""
+    
+    def __init__(self, path: Path, max_entries: int = 200000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._count = 0
+        self._initialize()
+    
+    def _initialize(self):
+        """初始化缓存数据库"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, "
+            "vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"嵌入缓存已加载: {self.path}，共{self._count}条")
+    
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """批量读取缓存，命中的条目会刷新访问时间"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), _SQLITE_BATCH):
+                batch = unique_keys[start:start + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                    
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+                
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+    
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """批量写入缓存，超过容量时按最近最少使用淘汰"""
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, len(vector), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, dim, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._count += self._conn.total_changes - before
+            
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                self.evictions += overflow
+            self._conn.commit()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+    
+    def close(self) -> None:
+        """关闭缓存数据库"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class CachedEmbeddings(Embeddings):
+    """带磁盘缓存的嵌入模型包装器，Chroma和FAISS后端共用"""
+    
+    def __init__(self, embeddings: Embeddings, model_name: str, store: EmbeddingCacheStore):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+    
+    def _key(self, text: str) -> str:
+        """计算缓存键"""
+        return content_hash(text, namespace=self.model_name)
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """嵌入文档，只对缓存未命中的文本调用底层模型"""
+        keys = [self._key(text) for text in texts]
+        cached = self.store.get_many(keys)
+        
+        # 同一批次内的重复文本只计算一次
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+                
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(computed)
+            cached.update(computed)
+            logger.debug(f"嵌入缓存未命中{len(missing)}条，命中{len(texts) - len(missing)}条")
+            
+        return [list(cached[key]) for key in keys]
+    
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本（查询不写入磁盘缓存）"""
+        return self.embeddings.embed_query(text)
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """一次前向计算批量嵌入多条查询（查询不写入磁盘缓存）"""
+        return self.embeddings.embed_documents(texts)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        stats = self.store.get_stats()
+        stats["model_name"] = self.model_name
+        return stats
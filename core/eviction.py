@@ -0,0 +1,85 @@
+"""
+过期片段淘汰模块
+"""
+import threading
+from typing import List, Dict, Any, Optional, Set, Callable
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+INGESTED_AT = "ingested_at"
+
+def find_expired_ids(select_ids: Callable[[Dict[str, Any]], List[str]], now: float,
+                     ttl_by_type: Dict[str, float], ttl_by_category: Dict[str, float],
+                     pinned_types: List[str]) -> Set[str]:
+    """按TTL规则找出过期片段的ID
+    
+    select_ids按元数据过滤条件返回片段ID。category规则优先于type规则：
+    有category规则的片段只按category的TTL判断；置顶type的片段永不淘汰。
+    没有ingested_at时间戳的片段（旧数据）不会被匹配。
+    """
+    expired = set()
+    for category, ttl in ttl_by_category.items():
+        expired.update(select_ids({"category": category, INGESTED_AT: {"$lt": now - ttl}}))
+        
+    by_type = set()
+    for doc_type, ttl in ttl_by_type.items():
+        by_type.update(select_ids({"type": doc_type, INGESTED_AT: {"$lt": now - ttl}}))
+    if by_type and ttl_by_category:
+        by_type.difference_update(select_ids({"category": {"$in": list(ttl_by_category)}}))
+    expired.update(by_type)
+    
+    if expired and pinned_types:
+        expired.difference_update(select_ids({"type": {"$in": list(pinned_types)}}))
+    return expired
+
+class EvictionWorker:
+    """后台定期淘汰过期片段并压缩索引"""
+    
+    def __init__(self, vector_store, interval: float):
+        self.vector_store = vector_store
+        self.interval = interval
+        self.runs = 0
+        self.total_evicted = 0
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def run_once(self) -> Dict[str, Any]:
+        """执行一次淘汰，返回本次报告"""
+        report = self.vector_store.evict_expired()
+        self.runs += 1
+        self.total_evicted += report["evicted"]
+        self.last_report = report
+        return report
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"淘汰过期片段失败: {e}")
+    
+    def start(self) -> None:
+        """启动后台线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="ttl-eviction", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        """停止后台线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取淘汰统计信息"""
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "total_evicted": self.total_evicted,
+            "last_run": self.last_report
+        }
@@ -0,0 +1,240 @@
+"""
+FAISS索引选择与训练模块
+"""
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from config.settings import settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_FLAT = "flat"
+INDEX_IVF_FLAT = "ivf_flat"
+INDEX_HNSW = "hnsw"
+INDEX_IVF_PQ = "ivf_pq"
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF_FLAT, INDEX_HNSW, INDEX_IVF_PQ)
+
+DTYPE_FLOAT32 = "float32"
+DTYPE_FLOAT16 = "float16"
+DTYPE_INT8 = "int8"
+_SQ_TYPES = {
+    DTYPE_FLOAT16: faiss.ScalarQuantizer.QT_fp16,
+    DTYPE_INT8: faiss.ScalarQuantizer.QT_8bit
+}
+
+# FAISS建议每个聚类中心至少有39个训练样本
+_MIN_POINTS_PER_CENTROID = 39
+_MAX_TRAIN_POINTS_PER_CENTROID = 256
+
+def choose_index_type(ntotal: int) -> str:
+    """根据向量数量和配置阈值选择索引类型"""
+    if settings.FAISS_INDEX_TYPE != "auto":
+        return settings.FAISS_INDEX_TYPE
+    if ntotal >= settings.FAISS_PQ_THRESHOLD:
+        return INDEX_IVF_PQ
+    if ntotal >= settings.FAISS_ANN_THRESHOLD:
+        return settings.FAISS_ANN_TYPE
+    return INDEX_FLAT
+
+def choose_dtype(ntotal: int) -> str:
+    """选择向量存储精度；int8需要足够样本训练量化范围，样本不足时先用float32"""
+    dtype = settings.VECTOR_STORAGE_DTYPE
+    if dtype == DTYPE_INT8 and ntotal < settings.VECTOR_INT8_MIN_TRAIN:
+        return DTYPE_FLOAT32
+    return dtype
+
+def index_type_of(index) -> str:
+    """识别现有索引的类型（标量量化的变体归入对应的基础类型）"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return INDEX_IVF_PQ
+    if isinstance(index, faiss.IndexIVF):
+        return INDEX_IVF_FLAT
+    if isinstance(index, faiss.IndexHNSW):
+        return INDEX_HNSW
+    return INDEX_FLAT
+
+def index_dtype_of(index) -> Optional[str]:
+    """识别现有索引的向量存储精度；IVF-PQ为乘积量化，返回None"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return None
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        for dtype, qtype in _SQ_TYPES.items():
+            if index.sq.qtype == qtype:
+                return dtype
+    return DTYPE_FLOAT32
+
+def is_compressed(index) -> bool:
+    """索引中的向量是否为有损压缩存储"""
+    return index_dtype_of(index) != DTYPE_FLOAT32
+
+def suggested_nlist(ntotal: int) -> int:
+    """IVF聚类中心数：配置值优先，否则取4*sqrt(n)，并保证训练样本充足"""
+    if settings.FAISS_NLIST > 0:
+        nlist = settings.FAISS_NLIST
+    else:
+        nlist = int(4 * math.sqrt(max(ntotal, 1)))
+    return max(1, min(nlist, ntotal // _MIN_POINTS_PER_CENTROID))
+
+def _pq_subquantizers(dimension: int) -> int:
+    """PQ子量化器数量必须整除向量维度，取不超过配置值的最大约数"""
+    m = min(settings.FAISS_PQ_M, dimension)
+    while dimension % m:
+        m -= 1
+    return m
+
+def needs_rebuild(index) -> bool:
+    """索引类型与当前规模不匹配，或IVF聚类数已明显偏小时需要重建"""
+    ntotal = index.ntotal
+    desired = choose_index_type(ntotal)
+    if desired != index_type_of(index):
+        return True
+    current_dtype = index_dtype_of(index)
+    if current_dtype is not None and current_dtype != choose_dtype(ntotal):
+        return True
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        return suggested_nlist(ntotal) >= 2 * index.nlist
+    return False
+
+def ensure_direct_map(index) -> None:
+    """为IVF索引建立位置到倒排表条目的直接映射，按位置取回向量时需要
+    
+    会修改索引，只能在索引对外可见之前或持有写锁时调用；之后顺序追加的向量会自动维护映射。
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.NoMap:
+        index.make_direct_map()
+
+def _require_direct_map(index) -> None:
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.type == faiss.DirectMap.NoMap:
+        raise RuntimeError("IVF索引尚未建立直接映射，需先调用ensure_direct_map")
+
+def reconstruct_all(index) -> np.ndarray:
+    """取回索引中的全部向量（压缩存储的索引为有损重建）"""
+    index = faiss.downcast_index(index)
+    _require_direct_map(index)
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+def build_index(vectors: np.ndarray, index_type: str, metric: int = faiss.METRIC_L2,
+                dtype: Optional[str] = None):
+    """构建并训练指定类型和存储精度的索引，向量按原顺序加入以保持位置不变"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, dimension = vectors.shape
+    dtype = dtype or choose_dtype(ntotal)
+    qtype = _SQ_TYPES.get(dtype)
+    
+    if index_type == INDEX_HNSW:
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dimension, settings.FAISS_HNSW_M, metric)
+        else:
+            index = faiss.IndexHNSWSQ(dimension, qtype, settings.FAISS_HNSW_M, metric)
+            _train(index, vectors)
+        index.hnsw.efConstruction = settings.FAISS_EF_CONSTRUCTION
+        index.hnsw.efSearch = settings.FAISS_EF_SEARCH
+    elif index_type in (INDEX_IVF_FLAT, INDEX_IVF_PQ):
+        nlist = suggested_nlist(ntotal)
+        quantizer = faiss.IndexFlat(dimension, metric)
+        if index_type == INDEX_IVF_PQ:
+            # 乘积量化本身已是紧凑编码，不再叠加标量量化
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_subquantizers(dimension), 8, metric)
+        elif qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, qtype, metric)
+        index.nprobe = settings.FAISS_NPROBE
+        _train(index, vectors, nlist)
+    elif qtype is not None:
+        index = faiss.IndexScalarQuantizer(dimension, qtype, metric)
+        _train(index, vectors)
+    else:
+        index = faiss.IndexFlat(dimension, metric)
+        
+    if ntotal:
+        index.add(vectors)
+    ensure_direct_map(index)
+    logger.info(f"FAISS索引构建完成: {index_type}/{dtype}，向量数: {ntotal}")
+    return index
+
+def _train(index, vectors: np.ndarray, nlist: int = 1) -> None:
+    """从全部向量中均匀抽样训练"""
+    if index.is_trained:
+        return
+    sample_size = min(len(vectors), max(nlist * _MAX_TRAIN_POINTS_PER_CENTROID, 65536))
+    if sample_size < len(vectors):
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    else:
+        sample = vectors
+    index.train(sample)
+
+def search_parameters(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      selection: Optional[np.ndarray] = None):
+    """构建单次查询的搜索参数，不修改共享索引的状态；selection为允许返回的向量位置"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or settings.FAISS_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or settings.FAISS_EF_SEARCH
+    elif selection is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+        
+    if selection is not None:
+        bitmap = np.zeros(index.ntotal, dtype=bool)
+        bitmap[selection] = True
+        selector = faiss.IDSelectorBitmap(np.packbits(bitmap, bitorder="little"))
+        params.sel = selector
+        # SWIG只保存指针，需要持有Python对象防止被回收
+        params.referenced_objects = [selector]
+    return params
+
+def subset_search(index, queries: np.ndarray, positions: np.ndarray, k: int):
+    """在候选位置子集上精确计算距离，返回与index.search相同格式的(距离, 位置)
+
+    过滤后候选很少时，直接对子集暴力计算比带过滤的ANN搜索更快，且不会因图/聚类剪枝漏召回。
+    """
+    index = faiss.downcast_index(index)
+    _require_direct_map(index)
+    vectors = np.vstack([index.reconstruct(int(position)) for position in positions])
+    k = min(k, len(positions))
+    
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        scores = queries @ vectors.T
+        ranking = -scores
+    else:
+        scores = (
+            np.sum(queries ** 2, axis=1, keepdims=True)
+            - 2 * queries @ vectors.T
+            + np.sum(vectors ** 2, axis=1)
+        )
+        ranking = scores
+    top = np.argpartition(ranking, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(top, np.argsort(np.take_along_axis(ranking, top, axis=1), axis=1), axis=1)
+    return np.take_along_axis(scores, order, axis=1), positions[order]
+
+def rescore(query_vectors: np.ndarray, candidate_vectors: np.ndarray, k: int,
+            metric: int = faiss.METRIC_L2):
+    """用float32原始向量对候选重新计算精确分数，返回(排序下标, 分数)"""
+    queries = np.asarray(query_vectors, dtype=np.float32)
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        scores = candidates @ queries
+        order = np.argsort(-scores)[:k]
+    else:
+        # 与IndexFlatL2一致，返回平方L2距离
+        scores = np.sum((candidates - queries) ** 2, axis=1)
+        order = np.argsort(scores)[:k]
+    return order, scores[order]
@@ -0,0 +1,181 @@
+"""
+FAISS内存映射服务模块
+"""
+import json
+import mmap
+import os
+import shutil
+from collections.abc import Mapping
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Union, Optional
+
+import faiss
+import numpy as np
+from langchain.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+
+from core.faiss_index import ensure_direct_map
+from core.raw_vectors import write_raw_vectors
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.jsonl"
+OFFSETS_FILE = "docs.offsets.npy"
+MANIFEST_FILE = "manifest.json"
+SERVING_RAW_DIR = "raw"
+
+class MmapDocstore(Docstore):
+    """只读文档存储：JSONL数据文件 + 偏移量数组，均通过内存映射按需读取"""
+    
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._offsets = np.load(str(self.directory / OFFSETS_FILE), mmap_mode="r")
+        self._file = open(self.directory / DOCS_FILE, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # 空文件无法映射
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    
+    def __len__(self) -> int:
+        return max(len(self._offsets) - 1, 0)
+    
+    def record(self, position: int) -> Dict[str, Any]:
+        """按位置读取原始记录"""
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return json.loads(self._data[start:end])
+    
+    def search(self, search: Union[str, int]) -> Union[str, Document]:
+        """按位置查找文档（与PositionalIds配合使用）"""
+        try:
+            position = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        if position < 0 or position >= len(self):
+            return f"ID {search} not found."
+        item = self.record(position)
+        return Document(page_content=item["page_content"], metadata=item["metadata"])
+    
+    def close(self) -> None:
+        """释放内存映射"""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+class PositionalIds(Mapping):
+    """轻量的位置->文档ID映射，避免为每个向量构建Python字典"""
+    
+    def __init__(self, size: int):
+        self._size = size
+    
+    def __getitem__(self, position: int) -> int:
+        if 0 <= position < self._size:
+            return position
+        raise KeyError(position)
+    
+    def __iter__(self):
+        return iter(range(self._size))
+    
+    def __len__(self) -> int:
+        return self._size
+
+def to_mmap_layout(index):
+    """转换为可内存映射的索引布局
+    
+    FAISS只支持映射IVF的倒排表，平坦索引会被转换为单个倒排表的IVF
+    （标量量化索引保持原精度），搜索时扫描全部向量，结果与平坦索引一致。
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        return index
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        qtype = index.sq.qtype
+    elif isinstance(index, faiss.IndexFlat):
+        qtype = None
+    else:
+        logger.warning(f"索引类型{type(index).__name__}不支持内存映射，将按原样导出")
+        return index
+    
+    quantizer = faiss.IndexFlat(index.d, index.metric_type)
+    quantizer.add(np.zeros((1, index.d), dtype=np.float32))
+    if qtype is None:
+        ivf = faiss.IndexIVFFlat(quantizer, index.d, 1, index.metric_type)
+    else:
+        ivf = faiss.IndexIVFScalarQuantizer(quantizer, index.d, 1, qtype, index.metric_type)
+        ivf.train(index.reconstruct_n(0, min(index.ntotal, 65536)))
+    batch = 65536
+    for start in range(0, index.ntotal, batch):
+        count = min(batch, index.ntotal - start)
+        ivf.add(index.reconstruct_n(start, count))
+    return ivf
+
+def export_serving_index(index, documents: List[Tuple[str, Document]], directory: Path,
+                         raw_vectors: Optional[np.ndarray] = None, model: Optional[str] = None) -> None:
+    """导出只读服务索引；documents和raw_vectors（供压缩索引精排的float32向量）需按索引位置排序"""
+    directory = Path(directory)
+    tmp_dir = directory.with_name(directory.name + ".tmp")
+    old_dir = directory.with_name(directory.name + ".old")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    
+    faiss.write_index(to_mmap_layout(index), str(tmp_dir / INDEX_FILE))
+    
+    offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+    with open(tmp_dir / DOCS_FILE, "wb") as f:
+        for position, (doc_id, doc) in enumerate(documents):
+            line = json.dumps(
+                {"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata},
+                ensure_ascii=False,
+                default=str
+            ).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets[position + 1] = offsets[position] + len(line)
+    np.save(str(tmp_dir / OFFSETS_FILE), offsets)
+    
+    if raw_vectors is not None:
+        # 服务索引的文档ID即位置
+        batch = 65536
+        write_raw_vectors(
+            tmp_dir / SERVING_RAW_DIR,
+            [str(position) for position in range(len(raw_vectors))],
+            (raw_vectors[start:start + batch] for start in range(0, len(raw_vectors), batch)),
+            model
+        )
+    
+    (tmp_dir / MANIFEST_FILE).write_text(
+        json.dumps({"ntotal": int(index.ntotal), "dimension": int(index.d)}),
+        encoding="utf-8"
+    )
+    
+    # 已映射旧文件的进程不受影响：被替换的文件在其关闭前仍然有效
+    if directory.exists():
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logger.info(f"只读服务索引导出完成: {directory}，共{len(documents)}个向量")
+
+def read_index_mmap(path: Path):
+    """以内存映射方式读取索引，不支持时退回普通读取"""
+    try:
+        return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        logger.warning(f"索引不支持内存映射，改为完整加载: {e}")
+        return faiss.read_index(str(path))
+
+def load_serving_index(directory: Path, embeddings):
+    """加载只读服务索引，返回LangChain FAISS对象"""
+    directory = Path(directory)
+    index = read_index_mmap(directory / INDEX_FILE)
+    # 直接映射只读取倒排表的ID，建在进程内存中，映射的文件保持只读
+    ensure_direct_map(index)
+    docstore = MmapDocstore(directory)
+    return FAISS(embeddings, index, docstore, PositionalIds(len(docstore)))
+
+def has_serving_index(directory: Path) -> bool:
+    """目录中是否存在完整的只读服务索引"""
+    directory = Path(directory)
+    return all((directory / name).exists() for name in (INDEX_FILE, DOCS_FILE, OFFSETS_FILE))
@@ -0,0 +1,250 @@
+"""
+FAISS增量持久化模块
+"""
+import json
+import os
+import pickle
+import shutil
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable
+
+import faiss
+import numpy as np
+
+from core.record_log import append_record, read_records
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_DIR = "segments"
+
+class FaissSegmentLog:
+    """FAISS增量持久化：基础索引 + 只追加的增量段
+    
+    写入时只把本批次的向量和文档追加到当前增量段，耗时与批次大小成正比；
+    后台压缩把内存中的完整索引写成新的基础索引，并删除已合并的增量段；
+    加载时先读基础索引，再按顺序重放未合并的增量段。
+    """
+    
+    def __init__(self, directory: Path, compact_threshold: int = 10000,
+                 on_compacted: Optional[Callable[[], None]] = None):
+        self.directory = Path(directory)
+        self.on_compacted = on_compacted
+        self.segment_dir = self.directory / SEGMENT_DIR
+        self.compact_threshold = compact_threshold
+        self.base_name = None
+        self.compacted_through = 0
+        self.active_segment = 1
+        self.pending_vectors = 0
+        self._file = None
+        self._compacting = threading.Lock()
+        self._compact_thread = None
+        # 后台压缩进行中又收到的请求，当前压缩结束后再执行一次（强制请求不会被丢弃）
+        self._schedule_lock = threading.Lock()
+        self._rerun = None
+        self._load_manifest()
+    
+    def _load_manifest(self):
+        """读取清单文件，确定基础索引和下一个增量段编号"""
+        manifest_path = self.directory / MANIFEST_FILE
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            self.base_name = manifest.get("base")
+            self.compacted_through = manifest.get("compacted_through", 0)
+            
+        segments = self._list_segments()
+        last_segment = segments[-1] if segments else self.compacted_through
+        self.active_segment = max(last_segment, self.compacted_through) + 1
+    
+    def _list_segments(self) -> List[int]:
+        """列出磁盘上的增量段编号（升序）"""
+        if not self.segment_dir.exists():
+            return []
+        numbers = []
+        for path in self.segment_dir.glob("segment-*.log"):
+            try:
+                numbers.append(int(path.stem.split("-")[1]))
+            except (IndexError, ValueError):
+                logger.warning(f"忽略无法识别的增量段文件: {path}")
+        return sorted(numbers)
+    
+    def _segment_path(self, number: int) -> Path:
+        """增量段文件路径"""
+        return self.segment_dir / f"segment-{number:06d}.log"
+    
+    def base_path(self) -> Optional[Path]:
+        """基础索引目录；兼容旧版直接保存在根目录的索引"""
+        if self.base_name and (self.directory / self.base_name / "index.faiss").exists():
+            return self.directory / self.base_name
+        if (self.directory / "index.faiss").exists():
+            return self.directory
+        return None
+    
+    def append(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]],
+               vectors: List[List[float]]) -> None:
+        """追加一个批次到当前增量段（调用方需持有写锁）"""
+        if self._file is None:
+            self.segment_dir.mkdir(parents=True, exist_ok=True)
+            self._file = open(self._segment_path(self.active_segment), "ab")
+        append_record(self._file, {
+            "ids": ids,
+            "texts": texts,
+            "metadatas": metadatas,
+            "vectors": np.asarray(vectors, dtype=np.float32)
+        })
+        self.pending_vectors += len(ids)
+    
+    def append_deletes(self, ids: List[str]) -> None:
+        """追加一条删除记录，向量仍留在索引中，重放时只从文档存储移除（调用方需持有写锁）"""
+        if self._file is None:
+            self.segment_dir.mkdir(parents=True, exist_ok=True)
+            self._file = open(self._segment_path(self.active_segment), "ab")
+        append_record(self._file, {"deleted": ids})
+    
+    def replay(self, vector_db) -> int:
+        """把未合并的增量段重放到已加载的索引中，返回重放的向量数"""
+        replayed = 0
+        for number in self._list_segments():
+            if number <= self.compacted_through:
+                continue
+            for record in read_records(self._segment_path(number)):
+                if "deleted" in record:
+                    vector_db.docstore.delete(record["deleted"])
+                    continue
+                vector_db.add_embeddings(
+                    list(zip(record["texts"], record["vectors"].tolist())),
+                    metadatas=record["metadatas"],
+                    ids=record["ids"]
+                )
+                replayed += len(record["ids"])
+        self.pending_vectors = replayed
+        if replayed:
+            logger.info(f"重放FAISS增量段完成，共{replayed}个向量")
+        return replayed
+    
+    def should_compact(self) -> bool:
+        """未合并的向量数是否达到压缩阈值"""
+        return self.pending_vectors >= self.compact_threshold
+    
+    def compact_in_background(self, vector_db, lock, force: bool = False) -> None:
+        """在后台线程中压缩，不阻塞写入；已有压缩在进行时排队，结束后再执行一次"""
+        with self._schedule_lock:
+            if self._compact_thread is not None:
+                pending_force = self._rerun[2] if self._rerun is not None else False
+                self._rerun = (vector_db, lock, force or pending_force)
+                return
+            self._compact_thread = threading.Thread(
+                target=self._compact_loop,
+                args=(vector_db, lock, force),
+                name="faiss-compaction",
+                daemon=True
+            )
+            self._compact_thread.start()
+    
+    def _compact_loop(self, vector_db, lock, force: bool) -> None:
+        """后台压缩线程：执行压缩，直到没有排队的请求"""
+        while True:
+            self.compact(vector_db, lock, force)
+            with self._schedule_lock:
+                if self._rerun is None:
+                    self._compact_thread = None
+                    return
+                vector_db, lock, force = self._rerun
+                self._rerun = None
+    
+    def compact(self, vector_db, lock, force: bool = False) -> bool:
+        """把内存中的完整索引写成新的基础索引，并删除已合并的增量段
+        
+        非强制压缩遇到进行中的压缩时直接返回；强制压缩等待其结束后执行。
+        """
+        from langchain.docstore.in_memory import InMemoryDocstore
+        
+        if not self._compacting.acquire(blocking=force):
+            logger.info("FAISS压缩正在进行，跳过本次请求")
+            return False
+        try:
+            # 持锁期间只复制索引和文档映射并切换增量段，之后的写入进入新段；
+            # 序列化和写盘在锁外进行
+            with lock:
+                if not force and self.pending_vectors == 0:
+                    return False
+                sealed = self.active_segment - 1 if self._file is None else self.active_segment
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                    self.active_segment += 1
+                index = faiss.clone_index(vector_db.index)
+                docstore = InMemoryDocstore(dict(vector_db.docstore._dict))
+                index_to_docstore_id = dict(vector_db.index_to_docstore_id)
+                self.pending_vectors = 0
+                
+            index_bytes = faiss.serialize_index(index)
+            meta_bytes = pickle.dumps((docstore, index_to_docstore_id), protocol=pickle.HIGHEST_PROTOCOL)
+            del index
+            
+            # 写入新的基础索引目录，格式与FAISS.save_local一致
+            base_name = f"base-{sealed:06d}"
+            base_dir = self.directory / base_name
+            tmp_dir = self.directory / f"{base_name}.tmp"
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir)
+            tmp_dir.mkdir(parents=True)
+            index_bytes.tofile(str(tmp_dir / "index.faiss"))
+            with open(tmp_dir / "index.pkl", "wb") as f:
+                f.write(meta_bytes)
+            if base_dir.exists():
+                shutil.rmtree(base_dir)
+            os.replace(tmp_dir, base_dir)
+            
+            # 原子更新清单
+            self._write_manifest(base_name, sealed)
+            self._cleanup(base_name, sealed)
+            logger.info(f"FAISS压缩完成，基础索引: {base_name}")
+            if self.on_compacted is not None:
+                self.on_compacted()
+            return True
+            
+        except Exception as e:
+            logger.error(f"FAISS压缩失败: {e}")
+            return False
+        finally:
+            self._compacting.release()
+    
+    def _write_manifest(self, base_name: str, compacted_through: int):
+        """原子写入清单文件"""
+        manifest_path = self.directory / MANIFEST_FILE
+        tmp_path = self.directory / f"{MANIFEST_FILE}.tmp"
+        tmp_path.write_text(
+            json.dumps({"base": base_name, "compacted_through": compacted_through}),
+            encoding="utf-8"
+        )
+        os.replace(tmp_path, manifest_path)
+        self.base_name = base_name
+        self.compacted_through = compacted_through
+    
+    def _cleanup(self, base_name: str, compacted_through: int):
+        """删除旧的基础索引和已合并的增量段"""
+        for number in self._list_segments():
+            if number <= compacted_through:
+                self._segment_path(number).unlink(missing_ok=True)
+        for path in self.directory.glob("base-*"):
+            if path.is_dir() and path.name != base_name:
+                shutil.rmtree(path, ignore_errors=True)
+        # 旧版根目录中的索引文件已被新的基础索引取代
+        for legacy in ("index.faiss", "index.pkl"):
+            (self.directory / legacy).unlink(missing_ok=True)
+    
+    def wait(self) -> None:
+        """等待进行中的后台压缩（含排队的请求）结束"""
+        thread = self._compact_thread
+        if thread is not None and thread.is_alive():
+            thread.join()
+    
+    def close(self) -> None:
+        """关闭当前增量段文件"""
+        self.wait()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
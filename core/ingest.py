@@ -0,0 +1,261 @@
+"""
+流式批量入库模块
+"""
+import hashlib
+import itertools
+import json
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Union
+
+from langchain.schema import Document
+
+from config.settings import settings
+from core.record_log import write_atomic
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class JsonlSource:
+    """JSONL数据源：每行一个JSON对象，正文字段之外的字段并入元数据
+    
+    断点位置为已读取行之后的字节偏移，恢复时直接定位，无需重新解析前面的行。
+    """
+    
+    def __init__(self, path: Union[str, Path], text_field: str = "content", encoding: str = "utf-8"):
+        self.path = Path(path)
+        self.text_field = text_field
+        self.encoding = encoding
+    
+    @property
+    def name(self) -> str:
+        return f"jsonl:{self.path.resolve()}"
+    
+    def read(self, position: int = 0) -> Iterator[Tuple[Document, int]]:
+        """从指定字节偏移开始逐行读取，产出(文档, 下一行的偏移)"""
+        with open(self.path, "rb") as f:
+            f.seek(position)
+            line_number = 0
+            for line in iter(f.readline, b""):
+                line_number += 1
+                position += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line.decode(self.encoding))
+                    text = record.pop(self.text_field)
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"跳过无法解析的记录（起始偏移后第{line_number}行）: {e}")
+                    continue
+                metadata = record.pop("metadata", None) or {}
+                metadata.update(record)
+                yield Document(page_content=str(text), metadata=metadata), position
+
+class TextDirectorySource:
+    """文本目录数据源：每个文件一篇文档，按路径排序保证顺序稳定
+    
+    断点位置为已读取的文件数。
+    """
+    
+    def __init__(self, directory: Union[str, Path], pattern: str = "**/*.txt", encoding: str = "utf-8"):
+        self.directory = Path(directory)
+        self.pattern = pattern
+        self.encoding = encoding
+    
+    @property
+    def name(self) -> str:
+        return f"dir:{self.directory.resolve()}:{self.pattern}"
+    
+    def read(self, position: int = 0) -> Iterator[Tuple[Document, int]]:
+        """从第position个文件开始读取，产出(文档, 已读取的文件数)"""
+        paths = sorted(path for path in self.directory.glob(self.pattern) if path.is_file())
+        for number, path in enumerate(paths[position:], start=position + 1):
+            try:
+                text = path.read_text(encoding=self.encoding)
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning(f"跳过无法读取的文件 {path}: {e}")
+                continue
+            metadata = {
+                "source": str(path.relative_to(self.directory)),
+                "type": "ingest"
+            }
+            yield Document(page_content=text, metadata=metadata), number
+
+class IterableSource:
+    """迭代器/生成器数据源，元素为Document或字符串
+    
+    断点位置为已消费的元素数；恢复时会重新迭代并跳过已处理的元素，
+    因此要求同一name对应的迭代顺序稳定。未指定name时不记录断点。
+    """
+    
+    def __init__(self, documents: Iterable[Union[Document, str]], name: Optional[str] = None):
+        self.documents = documents
+        self._name = name
+    
+    @property
+    def name(self) -> Optional[str]:
+        return f"iterable:{self._name}" if self._name else None
+    
+    def read(self, position: int = 0) -> Iterator[Tuple[Document, int]]:
+        """跳过前position个元素后读取，产出(文档, 已消费的元素数)"""
+        for number, item in enumerate(itertools.islice(self.documents, position, None), start=position + 1):
+            if isinstance(item, str):
+                item = Document(page_content=item, metadata={"type": "ingest"})
+            yield item, number
+
+class StreamingIngestor:
+    """流式批量入库：逐批读取和分割文档，按固定大小的片段批次嵌入并写入
+    
+    内存中只保留在途的读取批次和一个未写入的片段批次，与数据源总大小无关；
+    启用并行分割时读取批次在进程池中分割，与嵌入写入重叠进行。
+    每写入一个批次就记录断点；断点只推进到片段已全部写入的文档，
+    恢复时只重放未完全写入的读取批次，其中已写入的片段由内容去重跳过。
+    """
+    
+    def __init__(self, vector_store, batch_size: Optional[int] = None,
+                 read_batch: Optional[int] = None, checkpoint_dir: Optional[Path] = None):
+        self.vector_store = vector_store
+        self.batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        self.read_batch = read_batch or settings.INGEST_READ_BATCH
+        self.checkpoint_dir = Path(checkpoint_dir or settings.INGEST_CHECKPOINT_DIR)
+    
+    def _checkpoint_path(self, source) -> Path:
+        """断点文件路径，按数据源名称区分"""
+        digest = hashlib.sha1(source.name.encode("utf-8")).hexdigest()[:16]
+        return self.checkpoint_dir / f"{digest}.json"
+    
+    def _load_checkpoint(self, source) -> Dict[str, Any]:
+        """读取断点，不存在或不属于该数据源时返回初始状态"""
+        path = self._checkpoint_path(source) if source.name else None
+        if path is not None and path.exists():
+            try:
+                state = json.loads(path.read_text(encoding="utf-8"))
+                if state.get("source") == source.name:
+                    return state
+            except ValueError as e:
+                logger.warning(f"断点文件损坏，将从头开始入库: {e}")
+        return {
+            "source": source.name,
+            "position": 0,
+            "documents": 0,
+            "skipped_documents": 0,
+            "chunks_added": 0,
+            "chunks_skipped": 0,
+            "completed": False
+        }
+    
+    def _load_checkpoint_fresh(self, source) -> Dict[str, Any]:
+        """忽略已有断点，从头入库"""
+        if source.name:
+            self._checkpoint_path(source).unlink(missing_ok=True)
+        return self._load_checkpoint(source)
+    
+    def _save_checkpoint(self, source, state: Dict[str, Any]) -> None:
+        """原子写入断点"""
+        if not source.name:
+            return
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        state["updated_at"] = time.time()
+        write_atomic(self._checkpoint_path(source), json.dumps(state, ensure_ascii=False).encode("utf-8"))
+    
+    def run(self, source, resume: bool = True) -> Dict[str, Any]:
+        """执行入库并返回统计报告（包含每秒文档数）"""
+        state = self._load_checkpoint(source) if resume else self._load_checkpoint_fresh(source)
+        if state["completed"]:
+            logger.info(f"数据源已完成入库，跳过: {source.name}（使用resume=False重新入库）")
+            return self._report(state, documents=0, elapsed=0.0)
+        if state["position"]:
+            logger.info(f"从断点恢复入库: {source.name}，已处理{state['documents']}篇文档")
+            
+        start = time.perf_counter()
+        session_documents = 0
+        pending: List[Document] = []
+        # 每个读取批次一项：(该批次最后一个片段的累计序号, 批次之后的读取位置, 文档数)
+        boundaries: List[Tuple[int, int, int]] = []
+        flushed = 0
+        queued = 0
+        
+        groups = self._read_groups(source.read(state["position"]))
+        for chunks, skipped_documents, (position, count) in self.vector_store.prepare_batches(groups):
+            state["skipped_documents"] += skipped_documents
+            pending.extend(chunks)
+            queued += len(chunks)
+            boundaries.append((queued, position, count))
+            session_documents += count
+            
+            while len(pending) >= self.batch_size:
+                batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+                flushed += len(batch)
+                self._write_batch(batch, state)
+                boundaries = self._advance(state, boundaries, flushed)
+                self._save_checkpoint(source, state)
+                self._log_progress(state, session_documents, start)
+                
+        if pending:
+            flushed += len(pending)
+            self._write_batch(pending, state)
+        self._advance(state, boundaries, flushed)
+        state["completed"] = True
+        self._save_checkpoint(source, state)
+        
+        report = self._report(state, session_documents, time.perf_counter() - start)
+        logger.info(
+            f"入库完成: {source.name or '迭代器'}，本次文档{report['documents']}篇，"
+            f"新增片段{state['chunks_added']}个，速度{report['docs_per_second']}篇/秒"
+        )
+        return report
+    
+    def _read_groups(self, documents: Iterator[Tuple[Document, int]]) -> Iterator[Tuple[List[Document], tuple]]:
+        """按读取批次分组，产出(文档列表, (批次之后的读取位置, 文档数))"""
+        while True:
+            group = list(itertools.islice(documents, self.read_batch))
+            if not group:
+                return
+            yield [doc for doc, _ in group], (group[-1][1], len(group))
+    
+    def _write_batch(self, batch: List[Document], state: Dict[str, Any]) -> None:
+        """嵌入并写入一个片段批次"""
+        result = self.vector_store.add_chunks(batch)
+        state["chunks_added"] += result["added"]
+        state["chunks_skipped"] += result["skipped"]
+    
+    @staticmethod
+    def _advance(state: Dict[str, Any], boundaries: List[tuple], flushed: int) -> List[tuple]:
+        """把断点推进到片段已全部写入的最后一个读取批次"""
+        remaining = []
+        for queued, position, count in boundaries:
+            if queued <= flushed:
+                state["position"] = position
+                state["documents"] += count
+            else:
+                remaining.append((queued, position, count))
+        return remaining
+    
+    def _log_progress(self, state: Dict[str, Any], documents: int, start: float) -> None:
+        """输出入库进度"""
+        elapsed = time.perf_counter() - start
+        rate = documents / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            f"入库进度: 累计文档{state['documents']}篇，新增片段{state['chunks_added']}个，"
+            f"跳过重复片段{state['chunks_skipped']}个，{rate:.1f}篇/秒"
+        )
+    
+    @staticmethod
+    def _report(state: Dict[str, Any], documents: int, elapsed: float) -> Dict[str, Any]:
+        """生成统计报告"""
+        return {
+            "source": state["source"],
+            "documents": documents,
+            "total_documents": state["documents"],
+            "skipped_documents": state["skipped_documents"],
+            "chunks_added": state["chunks_added"],
+            "chunks_skipped": state["chunks_skipped"],
+            "elapsed_seconds": round(elapsed, 3),
+            "docs_per_second": round(documents / elapsed, 2) if elapsed > 0 else 0.0
+        }
+
+def ingest(vector_store, source, batch_size: Optional[int] = None, resume: bool = True) -> Dict[str, Any]:
+    """流式入库的便捷入口；source可以是数据源对象，也可以是Document/字符串的可迭代对象"""
+    if not hasattr(source, "read"):
+        source = IterableSource(source)
+    return StreamingIngestor(vector_store, batch_size=batch_size).run(source, resume=resume)
@@ -0,0 +1,331 @@
+"""
+中文感知的BM25词法索引模块
+"""
+import math
+import pickle
+import re
+import threading
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Optional, Iterable, Tuple, Callable
+
+import numpy as np
+
+from core.record_log import append_record, read_records, write_atomic
+from utils.text import normalize_text
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SNAPSHOT_FILE = "bm25.pkl"
+JOURNAL_FILE = "bm25.journal"
+SNAPSHOT_FORMAT = 2
+
+# 连续的中日韩字符，或连续的字母数字
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+def tokenize(text: str) -> List[str]:
+    """分词：中文按字符二元组切分（单字片段保留单字），英文数字按词切分"""
+    tokens = []
+    for run in _TOKEN_RE.findall(normalize_text(text).lower()):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class _Posting:
+    """单个词项的倒排表：片段编号和词频两个可增长数组，已删除的条目超过一半时压缩"""
+    
+    __slots__ = ("numbers", "tfs", "df")
+    
+    def __init__(self):
+        self.numbers = array("q")
+        self.tfs = array("f")
+        self.df = 0
+    
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """编号和词频数组的副本；不保留对可增长数组缓冲区的引用，之后的写入仍可追加"""
+        return (np.frombuffer(self.numbers, dtype=np.int64).copy(),
+                np.frombuffer(self.tfs, dtype=np.float32).copy())
+
+class BM25Index:
+    """支持增量更新的BM25倒排索引
+    
+    片段在索引内按加入顺序编号，倒排表保存编号和词频数组：查询持锁只复制命中词项的数组，
+    在锁外用NumPy计算分数，不阻塞并发写入。df超过max_df_ratio的高频词（如"约会"）
+    几乎不区分片段却占据大部分计算量，查询中还有其他词时跳过。
+    持久化采用快照 + 追加日志：每次写入只追加本批次的词项，
+    日志条数达到阈值时重写快照。
+    """
+    
+    def __init__(self, directory: Optional[Path] = None, k1: float = 1.5, b: float = 0.75,
+                 journal_limit: int = 5000, max_df_ratio: float = 1.0):
+        self.directory = Path(directory) if directory else None
+        self.k1 = k1
+        self.b = b
+        self.journal_limit = journal_limit
+        self.max_df_ratio = max_df_ratio
+        self.postings: Dict[str, _Posting] = {}
+        self.doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self.total_length = 0
+        # 片段ID <-> 编号；编号不复用，删除只清除存活标记，查询在锁外读取的编号始终有效
+        self._numbers: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._journal = None
+        self._journal_records = 0
+        self._lock = threading.RLock()
+        if self.directory:
+            self._load()
+    
+    def __len__(self) -> int:
+        return len(self._numbers)
+    
+    def _load(self):
+        """加载快照并重放日志"""
+        snapshot_path = self.directory / SNAPSHOT_FILE
+        journal_path = self.directory / JOURNAL_FILE
+        if snapshot_path.exists():
+            with open(snapshot_path, "rb") as f:
+                state = pickle.load(f)
+            if state.get("format") == SNAPSHOT_FORMAT:
+                self._restore(state)
+            else:
+                # 旧版快照按片段ID保存词频字典
+                docs = {doc_id: {} for doc_id in state["doc_lengths"]}
+                for term, posting in state["postings"].items():
+                    for doc_id, tf in posting.items():
+                        docs[doc_id][term] = tf
+                for doc_id, term_counts in docs.items():
+                    self._add_counts(doc_id, term_counts)
+        if journal_path.exists():
+            for record in read_records(journal_path):
+                self._apply(record)
+                self._journal_records += 1
+        if self._numbers:
+            logger.info(f"BM25索引已加载，共{len(self._numbers)}个片段")
+    
+    def _restore(self, state: dict):
+        """从快照恢复编号数组和倒排表"""
+        self._ids = list(state["doc_ids"])
+        self._numbers = {doc_id: number for number, doc_id in enumerate(self._ids)}
+        self._reserve(len(self._ids))
+        self._lengths[:len(self._ids)] = state["lengths"]
+        self._alive[:len(self._ids)] = True
+        self.doc_terms = state["doc_terms"]
+        self.total_length = state["total_length"]
+        for term, (numbers, tfs) in state["postings"].items():
+            posting = self.postings[term] = _Posting()
+            posting.numbers.frombytes(np.ascontiguousarray(numbers, dtype=np.int64).tobytes())
+            posting.tfs.frombytes(np.ascontiguousarray(tfs, dtype=np.float32).tobytes())
+            posting.df = len(posting.numbers)
+    
+    def _apply(self, record: dict):
+        """应用一条日志记录"""
+        if record["op"] == "add":
+            for doc_id, term_counts in record["docs"]:
+                self._add_counts(doc_id, term_counts)
+        elif record["op"] == "remove":
+            for doc_id in record["ids"]:
+                self._remove(doc_id)
+    
+    def _reserve(self, size: int):
+        """保证编号数组的容量，不足时按两倍扩容到新数组（锁外的查询继续使用旧数组）"""
+        if size <= len(self._lengths):
+            return
+        capacity = max(1024, size, 2 * len(self._lengths))
+        lengths = np.zeros(capacity, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        lengths[:len(self._lengths)] = self._lengths
+        alive[:len(self._alive)] = self._alive
+        self._lengths, self._alive = lengths, alive
+    
+    def _add_counts(self, doc_id: str, term_counts: Dict[str, int]):
+        """写入单个片段的词频"""
+        if doc_id in self._numbers:
+            self._remove(doc_id)
+        number = len(self._ids)
+        self._reserve(number + 1)
+        for term, tf in term_counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = _Posting()
+            posting.numbers.append(number)
+            posting.tfs.append(tf)
+            posting.df += 1
+        length = sum(term_counts.values())
+        self._ids.append(doc_id)
+        self._numbers[doc_id] = number
+        self._lengths[number] = length
+        self._alive[number] = True
+        self.doc_terms[doc_id] = tuple(term_counts)
+        self.total_length += length
+    
+    def _remove(self, doc_id: str):
+        """删除单个片段"""
+        number = self._numbers.pop(doc_id, None)
+        if number is None:
+            return
+        self._alive[number] = False
+        self.total_length -= int(self._lengths[number])
+        for term in self.doc_terms.pop(doc_id, ()):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.df -= 1
+            if posting.df == 0:
+                del self.postings[term]
+            elif 2 * posting.df < len(posting.numbers):
+                self._compact(posting)
+    
+    def _compact(self, posting: _Posting):
+        """去掉倒排表中已删除片段的条目"""
+        numbers, tfs = posting.arrays()
+        keep = self._alive[numbers]
+        posting.numbers, posting.tfs = array("q"), array("f")
+        posting.numbers.frombytes(numbers[keep].tobytes())
+        posting.tfs.frombytes(tfs[keep].tobytes())
+    
+    def add(self, items: Iterable[Tuple[str, str]]) -> None:
+        """批量加入(片段ID, 文本)"""
+        docs = [(str(doc_id), dict(Counter(tokenize(text)))) for doc_id, text in items]
+        if not docs:
+            return
+        with self._lock:
+            for doc_id, term_counts in docs:
+                self._add_counts(doc_id, term_counts)
+            self._log({"op": "add", "docs": docs})
+    
+    def remove(self, doc_ids: Iterable[str]) -> None:
+        """批量删除片段"""
+        ids = [str(doc_id) for doc_id in doc_ids]
+        if not ids:
+            return
+        with self._lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+            self._log({"op": "remove", "ids": ids})
+    
+    def _log(self, record: dict):
+        """追加日志，超过阈值时重写快照（调用方需持有锁）"""
+        if not self.directory:
+            return
+        if self._journal_records >= self.journal_limit:
+            self.save()
+            return
+        if self._journal is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._journal = open(self.directory / JOURNAL_FILE, "ab")
+        append_record(self._journal, record)
+        self._journal_records += 1
+    
+    def save(self) -> None:
+        """写入完整快照并清空日志；快照只含存活的片段，编号重新从0开始"""
+        if not self.directory:
+            return
+        with self._lock:
+            count = len(self._ids)
+            live = np.flatnonzero(self._alive[:count])
+            renumber = np.full(count, -1, dtype=np.int64)
+            renumber[live] = np.arange(len(live))
+            postings = {}
+            for term, posting in self.postings.items():
+                numbers, tfs = posting.arrays()
+                keep = self._alive[numbers]
+                postings[term] = (renumber[numbers[keep]], tfs[keep])
+            self.directory.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.directory / SNAPSHOT_FILE, pickle.dumps({
+                "format": SNAPSHOT_FORMAT,
+                "doc_ids": [self._ids[number] for number in live],
+                "lengths": self._lengths[live],
+                "postings": postings,
+                "doc_terms": self.doc_terms,
+                "total_length": self.total_length
+            }, protocol=pickle.HIGHEST_PROTOCOL))
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            (self.directory / JOURNAL_FILE).unlink(missing_ok=True)
+            self._journal_records = 0
+    
+    def search(self, query: str, k: int,
+               allowed: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, float]]:
+        """BM25检索，返回(片段ID, 分数)列表；allowed用于在取top-k之前过滤片段"""
+        terms = Counter(tokenize(query))
+        if not terms or k <= 0:
+            return []
+        with self._lock:
+            total_docs = len(self._numbers)
+            if total_docs == 0:
+                return []
+            avg_length = self.total_length / total_docs
+            matched = [(query_tf, self.postings[term]) for term, query_tf in terms.items() if term in self.postings]
+            # 查询中还有其他词时跳过高频词
+            rare = [item for item in matched if item[1].df <= self.max_df_ratio * total_docs]
+            # 持锁只复制命中词项的倒排数组；编号数组扩容时整体替换，引用在锁外保持一致
+            copied = [(query_tf, posting.df) + posting.arrays() for query_tf, posting in rare or matched]
+            lengths, alive, ids = self._lengths, self._alive, self._ids
+        if not copied:
+            return []
+        
+        numbers = np.concatenate([item[2] for item in copied])
+        weights = []
+        for query_tf, df, term_numbers, tfs in copied:
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[term_numbers] / avg_length)
+            weights.append(query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm))
+        weights = np.concatenate(weights) * alive[numbers]
+        scores = np.bincount(numbers, weights=weights)
+        candidates = np.flatnonzero(scores)
+        if allowed is None and len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        
+        results = []
+        for number in candidates.tolist():
+            doc_id = ids[number]
+            if allowed is None or allowed(doc_id):
+                results.append((doc_id, float(scores[number])))
+                if len(results) == k:
+                    break
+        return results
+    
+    def remapped(self, id_map: Dict[str, str], directory: Path) -> "BM25Index":
+        """按新的ID映射复制索引并保存到指定目录（用于导出只读服务索引）"""
+        copy = BM25Index(directory=None, k1=self.k1, b=self.b, journal_limit=self.journal_limit,
+                         max_df_ratio=self.max_df_ratio)
+        with self._lock:
+            docs = {id_map[doc_id]: {} for doc_id in self._numbers if doc_id in id_map}
+            for term, posting in self.postings.items():
+                numbers, tfs = posting.arrays()
+                keep = self._alive[numbers]
+                for number, tf in zip(numbers[keep].tolist(), tfs[keep].tolist()):
+                    doc_id = id_map.get(self._ids[number])
+                    if doc_id is not None:
+                        docs[doc_id][term] = int(tf)
+        for doc_id, term_counts in docs.items():
+            copy._add_counts(doc_id, term_counts)
+        copy.directory = Path(directory)
+        copy.save()
+        return copy
+    
+    def close(self) -> None:
+        """关闭日志文件"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """倒数排名融合：score(d) = Σ 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
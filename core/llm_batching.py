@@ -0,0 +1,164 @@
+"""
+本地模型动态批处理模块
+
+短时间窗口内到达的生成请求合并为一次model.generate调用，
+提高并发场景下的吞吐量；每个请求通过Future取回自己的结果。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Any, Callable, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+def sampling_kwargs(max_new_tokens: int, temperature: float) -> Dict[str, Any]:
+    """本地模型的生成参数；temperature不大于0时改为贪心解码（采样要求温度为正）"""
+    kwargs = {"max_new_tokens": max_new_tokens, "repetition_penalty": 1.15}
+    if temperature > 0:
+        kwargs.update(do_sample=True, temperature=temperature, top_p=0.95)
+    else:
+        kwargs["do_sample"] = False
+    return kwargs
+
+def hf_generate_batch(model, tokenizer, prompts: List[str], max_new_tokens: int,
+                      temperature: float) -> List[str]:
+    """一次生成一批提示：左侧填充后调用model.generate，只解码新生成的部分"""
+    import torch
+    
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            **sampling_kwargs(max_new_tokens, temperature),
+            pad_token_id=tokenizer.pad_token_id
+        )
+    # 左侧填充时所有提示对齐在同一位置结束
+    new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+    return tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+class _Request:
+    __slots__ = ("prompt", "max_new_tokens", "temperature", "future", "enqueued_at")
+    
+    def __init__(self, prompt: str, max_new_tokens: int, temperature: float):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+class BatchScheduler:
+    """动态批处理调度器
+    
+    后台线程取出第一个请求后，最多再等待max_wait_ms收集后续请求，凑满max_batch_size
+    立即执行。生成参数(max_new_tokens, temperature)不同的请求分组执行。
+    generate_batch(prompts, max_new_tokens, temperature)需按顺序返回每个提示的输出。
+    """
+    
+    def __init__(self, generate_batch: Callable[[List[str], int, float], List[str]],
+                 max_batch_size: int = 8, max_wait_ms: float = 20):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+        self.failures = 0
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="llm-batching", daemon=True)
+        self._thread.start()
+    
+    def submit(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7) -> Future:
+        """提交一个生成请求，返回结果的Future"""
+        if not self._thread.is_alive():
+            raise RuntimeError("批处理调度器已停止")
+        request = _Request(prompt, max_new_tokens, temperature)
+        self._queue.put(request)
+        return request.future
+    
+    def generate(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7) -> str:
+        """提交请求并等待结果"""
+        return self.submit(prompt, max_new_tokens, temperature).result()
+    
+    def _collect(self, first: _Request) -> List[_Request]:
+        """从第一个请求开始，在等待窗口内收集一批请求"""
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # 停止信号放回队列，本批处理完后退出
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+    
+    def _execute(self, batch: List[_Request]) -> None:
+        """按生成参数分组执行一批请求，并把结果交回各自的调用方"""
+        groups: Dict[tuple, List[_Request]] = {}
+        for request in batch:
+            groups.setdefault((request.max_new_tokens, request.temperature), []).append(request)
+            
+        for (max_new_tokens, temperature), requests in groups.items():
+            requests = [request for request in requests if request.future.set_running_or_notify_cancel()]
+            if not requests:
+                continue
+            try:
+                outputs = self.generate_batch([request.prompt for request in requests], max_new_tokens, temperature)
+                if len(outputs) != len(requests):
+                    raise RuntimeError(f"批量生成返回{len(outputs)}条结果，期望{len(requests)}条")
+                for request, output in zip(requests, outputs):
+                    request.future.set_result(output)
+            except Exception as e:
+                logger.error(f"批量生成失败（{len(requests)}个请求）: {e}")
+                with self._stats_lock:
+                    self.failures += len(requests)
+                for request in requests:
+                    request.future.set_exception(e)
+                    
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(requests)
+                self.largest_batch = max(self.largest_batch, len(requests))
+    
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            self._execute(self._collect(first))
+            
+        # 停止后仍在队列中的请求直接失败
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(RuntimeError("批处理调度器已停止"))
+    
+    def stop(self) -> None:
+        """停止调度线程，正在执行的批次会先完成"""
+        self._queue.put(None)
+        self._thread.join()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取批处理统计信息"""
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "batches": self.batches,
+                "requests": self.requests,
+                "average_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "failures": self.failures,
+                "queued": self._queue.qsize()
+            }
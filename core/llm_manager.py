@@ -1,29 +1,29 @@
 """
 LLM管理器模块
 """
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Iterator, AsyncIterator
 from pathlib import Path
 
-from langchain.llms import HuggingFacePipeline
-from langchain.chat_models import ChatOpenAI
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from transformers import (
-    AutoTokenizer, 
-    AutoModelForCausalLM, 
-    pipeline,
-    BitsAndBytesConfig
-)
-import torch
-
 from config.settings import settings
+from core.llm_batching import BatchScheduler, hf_generate_batch, sampling_kwargs
+from core.response_cache import ResponseCache, ResponseCacheStore, response_cache_key
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+class GenerationError(RuntimeError):
+    """生成失败；消息与默认返回的错误信息相同（"生成失败: ..."）"""
+
 class LLMManager:
-    """LLM管理器类"""
+    """LLM管理器类
+    
+    LangChain的模型封装、transformers和torch只在初始化对应模式时导入，
+    使用OpenAI API的进程不会加载本地模型依赖。
+    """
     
     def __init__(self):
         self.llm = None
@@ -31,6 +31,13 @@ class LLMManager:
         self.model = None
         self.pipeline = None
         self.use_openai = False
+        self.model_name = None
+        # 本地模式下的动态批处理调度器
+        self.batch_scheduler = None
+        self.response_cache = self._create_response_cache()
+        # 异步接口中执行本地推理的有界线程池，首次使用时创建
+        self._executor = None
+        self._executor_lock = threading.Lock()
         self._initialize()
     
     def _initialize(self):
@@ -50,19 +57,36 @@ class LLMManager:
             logger.error(f"LLM模型初始化失败: {e}")
             raise
     
+    def _create_response_cache(self) -> Optional[ResponseCache]:
+        """创建两级响应缓存；磁盘缓存不可用时只使用进程内缓存"""
+        if not settings.LLM_CACHE_ENABLED:
+            return None
+        try:
+            store = ResponseCacheStore(
+                settings.LLM_CACHE_PATH,
+                max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.LLM_CACHE_TTL
+            )
+        except Exception as e:
+            logger.error(f"LLM响应磁盘缓存初始化失败，仅使用进程内缓存: {e}")
+            store = None
+        return ResponseCache(settings.LLM_CACHE_MEMORY_SIZE, ttl_seconds=settings.LLM_CACHE_TTL, store=store)
+    
     def _init_openai(self):
         """初始化OpenAI API"""
         try:
+            from langchain.chat_models import ChatOpenAI
+            
             # 设置环境变量
             os.environ["OPENAI_API_KEY"] = settings.OPENAI_API_KEY
             os.environ["OPENAI_API_BASE"] = settings.OPENAI_API_BASE
             
-            # 创建OpenAI聊天模型
+            # 创建OpenAI聊天模型；逐token输出通过stream/astream获取，不再打印到标准输出
+            self.model_name = "gpt-4o"
             self.llm = ChatOpenAI(
-                model_name="gpt-4o",
+                model_name=self.model_name,
                 temperature=0.7,
-                streaming=True,
-                callbacks=[StreamingStdOutCallbackHandler()]
+                streaming=True
             )
             
             logger.info("OpenAI API初始化成功")
@@ -74,7 +98,12 @@ class LLMManager:
     def _init_local_llama(self):
         """初始化本地LLaMA模型"""
         try:
+            import torch
+            from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline, BitsAndBytesConfig
+            from langchain.llms import HuggingFacePipeline
+            
             logger.info(f"开始初始化本地LLM模型: {settings.MODEL_NAME}")
+            self.model_name = settings.MODEL_NAME
             
             # 检查是否有GPU
             device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -138,12 +167,22 @@ class LLMManager:
             )
             
             # 创建LangChain LLM
-            callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
-            self.llm = HuggingFacePipeline(
-                pipeline=self.pipeline,
-                callback_manager=callback_manager,
-                verbose=True
-            )
+            self.llm = HuggingFacePipeline(pipeline=self.pipeline)
+            
+            if settings.LLM_BATCHING_ENABLED:
+                # 仅解码器模型批量生成需要左侧填充
+                self.tokenizer.padding_side = "left"
+                self.batch_scheduler = BatchScheduler(
+                    lambda prompts, max_new_tokens, temperature: hf_generate_batch(
+                        self.model, self.tokenizer, prompts, max_new_tokens, temperature
+                    ),
+                    max_batch_size=settings.LLM_BATCH_MAX_SIZE,
+                    max_wait_ms=settings.LLM_BATCH_MAX_WAIT_MS
+                )
+                logger.info(
+                    f"已启用动态批处理: 每批最多{settings.LLM_BATCH_MAX_SIZE}个请求，"
+                    f"等待窗口{settings.LLM_BATCH_MAX_WAIT_MS}毫秒"
+                )
             
             logger.info("本地LLM模型初始化成功")
             
@@ -151,31 +190,216 @@ class LLMManager:
             logger.error(f"本地LLM模型初始化失败: {e}")
             raise
     
-    def generate(self, prompt: str, max_length: int = 512, temperature: float = 0.7) -> str:
-        """生成文本"""
+    def generate(self, prompt: str, max_length: int = 512, temperature: float = 0.7,
+                 use_cache: bool = True, raise_on_error: bool = False) -> str:
+        """生成文本；相同的完整提示和生成参数直接返回缓存的响应，use_cache=False时跳过缓存
+        
+        max_length为最多生成的token数，temperature不大于0时本地模型使用贪心解码。
+        失败时返回错误信息，raise_on_error=True时改为抛出GenerationError。
+        """
         try:
             if not self.llm:
                 raise RuntimeError("LLM模型未初始化")
             
+            key = self._cache_key(prompt, max_length, temperature, use_cache)
+            cached = self._cached_response(key)
+            if cached is not None:
+                return cached
+            
             if self.use_openai:
                 # 使用OpenAI API
-                return self._generate_with_openai(prompt)
+                response = self._generate_with_openai(prompt, max_length, temperature)
             else:
                 # 使用本地LLaMA
-                return self._generate_with_local_llama(prompt)
+                response = self._generate_with_local_llama(prompt, max_length, temperature)
+            self._store_response(key, response)
+            return response
+                
+        except Exception as e:
+            logger.error(f"文本生成失败: {e}")
+            if raise_on_error:
+                raise GenerationError(f"生成失败: {str(e)}") from e
+            return f"生成失败: {str(e)}"
+    
+    async def agenerate(self, prompt: str, max_length: int = 512, temperature: float = 0.7,
+                        use_cache: bool = True, raise_on_error: bool = False) -> str:
+        """异步生成文本：OpenAI兼容后端使用异步客户端，本地模型在有界线程池中推理，不阻塞事件循环"""
+        try:
+            if not self.llm:
+                raise RuntimeError("LLM模型未初始化")
+            
+            key = self._cache_key(prompt, max_length, temperature, use_cache)
+            cached = self._cached_response(key)
+            if cached is not None:
+                return cached
+            
+            if self.use_openai:
+                response = await self._agenerate_with_openai(prompt, max_length, temperature)
+            elif self.batch_scheduler is not None:
+                # 批处理调度器返回Future，等待期间不占用线程
+                response = await self._agenerate_with_batching(prompt, max_length, temperature)
+            else:
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(
+                    self._local_executor(), self._generate_with_local_llama, prompt, max_length, temperature
+                )
+            self._store_response(key, response)
+            return response
                 
         except Exception as e:
             logger.error(f"文本生成失败: {e}")
+            if raise_on_error:
+                raise GenerationError(f"生成失败: {str(e)}") from e
             return f"生成失败: {str(e)}"
     
-    def _generate_with_openai(self, prompt: str) -> str:
+    def stream(self, prompt: str, max_length: int = 512, temperature: float = 0.7,
+               use_cache: bool = True, raise_on_error: bool = False) -> Iterator[str]:
+        """逐段生成文本，每生成一段就返回，缓存命中时一次返回完整响应
+        
+        失败时最后返回一段错误信息，raise_on_error=True时改为在已返回的部分之后抛出GenerationError。
+        """
+        try:
+            if not self.llm:
+                raise RuntimeError("LLM模型未初始化")
+            
+            key = self._cache_key(prompt, max_length, temperature, use_cache)
+            cached = self._cached_response(key)
+            if cached is not None:
+                yield cached
+                return
+            
+            full_prompt = self._build_prompt(prompt)
+            parts = []
+            if self.use_openai:
+                for chunk in self.llm.stream(full_prompt, temperature=temperature, max_tokens=max_length):
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield chunk.content
+            else:
+                for token in self._stream_with_local_llama(full_prompt, max_length, temperature):
+                    parts.append(token)
+                    yield token
+            self._store_response(key, self._clean_response("".join(parts), prompt))
+                
+        except Exception as e:
+            logger.error(f"流式生成失败: {e}")
+            if raise_on_error:
+                raise GenerationError(f"生成失败: {str(e)}") from e
+            yield f"生成失败: {str(e)}"
+    
+    async def astream(self, prompt: str, max_length: int = 512, temperature: float = 0.7,
+                      use_cache: bool = True, raise_on_error: bool = False) -> AsyncIterator[str]:
+        """异步逐段生成文本：OpenAI兼容后端使用异步客户端，本地模型的输出从推理线程转交给事件循环"""
+        try:
+            if not self.llm:
+                raise RuntimeError("LLM模型未初始化")
+            
+            key = self._cache_key(prompt, max_length, temperature, use_cache)
+            cached = self._cached_response(key)
+            if cached is not None:
+                yield cached
+                return
+            
+            full_prompt = self._build_prompt(prompt)
+            parts = []
+            if self.use_openai:
+                async for chunk in self.llm.astream(full_prompt, temperature=temperature, max_tokens=max_length):
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield chunk.content
+            else:
+                loop = asyncio.get_running_loop()
+                tokens = self._stream_with_local_llama(full_prompt, max_length, temperature)
+                while True:
+                    # 等待下一段输出时不阻塞事件循环
+                    token = await loop.run_in_executor(None, next, tokens, None)
+                    if token is None:
+                        break
+                    parts.append(token)
+                    yield token
+            self._store_response(key, self._clean_response("".join(parts), prompt))
+                    
+        except Exception as e:
+            logger.error(f"流式生成失败: {e}")
+            if raise_on_error:
+                raise GenerationError(f"生成失败: {str(e)}") from e
+            yield f"生成失败: {str(e)}"
+    
+    def _stream_with_local_llama(self, full_prompt: str, max_length: int, temperature: float) -> Iterator[str]:
+        """本地模型流式生成：generate在推理线程池中执行，通过TextIteratorStreamer逐段取出新生成的文本"""
+        from transformers import TextIteratorStreamer
+        
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = self.tokenizer(full_prompt, return_tensors="pt").to(self.model.device)
+        
+        def run():
+            try:
+                self.model.generate(
+                    **inputs,
+                    **sampling_kwargs(max_length, temperature),
+                    streamer=streamer,
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+            except Exception:
+                # 推理失败时结束流，避免读取方一直等待
+                streamer.end()
+                raise
+        
+        future = self._local_executor().submit(run)
+        for text in streamer:
+            if text:
+                yield text
+        # 推理线程中的异常在这里抛出
+        future.result()
+        logger.info("本地LLM流式生成完成")
+    
+    def _cache_key(self, prompt: str, max_length: int, temperature: float, use_cache: bool) -> Optional[str]:
+        """计算响应缓存键，未启用缓存或调用方跳过缓存时返回None"""
+        if not use_cache or self.response_cache is None:
+            return None
+        backend = "openai" if self.use_openai else "local"
+        return response_cache_key(backend, self.model_name, self._build_prompt(prompt), temperature, max_length)
+    
+    def _cached_response(self, key: Optional[str]) -> Optional[str]:
+        """读取缓存的响应，缓存故障不影响生成"""
+        if key is None:
+            return None
+        try:
+            response = self.response_cache.get(key)
+        except Exception as e:
+            logger.error(f"读取LLM响应缓存失败: {e}")
+            return None
+        if response is not None:
+            logger.info("命中LLM响应缓存")
+        return response
+    
+    def _store_response(self, key: Optional[str], response: str) -> None:
+        """缓存成功生成的响应（生成失败时各生成方法会抛出异常，不会走到这里）"""
+        if key is None or not response:
+            return
+        try:
+            self.response_cache.put(key, response)
+        except Exception as e:
+            logger.error(f"写入LLM响应缓存失败: {e}")
+    
+    def _local_executor(self) -> ThreadPoolExecutor:
+        """本地推理线程池；线程数有限，多余的请求在队列中等待而不是同时占用模型"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, settings.LLM_LOCAL_WORKERS),
+                    thread_name_prefix="local-llm"
+                )
+            return self._executor
+    
+    def _generate_with_openai(self, prompt: str, max_length: int, temperature: float) -> str:
         """使用OpenAI API生成文本"""
         try:
             # 构建完整的提示
             full_prompt = self._build_prompt(prompt)
             
-            # 使用OpenAI生成
-            response = self.llm.invoke(full_prompt)
+            # 使用OpenAI生成，生成参数覆盖模型的默认值
+            response = self.llm.invoke(full_prompt, temperature=temperature, max_tokens=max_length)
             
             # 清理响应
             cleaned_response = self._clean_response(str(response.content), prompt)
@@ -185,16 +409,52 @@ class LLMManager:
             
         except Exception as e:
             logger.error(f"OpenAI API生成失败: {e}")
-            return f"OpenAI API生成失败: {str(e)}"
+            raise
     
-    def _generate_with_local_llama(self, prompt: str) -> str:
-        """使用本地LLaMA生成文本"""
+    async def _agenerate_with_openai(self, prompt: str, max_length: int, temperature: float) -> str:
+        """使用OpenAI异步客户端生成文本"""
+        try:
+            full_prompt = self._build_prompt(prompt)
+            response = await self.llm.ainvoke(full_prompt, temperature=temperature, max_tokens=max_length)
+            cleaned_response = self._clean_response(str(response.content), prompt)
+            
+            logger.info(f"OpenAI API异步文本生成完成，长度: {len(cleaned_response)}")
+            return cleaned_response
+            
+        except Exception as e:
+            logger.error(f"OpenAI API异步生成失败: {e}")
+            raise
+    
+    async def _agenerate_with_batching(self, prompt: str, max_length: int, temperature: float) -> str:
+        """通过批处理调度器异步生成文本"""
+        try:
+            future = self.batch_scheduler.submit(self._build_prompt(prompt), max_length, temperature)
+            response = await asyncio.wrap_future(future)
+            cleaned_response = self._clean_response(response, prompt)
+            
+            logger.info(f"本地LLM批量生成完成，长度: {len(cleaned_response)}")
+            return cleaned_response
+            
+        except Exception as e:
+            logger.error(f"本地LLM生成失败: {e}")
+            raise
+    
+    def _generate_with_local_llama(self, prompt: str, max_length: int, temperature: float) -> str:
+        """使用本地LLaMA生成文本；启用批处理时与并发请求合并执行"""
         try:
             # 构建完整的提示
             full_prompt = self._build_prompt(prompt)
             
-            # 生成文本
-            response = self.llm(full_prompt)
+            # 生成文本，生成参数覆盖pipeline创建时的默认值
+            if self.batch_scheduler is not None:
+                response = self.batch_scheduler.generate(full_prompt, max_length, temperature)
+            else:
+                outputs = self.pipeline(
+                    full_prompt,
+                    **sampling_kwargs(max_length, temperature),
+                    return_full_text=False
+                )
+                response = outputs[0]["generated_text"]
             
             # 清理响应
             cleaned_response = self._clean_response(response, prompt)
@@ -204,7 +464,7 @@ class LLMManager:
             
         except Exception as e:
             logger.error(f"本地LLM生成失败: {e}")
-            return f"本地LLM生成失败: {str(e)}"
+            raise
     
     def _build_prompt(self, user_input: str) -> str:
         """构建提示词"""
@@ -247,20 +507,23 @@ class LLMManager:
         """获取模型信息"""
         try:
             if self.use_openai:
-                return {
+                info = {
                     "type": "openai",
-                    "model": "gpt-4o",
+                    "model": self.model_name,
                     "api_base": settings.OPENAI_API_BASE,
                     "provider": "ChatAnywhere"
                 }
             else:
-                return {
+                info = {
                     "type": "local",
                     "model_name": settings.MODEL_NAME,
                     "tokenizer_vocab_size": len(self.tokenizer) if self.tokenizer else 0,
                     "model_parameters": sum(p.numel() for p in self.model.parameters()) if self.model else 0,
-                    "device": str(next(self.model.parameters()).device) if self.model else "unknown"
+                    "device": str(next(self.model.parameters()).device) if self.model else "unknown",
+                    "batching": self.batch_scheduler.get_stats() if self.batch_scheduler is not None else None
                 }
+            info["response_cache"] = self.response_cache.get_stats() if self.response_cache else None
+            return info
         except Exception as e:
             logger.error(f"获取模型信息失败: {e}")
             return {"error": str(e)}
@@ -0,0 +1,159 @@
+"""
+元数据二级索引模块
+"""
+import threading
+from array import array
+from typing import List, Dict, Any, Optional, Iterable
+
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_RANGE_OPS = ("$gt", "$gte", "$lt", "$lte")
+
+def _conditions(filter: Dict[str, Any]) -> List[tuple]:
+    """把过滤条件拆成(字段, 运算符, 值)列表，多个字段之间为"与"关系
+    
+    支持的写法：{"category": "dating_tips"}、{"category": {"$in": [...]}}、
+    {"relevance_score": {"$gte": 0.5}}，以及Chroma风格的{"$and": [...]}。
+    """
+    conditions = []
+    for field, condition in filter.items():
+        if field == "$and":
+            for sub_filter in condition:
+                conditions.extend(_conditions(sub_filter))
+        elif isinstance(condition, dict):
+            for op, value in condition.items():
+                if op not in ("$eq", "$in") + _RANGE_OPS:
+                    raise ValueError(f"不支持的过滤运算符: {op}")
+                conditions.append((field, op, value))
+        elif isinstance(condition, (list, tuple, set)):
+            conditions.append((field, "$in", list(condition)))
+        else:
+            conditions.append((field, "$eq", condition))
+    return conditions
+
+def to_chroma_where(filter: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """转换为Chroma的where子句"""
+    clauses = [{field: {op: value}} for field, op, value in _conditions(filter)]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+class MetadataIndex:
+    """元数据二级索引：分类字段按取值建立倒排表，数值字段按行存为列
+    
+    行号与FAISS索引中的向量位置一致，过滤结果可直接作为ANN搜索的候选集合。
+    只索引配置中列出的字段，对未索引字段过滤会报错而不是退化为全量扫描。
+    """
+    
+    def __init__(self, fields: Iterable[str]):
+        self.fields = set(fields)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[Any, array]] = {field: {} for field in self.fields}
+        self._numeric: Dict[str, array] = {}
+        # 已删除但向量仍留在FAISS索引中的行，选择时排除，压缩重建后清空
+        self._tombstones = array("q")
+        self._lock = threading.RLock()
+    
+    def __len__(self) -> int:
+        return len(self._ids)
+    
+    def add(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """按行号顺序追加片段"""
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                row = len(self._ids)
+                self._ids.append(doc_id)
+                self._rows[doc_id] = row
+                for field in self.fields:
+                    value = (metadata or {}).get(field)
+                    if value is None:
+                        continue
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        column = self._numeric.get(field)
+                        if column is None:
+                            column = self._numeric[field] = array("d")
+                        # 缺失值补NaN，任何范围比较都为假
+                        column.extend([float("nan")] * (row - len(column)))
+                        column.append(float(value))
+                    postings = self._postings[field]
+                    if value not in postings:
+                        postings[value] = array("q")
+                    postings[value].append(row)
+    
+    @property
+    def tombstones(self) -> int:
+        """已标记删除的行数"""
+        return len(self._tombstones)
+    
+    def tombstone(self, doc_ids: Iterable[str]) -> List[int]:
+        """把片段标记为已删除，返回被标记的行号"""
+        with self._lock:
+            rows = [self._rows.pop(doc_id) for doc_id in doc_ids if doc_id in self._rows]
+            self._tombstones.extend(rows)
+            return rows
+    
+    def row_of(self, doc_id: str) -> Optional[int]:
+        """片段ID对应的行号"""
+        return self._rows.get(doc_id)
+    
+    def ids_at(self, rows: Iterable[int]) -> List[str]:
+        """行号对应的片段ID"""
+        return [self._ids[int(row)] for row in rows]
+    
+    def select(self, filter: Dict[str, Any]) -> np.ndarray:
+        """返回满足全部条件且未删除的行号（升序）；条件为空时返回全部未删除的行"""
+        with self._lock:
+            mask = None
+            for field, op, value in _conditions(filter):
+                if field not in self.fields:
+                    raise ValueError(f"字段{field}未建立元数据索引，请加入METADATA_INDEX_FIELDS")
+                condition = self._condition_mask(field, op, value)
+                mask = condition if mask is None else mask & condition
+            if mask is None:
+                if not self._tombstones:
+                    return np.arange(len(self._ids), dtype=np.int64)
+                mask = np.ones(len(self._ids), dtype=bool)
+            if self._tombstones:
+                mask[np.frombuffer(self._tombstones, dtype=np.int64)] = False
+            return np.flatnonzero(mask)
+    
+    def _condition_mask(self, field: str, op: str, value: Any) -> np.ndarray:
+        """单个条件的位图"""
+        mask = np.zeros(len(self._ids), dtype=bool)
+        if op in _RANGE_OPS:
+            column = self._numeric.get(field)
+            if column is None:
+                return mask
+            values = np.frombuffer(column, dtype=np.float64)
+            with np.errstate(invalid="ignore"):
+                if op == "$gt":
+                    matched = values > value
+                elif op == "$gte":
+                    matched = values >= value
+                elif op == "$lt":
+                    matched = values < value
+                else:
+                    matched = values <= value
+            mask[:len(values)] = matched
+            return mask
+            
+        postings = self._postings[field]
+        for item in (value if op == "$in" else [value]):
+            rows = postings.get(item)
+            if rows is not None:
+                mask[np.frombuffer(rows, dtype=np.int64)] = True
+        return mask
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取索引统计信息"""
+        with self._lock:
+            return {
+                "rows": len(self._ids),
+                "tombstones": len(self._tombstones),
+                "fields": {field: len(postings) for field, postings in self._postings.items()}
+            }
@@ -0,0 +1,42 @@
+"""
+最大边际相关性（MMR）多样化模块
+"""
+from typing import List
+
+import numpy as np
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行L2归一化，零向量保持为零"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+def maximal_marginal_relevance(query_vector: np.ndarray, candidate_vectors: np.ndarray,
+                               k: int, lambda_mult: float = 0.5) -> List[int]:
+    """按MMR贪心选出k个候选，返回按选择顺序排列的候选下标
+    
+    每一步选择 lambda*相关性 - (1-lambda)*与已选片段的最大相似度 最大的候选，
+    相似度均为余弦相似度。候选之间的相似度矩阵一次矩阵乘法算出，
+    每步只用新选中片段的一行更新冗余度，整体为O(fetch_k²)的向量化计算。
+    """
+    candidates = _normalize(np.asarray(candidate_vectors, dtype=np.float32))
+    query = _normalize(np.asarray(query_vector, dtype=np.float32).reshape(-1))
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+        
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    first = int(np.argmax(relevance))
+    selected = [first]
+    redundancy = similarity[first].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+    
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
@@ -0,0 +1,295 @@
+"""
+NumPy向量存储模块
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+from array import array
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.vectorstore import VectorStore as LangChainVectorStore
+
+from core.record_log import write_atomic
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+DOCS_FILE = "docs.jsonl"
+MANIFEST_FILE = "manifest.json"
+INITIAL_CAPACITY = 1024
+
+class NumpyStore(LangChainVectorStore):
+    """纯NumPy向量存储，适合几千到几万个片段的小语料
+    
+    向量保存在预分配容量的.npy矩阵中，以内存映射方式读写；文档以JSONL追加写入，
+    内存中只保留每行的偏移量。查询做一次矩阵乘法加argpartition的精确top-k，
+    距离为平方L2距离，与FAISS平坦索引一致。
+    
+    写入顺序为向量、文档、清单；清单记录已提交的行数和文档字节数，
+    写入中途崩溃时加载会丢弃清单之外的部分。
+    """
+    
+    def __init__(self, directory: Path, embeddings=None):
+        self.directory = Path(directory)
+        old_dir = self.directory.with_name(self.directory.name + ".old")
+        if not self.directory.exists() and old_dir.exists():
+            # 重写在两次目录替换之间中断，恢复原目录
+            os.replace(old_dir, self.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._embeddings = embeddings
+        self._matrix = None
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._offsets = array("q", [0])
+        # 查询读取的一致视图(矩阵, 行平方范数, 行数)，写入完成后整体替换
+        self._view = (None, np.zeros(0, dtype=np.float32), 0)
+        self._lock = threading.RLock()
+        self._load()
+    
+    @property
+    def embeddings(self):
+        return self._embeddings
+    
+    def __len__(self) -> int:
+        return self._view[2]
+    
+    @property
+    def dimension(self) -> Optional[int]:
+        """向量维度，尚未写入时为None"""
+        return None if self._matrix is None else int(self._matrix.shape[1])
+    
+    def _load(self) -> None:
+        """按清单加载已提交的向量与文档"""
+        manifest_path = self.directory / MANIFEST_FILE
+        info = {"count": 0, "doc_bytes": 0}
+        if manifest_path.exists():
+            info = json.loads(manifest_path.read_text(encoding="utf-8"))
+        count = info["count"]
+        
+        self._docs = open(self.directory / DOCS_FILE, "a+b")
+        if os.fstat(self._docs.fileno()).st_size > info["doc_bytes"]:
+            logger.warning("NumPy向量存储的文档文件含未提交的记录，已截断")
+            self._docs.truncate(info["doc_bytes"])
+        self._docs.seek(0)
+        for line in self._docs:
+            self._ids.append(json.loads(line)["id"])
+            self._offsets.append(self._offsets[-1] + len(line))
+        if len(self._ids) != count:
+            raise RuntimeError(f"NumPy向量存储损坏：清单记录{count}行，文档文件有{len(self._ids)}行")
+        self._positions = {doc_id: position for position, doc_id in enumerate(self._ids)}
+        
+        vectors_path = self.directory / VECTORS_FILE
+        if vectors_path.exists():
+            self._matrix = np.load(str(vectors_path), mmap_mode="r+")
+            self._view = (self._matrix, self._row_norms(self._matrix[:count]), count)
+        logger.info(f"NumPy向量存储加载完成，共{count}个向量")
+    
+    @staticmethod
+    def _row_norms(vectors: np.ndarray, batch: int = 65536) -> np.ndarray:
+        """分批计算行平方范数，避免一次性读入整个映射矩阵"""
+        norms = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), batch):
+            block = np.asarray(vectors[start:start + batch], dtype=np.float32)
+            norms[start:start + batch] = np.einsum("ij,ij->i", block, block)
+        return norms
+    
+    def _reserve(self, rows: int, dimension: int) -> None:
+        """保证矩阵容量，不足时按两倍扩容到新文件再原子替换（调用方需持有锁）"""
+        if self._matrix is not None:
+            if dimension != self._matrix.shape[1]:
+                raise ValueError(f"向量维度不一致: {dimension} != {self._matrix.shape[1]}")
+            if rows <= self._matrix.shape[0]:
+                return
+        capacity = max(INITIAL_CAPACITY, rows, 2 * (0 if self._matrix is None else self._matrix.shape[0]))
+        path = self.directory / VECTORS_FILE
+        tmp_path = path.with_name(path.name + ".tmp")
+        matrix = np.lib.format.open_memmap(str(tmp_path), mode="w+", dtype=np.float32, shape=(capacity, dimension))
+        count = self._view[2]
+        if count:
+            matrix[:count] = self._matrix[:count]
+        matrix.flush()
+        # 进行中的查询仍持有旧映射，旧文件在其释放前保持有效
+        os.replace(tmp_path, path)
+        self._matrix = matrix
+    
+    def add_embeddings(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]],
+                       vectors: Iterable[Iterable[float]]) -> None:
+        """追加已计算好的向量与文档"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        lines = [
+            json.dumps(
+                {"id": doc_id, "page_content": text, "metadata": metadata},
+                ensure_ascii=False,
+                default=str
+            ).encode("utf-8") + b"\n"
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        
+        with self._lock:
+            _, norms, count = self._view
+            self._reserve(count + len(vectors), vectors.shape[1])
+            self._matrix[count:count + len(vectors)] = vectors
+            self._matrix.flush()
+            
+            self._docs.seek(0, os.SEEK_END)
+            for line in lines:
+                self._docs.write(line)
+                self._offsets.append(self._offsets[-1] + len(line))
+            self._docs.flush()
+            os.fsync(self._docs.fileno())
+            for position, doc_id in enumerate(ids, count):
+                self._ids.append(doc_id)
+                self._positions[doc_id] = position
+                
+            count += len(vectors)
+            write_atomic(
+                self.directory / MANIFEST_FILE,
+                json.dumps({"count": count, "doc_bytes": self._offsets[-1],
+                            "dimension": int(vectors.shape[1])}).encode("utf-8")
+            )
+            self._view = (self._matrix, np.concatenate([norms, self._row_norms(vectors)]), count)
+    
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """嵌入并追加文本（LangChain接口）"""
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self.add_embeddings(ids, texts, metadatas, self._embeddings.embed_documents(texts))
+        return ids
+    
+    def search(self, queries: np.ndarray, k: int,
+               selection: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """精确top-k搜索，返回(平方L2距离, 行号)，形状均为(查询数, k')
+        
+        selection为允许返回的行号（元数据预过滤结果），只在这些行上计算。
+        """
+        matrix, norms, count = self._view
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        rows = None
+        if selection is not None:
+            rows = np.asarray(selection, dtype=np.int64)
+            rows = rows[rows < count]
+        candidates = count if rows is None else len(rows)
+        k = min(k, candidates)
+        if k <= 0:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+            
+        if rows is None:
+            data, data_norms = matrix[:count], norms
+        else:
+            data, data_norms = matrix[rows], norms[rows]
+        # ||x - q||² = ||x||² - 2x·q + ||q||²，每条查询只需一次矩阵-向量乘法
+        distances = data_norms[None, :] - 2.0 * (queries @ data.T)
+        distances += np.einsum("ij,ij->i", queries, queries)[:, None]
+        np.maximum(distances, 0.0, out=distances)
+        
+        top = np.empty((len(queries), k), dtype=np.int64)
+        for row, row_distances in enumerate(distances):
+            if k < candidates:
+                boundary = row_distances[np.argpartition(row_distances, k - 1)[k - 1]]
+                # 与第k名距离相同的行可能不止一个，全部取出后按(距离, 行号)排序，结果是确定的
+                selected = np.flatnonzero(row_distances <= boundary)
+            else:
+                selected = np.arange(candidates)
+            top[row] = selected[np.lexsort((selected, row_distances[selected]))][:k]
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        positions = top if rows is None else rows[top]
+        return top_distances, positions
+    
+    def id_at(self, position: int) -> str:
+        """按行号取片段ID"""
+        return self._ids[position]
+    
+    def document_at(self, position: int) -> Document:
+        """按行号读取文档"""
+        start, end = self._offsets[position], self._offsets[position + 1]
+        item = json.loads(os.pread(self._docs.fileno(), end - start, start))
+        return Document(page_content=item["page_content"], metadata=item["metadata"])
+    
+    def vectors_for_ids(self, ids: List[str]) -> Optional[np.ndarray]:
+        """按片段ID取回已保存的向量，有ID不存在时返回None"""
+        matrix, _, count = self._view
+        positions = [self._positions.get(doc_id) for doc_id in ids]
+        if matrix is None or any(position is None or position >= count for position in positions):
+            return None
+        return np.asarray(matrix[positions], dtype=np.float32)
+    
+    def get_by_ids(self, ids: Iterable[str]) -> Dict[str, Document]:
+        """按片段ID批量读取文档，不存在的ID被忽略"""
+        documents = {}
+        for doc_id in ids:
+            position = self._positions.get(doc_id)
+            if position is not None:
+                documents[doc_id] = self.document_at(position)
+        return documents
+    
+    def iter_documents(self) -> Iterator[Tuple[str, Document]]:
+        """按行号顺序遍历(片段ID, 文档)"""
+        for position in range(len(self)):
+            yield self._ids[position], self.document_at(position)
+    
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        """按向量搜索(文档, 距离)（LangChain接口）"""
+        distances, positions = self.search(np.asarray([embedding]), k)
+        return [(self.document_at(int(p)), float(d)) for d, p in zip(distances[0], positions[0])]
+    
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        """按查询文本搜索(文档, 距离)（LangChain接口）"""
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k)
+    
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        """按查询文本搜索文档（LangChain接口，供检索问答链使用）"""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+    
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding, metadatas: Optional[List[dict]] = None,
+                   directory: Optional[Path] = None, **kwargs: Any) -> "NumpyStore":
+        """从文本创建存储（LangChain接口），必须指定directory"""
+        if directory is None:
+            raise ValueError("NumpyStore.from_texts需要指定directory")
+        store = cls(directory, embedding)
+        store.add_texts(texts, metadatas)
+        return store
+    
+    def rewritten(self, positions: List[int], batch: int = 4096) -> "NumpyStore":
+        """只保留指定行，重写为紧凑的新文件并替换原目录，返回新的存储对象
+        
+        本对象仍持有旧文件的映射和句柄，进行中的查询不受影响，由调用方稍后关闭。
+        """
+        tmp_dir = self.directory.with_name(self.directory.name + ".tmp")
+        old_dir = self.directory.with_name(self.directory.name + ".old")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        store = NumpyStore(tmp_dir, self._embeddings)
+        matrix = self._view[0]
+        for start in range(0, len(positions), batch):
+            rows = [int(position) for position in positions[start:start + batch]]
+            documents = [self.document_at(row) for row in rows]
+            store.add_embeddings(
+                [self._ids[row] for row in rows],
+                [doc.page_content for doc in documents],
+                [doc.metadata for doc in documents],
+                matrix[rows]
+            )
+        store.close()
+        
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+        os.replace(self.directory, old_dir)
+        os.replace(tmp_dir, self.directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return NumpyStore(self.directory, self._embeddings)
+    
+    def close(self) -> None:
+        """关闭文档文件；矩阵映射在最后一个引用释放时关闭"""
+        self._docs.close()
@@ -0,0 +1,173 @@
+"""
+ONNX嵌入模型后端模块
+"""
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MODEL_FILE = "model.onnx"
+POOLING_FILE = "pooling.json"
+
+def artifact_dir(model_name: str, cache_dir: Path, quantize: bool) -> Path:
+    """导出产物目录：按模型名和精度区分"""
+    safe_name = re.sub(r"[^0-9A-Za-z._-]+", "_", model_name)
+    return Path(cache_dir) / "onnx" / f"{safe_name}-{'int8' if quantize else 'fp32'}"
+
+def export_onnx_model(model_name: str, directory: Path, quantize: bool = True,
+                      cache_folder: Optional[Path] = None) -> Path:
+    """把sentence-transformers模型导出为ONNX（可选动态int8量化），返回产物目录
+    
+    同时保存分词器和池化配置，服务时不再依赖PyTorch。
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    
+    directory = Path(directory)
+    tmp_dir = directory.with_name(directory.name + ".tmp")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    
+    logger.info(f"开始导出ONNX嵌入模型: {model_name}")
+    model = SentenceTransformer(model_name, cache_folder=str(cache_folder) if cache_folder else None, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    
+    # 读取池化方式和是否归一化，保持与PyTorch路径的输出一致
+    pooling_mode = "mean"
+    normalize = False
+    for module in model:
+        config = getattr(module, "get_config_dict", lambda: {})()
+        if config.get("pooling_mode_cls_token"):
+            pooling_mode = "cls"
+        elif config.get("pooling_mode_max_tokens"):
+            pooling_mode = "max"
+        if type(module).__name__ == "Normalize":
+            normalize = True
+            
+    input_names = [name for name in tokenizer.model_input_names if name in ("input_ids", "attention_mask", "token_type_ids")]
+    sample = tokenizer(["导出样例"], return_tensors="pt")
+    
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+        
+        def forward(self, *inputs):
+            return self.inner(**dict(zip(input_names, inputs)))[0]
+            
+    fp32_path = tmp_dir / ("model.fp32.onnx" if quantize else MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer),
+            tuple(sample[name] for name in input_names),
+            str(fp32_path),
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names},
+                          "token_embeddings": {0: "batch", 1: "sequence"}},
+            opset_version=14
+        )
+        
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(fp32_path), str(tmp_dir / MODEL_FILE), weight_type=QuantType.QInt8)
+        fp32_path.unlink()
+        
+    tokenizer.save_pretrained(str(tmp_dir))
+    (tmp_dir / POOLING_FILE).write_text(json.dumps({
+        "model_name": model_name,
+        "pooling_mode": pooling_mode,
+        "normalize": normalize,
+        "max_seq_length": model.max_seq_length,
+        "input_names": input_names,
+        "quantized": quantize
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    
+    if directory.exists():
+        shutil.rmtree(directory)
+    tmp_dir.rename(directory)
+    logger.info(f"ONNX嵌入模型导出完成: {directory}")
+    return directory
+
+class OnnxEmbeddings(Embeddings):
+    """基于ONNX Runtime的CPU嵌入模型，首次使用时导出并缓存模型"""
+    
+    def __init__(self, model_name: str, cache_dir: Path, quantize: bool = True,
+                 batch_size: int = 32, num_threads: int = 0):
+        try:
+            import onnxruntime
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("ONNX嵌入后端需要安装onnxruntime和onnx: pip install onnxruntime onnx") from e
+            
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.directory = artifact_dir(model_name, cache_dir, quantize)
+        if not (self.directory / MODEL_FILE).exists():
+            export_onnx_model(model_name, self.directory, quantize, cache_folder=cache_dir)
+            
+        self.config: Dict[str, Any] = json.loads((self.directory / POOLING_FILE).read_text(encoding="utf-8"))
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.directory))
+        
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            str(self.directory / MODEL_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        logger.info(f"ONNX嵌入模型已加载: {self.directory}")
+    
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """对一个批次做前向计算并池化"""
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.config["max_seq_length"],
+            return_tensors="np"
+        )
+        inputs = {name: encoded[name].astype(np.int64) for name in self.config["input_names"]}
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        
+        if self.config["pooling_mode"] == "cls":
+            embeddings = token_embeddings[:, 0]
+        elif self.config["pooling_mode"] == "max":
+            embeddings = np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        else:
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            
+        if self.config["normalize"]:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """按长度排序后分批计算，减少填充，结果按原顺序返回"""
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            vectors = self._encode_batch([texts[i].replace("\n", " ") for i in batch])
+            for i, vector in zip(batch, vectors):
+                results[i] = vector.tolist()
+        return results
+    
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入单条查询"""
+        return self.embed_documents([text])[0]
@@ -0,0 +1,262 @@
+"""
+FAISS原始向量存储模块
+"""
+import json
+import os
+import shutil
+import threading
+from array import array
+from pathlib import Path
+from typing import List, Optional, Iterable, Callable, Sequence
+
+import numpy as np
+
+from core.record_log import write_atomic
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+RAW_VECTORS_DIR = "faiss_raw"
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.jsonl"
+MANIFEST_FILE = "manifest.json"
+INITIAL_CAPACITY = 1024
+
+class RawVectorStore:
+    """按FAISS位置保存入库时的float32向量（与索引中的值相同，未经量化）
+    
+    压缩存储的索引只保留有损编码，精排和重建索引从这里读取原始值，不再调用嵌入模型。
+    向量保存在预分配容量的.npy矩阵中并以内存映射方式读取；每行的片段ID追加到JSONL，
+    加载时用来核对与FAISS的位置是否一致。写入顺序为向量、ID、清单，
+    清单之外的部分（写入中途崩溃）在加载时丢弃。
+    """
+    
+    def __init__(self, directory: Path, model: Optional[str] = None, read_only: bool = False):
+        self.directory = Path(directory)
+        self.read_only = read_only
+        old_dir = self.directory.with_name(self.directory.name + ".old")
+        if not read_only:
+            if not self.directory.exists() and old_dir.exists():
+                # 重写在两次目录替换之间中断，恢复原目录
+                os.replace(old_dir, self.directory)
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.model = model
+        self._matrix = None
+        self._ids: List[str] = []
+        self._offsets = array("q", [0])
+        self._ids_file = None
+        # 查询读取的一致视图(矩阵, 行数)，写入完成后整体替换
+        self._view = (None, 0)
+        self._lock = threading.RLock()
+        self._load()
+    
+    def __len__(self) -> int:
+        return self._view[1]
+    
+    @property
+    def ids(self) -> List[str]:
+        """按位置排列的片段ID"""
+        return self._ids[:len(self)]
+    
+    @property
+    def dimension(self) -> Optional[int]:
+        """向量维度，尚未写入时为None"""
+        return None if self._matrix is None else int(self._matrix.shape[1])
+    
+    def _load(self) -> None:
+        """按清单加载已提交的行"""
+        manifest_path = self.directory / MANIFEST_FILE
+        info = {"count": 0, "ids_bytes": 0}
+        if manifest_path.exists():
+            info = json.loads(manifest_path.read_text(encoding="utf-8"))
+        count = info["count"]
+        stored_model = info.get("model")
+        if stored_model and self.model and stored_model != self.model:
+            logger.error(f"原始向量由嵌入模型{stored_model}生成，当前为{self.model}，需要重新构建向量库")
+        self.model = stored_model or self.model
+        
+        ids_path = self.directory / IDS_FILE
+        if self.read_only:
+            self._ids_file = open(ids_path, "rb") if ids_path.exists() else None
+        else:
+            self._ids_file = open(ids_path, "a+b")
+            if os.fstat(self._ids_file.fileno()).st_size > info["ids_bytes"]:
+                logger.warning("原始向量存储的ID文件含未提交的记录，已截断")
+                self._ids_file.truncate(info["ids_bytes"])
+        if self._ids_file is not None:
+            self._ids_file.seek(0)
+            for line in self._ids_file:
+                if self._offsets[-1] + len(line) > info["ids_bytes"]:
+                    break
+                self._ids.append(json.loads(line))
+                self._offsets.append(self._offsets[-1] + len(line))
+        if len(self._ids) != count:
+            raise RuntimeError(f"原始向量存储损坏：清单记录{count}行，ID文件有{len(self._ids)}行")
+        
+        vectors_path = self.directory / VECTORS_FILE
+        if vectors_path.exists():
+            self._matrix = np.load(str(vectors_path), mmap_mode="r" if self.read_only else "r+")
+            self._view = (self._matrix, count)
+    
+    def _reserve(self, rows: int, dimension: int) -> None:
+        """保证矩阵容量，不足时按两倍扩容到新文件再原子替换（调用方需持有锁）"""
+        if self._matrix is not None:
+            if dimension != self._matrix.shape[1]:
+                raise ValueError(f"向量维度不一致: {dimension} != {self._matrix.shape[1]}")
+            if rows <= self._matrix.shape[0]:
+                return
+        capacity = max(INITIAL_CAPACITY, rows, 2 * (0 if self._matrix is None else self._matrix.shape[0]))
+        path = self.directory / VECTORS_FILE
+        tmp_path = path.with_name(path.name + ".tmp")
+        matrix = np.lib.format.open_memmap(str(tmp_path), mode="w+", dtype=np.float32, shape=(capacity, dimension))
+        count = self._view[1]
+        if count:
+            matrix[:count] = self._matrix[:count]
+        matrix.flush()
+        # 进行中的查询仍持有旧映射，旧文件在其释放前保持有效
+        os.replace(tmp_path, path)
+        self._matrix = matrix
+    
+    def _commit(self, count: int) -> None:
+        """原子写入清单（调用方需持有锁）"""
+        write_atomic(
+            self.directory / MANIFEST_FILE,
+            json.dumps({
+                "count": count,
+                "ids_bytes": self._offsets[count],
+                "dimension": self.dimension,
+                "model": self.model
+            }).encode("utf-8")
+        )
+    
+    def append(self, ids: List[str], vectors) -> None:
+        """在末尾追加与FAISS新位置对应的向量"""
+        if self.read_only:
+            raise RuntimeError("只读的原始向量存储不能写入")
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        if len(vectors) != len(ids):
+            raise ValueError(f"向量数{len(vectors)}与ID数{len(ids)}不一致")
+        lines = [json.dumps(str(doc_id), ensure_ascii=False).encode("utf-8") + b"\n" for doc_id in ids]
+        
+        with self._lock:
+            count = self._view[1]
+            self._reserve(count + len(vectors), vectors.shape[1])
+            self._matrix[count:count + len(vectors)] = vectors
+            self._matrix.flush()
+            
+            self._ids_file.seek(0, os.SEEK_END)
+            for line in lines:
+                self._ids_file.write(line)
+                self._offsets.append(self._offsets[-1] + len(line))
+            self._ids_file.flush()
+            os.fsync(self._ids_file.fileno())
+            self._ids.extend(str(doc_id) for doc_id in ids)
+            
+            count += len(vectors)
+            self._commit(count)
+            self._view = (self._matrix, count)
+    
+    def truncate(self, count: int) -> None:
+        """丢弃count之后的行（FAISS写入前中断留下的多余行）"""
+        with self._lock:
+            if count >= self._view[1]:
+                return
+            self._commit(count)
+            self._ids_file.truncate(self._offsets[count])
+            del self._ids[count:]
+            del self._offsets[count + 1:]
+            self._view = (self._matrix, count)
+    
+    def get(self, positions: Optional[Sequence[int]] = None) -> np.ndarray:
+        """按FAISS位置取回float32向量的副本；positions为None时取回全部行"""
+        matrix, count = self._view
+        if positions is None:
+            if matrix is None:
+                return np.zeros((0, 0), dtype=np.float32)
+            return np.array(matrix[:count], dtype=np.float32)
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) and (matrix is None or positions.max() >= count or positions.min() < 0):
+            raise IndexError(f"原始向量存储只有{count}行")
+        if matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.asarray(matrix[positions], dtype=np.float32)
+    
+    def aligned(self, ids: List[str], recover: Callable[[List[int]], np.ndarray]) -> "RawVectorStore":
+        """与FAISS位置顺序的片段ID对齐，返回对齐后的存储
+        
+        多出的尾部行被截断；只缺尾部时由recover(位置列表)补齐后追加；
+        其余不一致（如删除重写后未完成FAISS持久化）按ID重排并重写，取不到的行同样由recover补齐。
+        """
+        count = len(self)
+        if self._ids[:len(ids)] == ids:
+            self.truncate(len(ids))
+            return self
+        if count < len(ids) and self._ids[:count] == ids[:count]:
+            missing = list(range(count, len(ids)))
+            logger.warning(f"原始向量存储缺少{len(missing)}行，正在补齐")
+            self.append(ids[count:], recover(missing))
+            return self
+        
+        rows = {doc_id: row for row, doc_id in enumerate(self._ids[:count])}
+        missing = [position for position, doc_id in enumerate(ids) if doc_id not in rows]
+        logger.warning(f"原始向量存储与FAISS索引的位置不一致，按片段ID重排（需补齐{len(missing)}行）")
+        recovered = dict(zip(missing, recover(missing))) if missing else {}
+        
+        def batches(batch: int = 65536):
+            for start in range(0, len(ids), batch):
+                positions = range(start, min(start + batch, len(ids)))
+                stored = self.get([rows[ids[p]] for p in positions if p not in recovered])
+                block, taken = [], iter(stored)
+                for position in positions:
+                    block.append(recovered[position] if position in recovered else next(taken))
+                yield np.asarray(block, dtype=np.float32)
+        store = self.replaced(ids, batches())
+        self.close()
+        return store
+    
+    def rewritten(self, positions: List[int], batch: int = 65536) -> "RawVectorStore":
+        """只保留指定位置的行，重写为紧凑的新文件，返回新的存储对象"""
+        ids = self.ids
+        return self.replaced(
+            [ids[position] for position in positions],
+            (self.get(positions[start:start + batch]) for start in range(0, len(positions), batch))
+        )
+    
+    def replaced(self, ids: List[str], batches: Iterable[np.ndarray]) -> "RawVectorStore":
+        """用给定的ID和向量批次重写整个存储并替换原目录，返回新的存储对象
+        
+        本对象仍持有旧文件的映射，进行中的查询不受影响，由调用方稍后关闭。
+        """
+        tmp_dir = self.directory.with_name(self.directory.name + ".tmp")
+        old_dir = self.directory.with_name(self.directory.name + ".old")
+        write_raw_vectors(tmp_dir, ids, batches, self.model)
+        
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+        os.replace(self.directory, old_dir)
+        os.replace(tmp_dir, self.directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return RawVectorStore(self.directory, self.model)
+    
+    def close(self) -> None:
+        """关闭ID文件；矩阵映射在最后一个引用释放时关闭"""
+        if self._ids_file is not None:
+            self._ids_file.close()
+
+def write_raw_vectors(directory: Path, ids: List[str], batches: Iterable[np.ndarray],
+                      model: Optional[str] = None) -> None:
+    """把向量批次写成一个新的原始向量存储目录（目录已存在时先清空）"""
+    directory = Path(directory)
+    if directory.exists():
+        shutil.rmtree(directory)
+    store = RawVectorStore(directory, model)
+    written = 0
+    for vectors in batches:
+        store.append(ids[written:written + len(vectors)], vectors)
+        written += len(vectors)
+    if written != len(ids):
+        store.close()
+        raise ValueError(f"写入了{written}行向量，期望{len(ids)}行")
+    store.close()
@@ -0,0 +1,55 @@
+"""
+追加写入记录日志模块
+"""
+import os
+import pickle
+import struct
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 记录头：8字节小端长度前缀
+_RECORD_HEADER = struct.Struct("<Q")
+
+def append_record(file: BinaryIO, obj: Any, sync: bool = True) -> None:
+    """向已打开的日志文件追加一条记录"""
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    file.write(_RECORD_HEADER.pack(len(payload)))
+    file.write(payload)
+    file.flush()
+    if sync:
+        os.fsync(file.fileno())
+
+def read_records(path: Path) -> Iterator[Any]:
+    """逐条读取日志记录；末尾不完整的记录（写入中途崩溃）会被截断"""
+    path = Path(path)
+    good_offset = 0
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            (length,) = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                break
+            good_offset = f.tell()
+            yield pickle.loads(payload)
+            
+    if good_offset < path.stat().st_size:
+        logger.warning(f"日志末尾记录不完整，已截断: {path}")
+        with open(path, "r+b") as f:
+            f.truncate(good_offset)
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """先写临时文件再原子替换"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,156 @@
+"""
+交叉编码器重排序模块
+"""
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+from langchain.schema import Document
+
+from utils.cache import LRUCache
+from utils.text import content_hash, normalize_text
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class CrossEncoderReranker:
+    """用本地交叉编码器对(查询, 片段)打分并保留top-n
+    
+    未缓存的片段按长度排序后分批打分，减少填充；分数按(规范化查询, 片段内容哈希)缓存。
+    空闲时总是执行重排序；已有重排序在进行时，按最近实测耗时的p95和当前并发数预估排队后的耗时，
+    超过延迟预算，或同时进行的重排序已达上限时跳过重排序，直接按召回顺序截断。
+    """
+    
+    def __init__(self, model_name: str, cache_dir: Optional[Path] = None, batch_size: int = 16,
+                 max_length: int = 512, cache_size: int = 4096, latency_budget_ms: float = 0,
+                 max_concurrency: int = 0, latency_window: int = 64):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.latency_budget = latency_budget_ms / 1000.0
+        self.score_cache = LRUCache(cache_size)
+        self.reranked = 0
+        self.skipped_budget = 0
+        self.skipped_busy = 0
+        # 最近若干次需要模型打分的重排序的实测耗时（秒）
+        self._latencies = deque(maxlen=latency_window)
+        self._active = 0
+        self._state_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self._model = None
+        self._model_lock = threading.Lock()
+    
+    def _get_model(self):
+        """首次使用时加载交叉编码器"""
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                
+                cache_args = {"cache_dir": str(self.cache_dir)} if self.cache_dir is not None else {}
+                self._model = CrossEncoder(
+                    self.model_name,
+                    max_length=self.max_length,
+                    device="cpu",
+                    automodel_args=cache_args,
+                    tokenizer_args=cache_args
+                )
+                logger.info(f"交叉编码器已加载: {self.model_name}")
+            return self._model
+    
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """计算(查询, 片段)相关性分数，只对未缓存的片段分批打分"""
+        query_key = normalize_text(query)
+        keys = [(query_key, content_hash(text)) for text in texts]
+        scores = [self.score_cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            missing.sort(key=lambda i: len(texts[i]))
+            start = time.perf_counter()
+            predicted = self._get_model().predict(
+                [(query, texts[i]) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            with self._state_lock:
+                self._latencies.append(time.perf_counter() - start)
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                self.score_cache.put(keys[i], scores[i])
+        return scores
+    
+    def _latency_percentile(self, percentile: float) -> Optional[float]:
+        """最近实测耗时的分位数（秒），尚无观测时返回None（调用方需持有状态锁）"""
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+    
+    def _over_budget(self, query: str, texts: List[str]) -> bool:
+        """已有重排序在进行时，按实测p95和排队数预估耗时是否超过预算（调用方需持有状态锁）
+        
+        交叉编码器在CPU上运行，并发的重排序共享计算资源，排在n个进行中的请求之后约需(n+1)倍耗时。
+        """
+        if self.latency_budget <= 0 or self._active == 0:
+            return False
+        p95 = self._latency_percentile(95)
+        if p95 is None or p95 * (self._active + 1) <= self.latency_budget:
+            return False
+        # 分数全部命中缓存时不需要模型计算
+        query_key = normalize_text(query)
+        return any((query_key, content_hash(text)) not in self.score_cache for text in texts)
+    
+    def rerank(self, query: str, documents: List[Document], top_n: int) -> List[Document]:
+        """按交叉编码器分数重排并保留前top_n个；跳过重排序时保留召回顺序的前top_n个"""
+        if len(documents) <= 1:
+            return documents[:top_n]
+        texts = [doc.page_content for doc in documents]
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            self.skipped_busy += 1
+            logger.info("同时进行的重排序已达上限，跳过重排序")
+            return documents[:top_n]
+        with self._state_lock:
+            over_budget = self._over_budget(query, texts)
+            if over_budget:
+                self.skipped_budget += 1
+            else:
+                self._active += 1
+        if over_budget:
+            if self._slots is not None:
+                self._slots.release()
+            logger.info("排队后预计重排序耗时超过延迟预算，跳过重排序")
+            return documents[:top_n]
+            
+        try:
+            scores = self.score(query, texts)
+            self.reranked += 1
+        except Exception as e:
+            logger.error(f"重排序失败，使用召回顺序: {e}")
+            return documents[:top_n]
+        finally:
+            with self._state_lock:
+                self._active -= 1
+            if self._slots is not None:
+                self._slots.release()
+                
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)[:top_n]
+        return [documents[i] for i in order]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取重排序统计信息"""
+        with self._state_lock:
+            p50 = self._latency_percentile(50)
+            p95 = self._latency_percentile(95)
+            active = self._active
+        return {
+            "model": self.model_name,
+            "reranked": self.reranked,
+            "skipped_budget": self.skipped_budget,
+            "skipped_busy": self.skipped_busy,
+            "active": active,
+            "latency_p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 3) if p95 is not None else None,
+            "score_cache": self.score_cache.get_stats()
+        }
@@ -0,0 +1,179 @@
+"""
+LLM响应缓存模块
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from utils.cache import LRUCache
+from utils.text import content_hash
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+def response_cache_key(backend: str, model_name: str, full_prompt: str,
+                       temperature: float, max_tokens: int) -> str:
+    """计算响应缓存键：(后端, 模型名, 规范化后的完整提示, 温度, 最大生成长度)的哈希"""
+    namespace = json.dumps([backend, model_name, float(temperature), int(max_tokens)])
+    return content_hash(full_prompt, namespace=namespace)
+
+class ResponseCacheStore:
+    """基于SQLite的磁盘响应缓存，按写入时间过期，超过容量时LRU淘汰"""
+    
+    def __init__(self, path: Path, max_entries: int = 20000, ttl_seconds: float = 0):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._count = 0
+        self._initialize()
+    
+    def _initialize(self):
+        """初始化缓存数据库"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        logger.info(f"LLM响应缓存已加载: {self.path}，共{self._count}条")
+    
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and created_at <= now - self.ttl_seconds
+    
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，命中时刷新访问时间，过期条目直接删除"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self._is_expired(row[1], now):
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._count -= 1
+                self.expirations += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+    
+    def put(self, key: str, response: str) -> None:
+        """写入缓存，顺带清理过期条目，超过容量时按最近最少使用淘汰"""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            if self.ttl_seconds > 0:
+                expired = self._conn.execute(
+                    "DELETE FROM responses WHERE created_at <= ?", (now - self.ttl_seconds,)
+                ).rowcount
+                self.expirations += max(expired, 0)
+            self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                self.evictions += overflow
+            if self._conn.total_changes != before:
+                self._conn.commit()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+    
+    def close(self) -> None:
+        """关闭缓存数据库"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class ResponseCache:
+    """两级LLM响应缓存：进程内LRU在前，SQLite磁盘缓存在后，磁盘命中的条目回填到内存"""
+    
+    def __init__(self, memory_entries: int, ttl_seconds: float = 0,
+                 store: Optional[ResponseCacheStore] = None):
+        self.memory = LRUCache(memory_entries, ttl_seconds=ttl_seconds)
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中返回None"""
+        response = self.memory.get(key)
+        if response is None and self.store is not None:
+            response = self.store.get(key)
+            if response is not None:
+                self.memory.put(key, response)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+    
+    def put(self, key: str, response: str) -> None:
+        """同时写入两级缓存"""
+        self.memory.put(key, response)
+        if self.store is not None:
+            try:
+                self.store.put(key, response)
+            except Exception as e:
+                logger.error(f"写入LLM响应缓存失败: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "memory": self.memory.get_stats(),
+            "disk": self.store.get_stats() if self.store is not None else None
+        }
+    
+    def close(self) -> None:
+        """关闭磁盘缓存"""
+        if self.store is not None:
+            self.store.close()
@@ -0,0 +1,182 @@
+"""
+语义缓存模块
+
+把历史查询的嵌入向量放在一个小的进程内矩阵中，新查询与其中最相似的查询
+余弦相似度达到阈值时直接复用之前的结果。相似度只是必要条件：查询中的城市、
+预算和日期等规划参数也必须完全相同，避免只差一个城市的查询拿到别人的规划。
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Hashable
+
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 常见城市（直辖市、省会及热门旅游城市），其余两字城市按“××市”识别
+_CITIES = (
+    "北京", "上海", "天津", "重庆", "广州", "深圳", "杭州", "南京", "苏州", "成都", "武汉", "西安",
+    "长沙", "郑州", "济南", "青岛", "大连", "沈阳", "长春", "哈尔滨", "石家庄", "太原", "呼和浩特",
+    "合肥", "福州", "厦门", "南昌", "南宁", "桂林", "海口", "三亚", "贵阳", "昆明", "大理", "丽江",
+    "拉萨", "兰州", "西宁", "银川", "乌鲁木齐", "宁波", "无锡", "佛山", "东莞", "珠海", "香港",
+    "澳门", "台北"
+)
+_CITY_PATTERN = re.compile("|".join(sorted(_CITIES, key=len, reverse=True)) + r"|[\u4e00-\u9fa5]{2}(?=市)")
+_BUDGET_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(千|k|K|万|w|W)?\s*(?:元|块|rmb|RMB|人民币)|预算\D{0,4}(\d+(?:\.\d+)?)\s*(千|k|K|万|w|W)?")
+_BUDGET_UNITS = {"千": 1000, "k": 1000, "K": 1000, "万": 10000, "w": 10000, "W": 10000}
+_DATE_PATTERN = re.compile(
+    r"\d{4}[-/.年]\d{1,2}[-/.月]\d{1,2}日?|\d{1,2}月\d{1,2}[日号]?|\d{1,2}[日号]"
+    r"|今天|明天|后天|今晚|明晚|这周[一二三四五六日天末]?|下周[一二三四五六日天末]?|周[一二三四五六日天末]"
+    r"|星期[一二三四五六日天]|七夕|情人节|白色情人节|圣诞节?|平安夜|跨年|元旦|春节|除夕|元宵|中秋|国庆|五一|劳动节|520|纪念日"
+)
+
+def plan_params(query: str) -> Tuple[Hashable, ...]:
+    """从查询中提取城市、预算和日期，作为语义缓存键的一部分
+    
+    未提到的参数为None；多个取值按出现顺序保留，预算统一换算为元。
+    """
+    cities = tuple(dict.fromkeys(_CITY_PATTERN.findall(query))) or None
+    budgets = []
+    for match in _BUDGET_PATTERN.finditer(query):
+        amount, unit = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+        budgets.append(float(amount) * _BUDGET_UNITS.get(unit, 1))
+    dates = tuple(dict.fromkeys(re.sub(r"[-/.年月]", "-", date).rstrip("日号") for date in _DATE_PATTERN.findall(query)))
+    return cities, tuple(budgets) or None, dates or None
+
+class SemanticCache:
+    """按查询语义相似度命中的结果缓存
+    
+    容量满时淘汰最久未命中的条目，ttl_seconds为0表示不过期。每次读写都带上
+    知识库的索引版本号，版本变化时整个缓存失效。params是必须完全相同的结构化参数
+    （如plan_params的结果），参数不同的条目即使相似度达到阈值也不命中。
+    """
+    
+    def __init__(self, max_entries: int, threshold: float, ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._entries: List[Optional[tuple]] = []
+        self._free: List[int] = []
+        # 行号 → None，按最近命中排序
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._lru)
+    
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+    
+    def _check_version(self, version: Any) -> None:
+        """知识库版本变化时清空缓存"""
+        if version != self._version:
+            if self._lru:
+                self.invalidations += 1
+                logger.info(f"知识库已变更，清空语义缓存（{len(self._lru)}条）")
+            self._clear()
+            self._version = version
+    
+    def _clear(self) -> None:
+        self._matrix = None
+        self._entries = []
+        self._free = []
+        self._lru.clear()
+    
+    def _remove(self, row: int) -> None:
+        self._entries[row] = None
+        self._matrix[row] = 0.0
+        self._lru.pop(row, None)
+        self._free.append(row)
+    
+    def get(self, vector: List[float], version: Any = None,
+            params: Hashable = None) -> Optional[Tuple[Any, float, str]]:
+        """查找最相似的历史查询，命中时返回(缓存值, 相似度, 历史查询)"""
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_version(version)
+            if not self._lru or self._matrix is None or self._matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+                
+            scores = self._matrix @ query
+            now = time.monotonic()
+            while True:
+                row = int(np.argmax(scores))
+                if scores[row] < self.threshold:
+                    self.misses += 1
+                    return None
+                entry = self._entries[row]
+                if entry is None:
+                    # 空闲行
+                    scores[row] = -np.inf
+                    continue
+                text, value, expires_at, entry_params = entry
+                if expires_at is not None and expires_at <= now:
+                    self._remove(row)
+                    self.expirations += 1
+                    scores[row] = -np.inf
+                    continue
+                if entry_params != params:
+                    scores[row] = -np.inf
+                    continue
+                self._lru.move_to_end(row)
+                self.hits += 1
+                return value, float(scores[row]), text
+    
+    def put(self, text: str, vector: List[float], value: Any, version: Any = None,
+            params: Hashable = None) -> None:
+        """写入一条查询及其结果，容量满时淘汰最久未命中的条目"""
+        if self.max_entries <= 0:
+            return
+        query = self._normalize(vector)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        with self._lock:
+            self._check_version(version)
+            if self._matrix is None or self._matrix.shape[1] != query.shape[0]:
+                self._clear()
+                self._matrix = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+                self._entries = [None] * self.max_entries
+                self._free = list(range(self.max_entries - 1, -1, -1))
+            if not self._free:
+                oldest = next(iter(self._lru))
+                self._remove(oldest)
+                self.evictions += 1
+            row = self._free.pop()
+            self._matrix[row] = query
+            self._entries[row] = (text, value, expires_at, params)
+            self._lru[row] = None
+    
+    def clear(self) -> None:
+        """清空缓存（统计计数保留）"""
+        with self._lock:
+            self._clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
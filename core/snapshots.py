@@ -0,0 +1,261 @@
+"""
+向量索引版本快照模块
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+from config.settings import settings
+from core.record_log import write_atomic
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SNAPSHOT_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "snapshot.json"
+BUILDING_SUFFIX = ".building"
+WORKING_DIR = "working"
+_VERSION_PATTERN = re.compile(r"^v-(\d{6})")
+
+def snapshot_root(base_dir: Path) -> Path:
+    """快照版本所在目录"""
+    return Path(base_dir) / SNAPSHOT_DIR
+
+def list_versions(base_dir: Path) -> List[str]:
+    """已发布（构建完成）的版本，按版本号升序"""
+    root = snapshot_root(base_dir)
+    if not root.exists():
+        return []
+    return sorted(
+        path.name for path in root.iterdir()
+        if path.is_dir() and _VERSION_PATTERN.match(path.name) and not path.name.endswith(BUILDING_SUFFIX)
+    )
+
+def read_current(base_dir: Path) -> Optional[Dict[str, Any]]:
+    """读取CURRENT指针，不存在、损坏或指向缺失目录时返回None"""
+    path = Path(base_dir) / CURRENT_FILE
+    if not path.exists():
+        return None
+    try:
+        info = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError as e:
+        logger.warning(f"快照指针文件损坏，忽略: {e}")
+        return None
+    if not (snapshot_root(base_dir) / str(info.get("version"))).is_dir():
+        logger.warning(f"快照指针指向的版本不存在: {info.get('version')}")
+        return None
+    return info
+
+def resolve_current(base_dir: Path) -> Tuple[Optional[str], Path]:
+    """返回(当前版本, 索引目录)；尚未发布过快照时使用base_dir本身（旧布局）"""
+    info = read_current(base_dir)
+    if info is None:
+        return None, Path(base_dir)
+    return info["version"], snapshot_root(base_dir) / info["version"]
+
+def publish(base_dir: Path, version: str, info: Optional[Dict[str, Any]] = None) -> None:
+    """原子替换CURRENT指针，运行中的服务在下一次轮询时切换到该版本"""
+    record = dict(info or {})
+    record.update({"version": version, "published_at": time.time()})
+    write_atomic(Path(base_dir) / CURRENT_FILE, json.dumps(record, ensure_ascii=False).encode("utf-8"))
+    logger.info(f"快照版本已发布: {version}")
+
+def checkout(directory: Path, resume: bool = False) -> Path:
+    """返回已发布版本的可写工作副本目录
+    
+    已发布的版本不可变：服务之后的写入（新增片段、增量段、淘汰）都落在同级working/下的副本中，
+    回滚或重新切换到该版本时看到的仍是发布时的内容。resume为True时沿用该版本最新的副本
+    （进程重启后继续此前的写入），否则总是复制出新的副本。
+    """
+    directory = Path(directory)
+    root = directory.parent / WORKING_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    pattern = re.compile(rf"^{re.escape(directory.name)}\.(\d+)$")
+    numbers = sorted(int(match.group(1)) for match in map(pattern.match, os.listdir(root)) if match)
+    if resume and numbers:
+        return root / f"{directory.name}.{numbers[-1]}"
+    
+    # 与构建目录相同：先复制到.building目录，完成后改名，多个进程并发时由mkdir保证唯一
+    number = numbers[-1] if numbers else 0
+    while True:
+        number += 1
+        building = root / f"{directory.name}.{number}{BUILDING_SUFFIX}"
+        try:
+            building.mkdir()
+            break
+        except FileExistsError:
+            continue
+    shutil.copytree(directory, building, dirs_exist_ok=True)
+    target = root / f"{directory.name}.{number}"
+    os.replace(building, target)
+    logger.info(f"已复制快照版本{directory.name}的工作副本: {target}")
+    return target
+
+def discard_working_copy(directory: Path) -> None:
+    """删除不再使用的工作副本；已发布的版本目录不受影响"""
+    directory = Path(directory)
+    if directory.parent.name == WORKING_DIR:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def collect_garbage(base_dir: Path, keep: int) -> List[str]:
+    """删除旧版本，保留最新的keep个版本和CURRENT指向的版本"""
+    versions = list_versions(base_dir)
+    protected = set(versions[-keep:]) if keep > 0 else set()
+    current = read_current(base_dir)
+    if current is not None:
+        protected.add(current["version"])
+        
+    removed = []
+    for version in versions:
+        if version in protected:
+            continue
+        shutil.rmtree(snapshot_root(base_dir) / version, ignore_errors=True)
+        removed.append(version)
+    working = snapshot_root(base_dir) / WORKING_DIR
+    if removed and working.exists():
+        for path in working.iterdir():
+            if path.name.split(".")[0] in removed:
+                shutil.rmtree(path, ignore_errors=True)
+    if removed:
+        logger.info(f"已回收旧快照版本: {', '.join(removed)}")
+    return removed
+
+class SnapshotBuilder:
+    """在新的版本目录中从头构建索引，完成后发布
+    
+    构建目录带.building后缀，完成并落盘后才改名为正式版本，
+    因此读取方只会看到完整的版本；已发布的版本不再被构建过程修改。
+    """
+    
+    def __init__(self, base_dir: Optional[Path] = None, embeddings=None, keep: Optional[int] = None):
+        self.base_dir = Path(base_dir or settings.VECTOR_DB_DIR)
+        # 与线上VectorStore共用嵌入模型时可直接复用其嵌入缓存
+        self.embeddings = embeddings
+        self.keep = settings.SNAPSHOT_KEEP if keep is None else keep
+    
+    def _claim_version(self) -> Tuple[str, Path]:
+        """分配下一个版本号并创建构建目录；多个构建进程并发时由mkdir保证唯一"""
+        root = snapshot_root(self.base_dir)
+        root.mkdir(parents=True, exist_ok=True)
+        while True:
+            numbers = [int(match.group(1)) for match in map(_VERSION_PATTERN.match, os.listdir(root)) if match]
+            version = f"v-{max(numbers, default=0) + 1:06d}"
+            building = root / (version + BUILDING_SUFFIX)
+            try:
+                building.mkdir()
+                return version, building
+            except FileExistsError:
+                continue
+    
+    def build(self, source, publish_version: bool = True) -> Dict[str, Any]:
+        """构建新版本并返回版本信息；source可以是数据源对象，也可以是Document/字符串的可迭代对象"""
+        from core.ingest import IterableSource, StreamingIngestor
+        from core.vector_store import VectorStore
+        
+        if not hasattr(source, "read"):
+            source = IterableSource(source)
+        version, building = self._claim_version()
+        logger.info(f"开始构建快照版本{version}: {source.name or '迭代器'}")
+        start = time.perf_counter()
+        store = None
+        try:
+            store = VectorStore(root=building, embeddings=self.embeddings)
+            checkpoint_dir = building / "ingest_checkpoints"
+            report = StreamingIngestor(store, checkpoint_dir=checkpoint_dir).run(source, resume=False)
+            document_count = store.get_collection_stats().get("document_count")
+            # 合并增量段并保存词法索引快照，加载新版本时无需重放日志
+            store.close(compact=True)
+            store = None
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+            
+            info = {
+                "version": version,
+                "source": source.name,
+                "documents": report["total_documents"],
+                "chunks": document_count,
+                "build_seconds": round(time.perf_counter() - start, 3),
+                "created_at": time.time()
+            }
+            write_atomic(building / MANIFEST_FILE, json.dumps(info, ensure_ascii=False).encode("utf-8"))
+            os.replace(building, snapshot_root(self.base_dir) / version)
+            
+        except Exception as e:
+            logger.error(f"构建快照版本{version}失败: {e}")
+            if store is not None:
+                store.close()
+            shutil.rmtree(building, ignore_errors=True)
+            raise
+            
+        logger.info(f"快照版本{version}构建完成，耗时{info['build_seconds']}秒")
+        if publish_version:
+            publish(self.base_dir, version, info)
+            collect_garbage(self.base_dir, self.keep)
+        return info
+    
+    def build_in_background(self, source, publish_version: bool = True,
+                            on_done: Optional[Callable[[Optional[Dict[str, Any]]], None]] = None) -> threading.Thread:
+        """在后台线程中构建，完成（或失败）后以版本信息（失败时为None）回调"""
+        def run():
+            info = None
+            try:
+                info = self.build(source, publish_version)
+            except Exception as e:
+                logger.error(f"后台构建快照失败: {e}")
+            if on_done is not None:
+                on_done(info)
+                
+        thread = threading.Thread(target=run, name="snapshot-builder", daemon=True)
+        thread.start()
+        return thread
+
+class SnapshotWatcher:
+    """后台轮询CURRENT指针，指向新版本时让VectorStore加载并切换过去"""
+    
+    def __init__(self, vector_store, base_dir: Path, interval: float):
+        self.vector_store = vector_store
+        self.base_dir = Path(base_dir)
+        self.interval = interval
+        self._failed_version = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def check(self) -> bool:
+        """检查一次指针，发生切换时返回True"""
+        info = read_current(self.base_dir)
+        if info is None:
+            return False
+        version = info["version"]
+        # 加载失败的版本不反复重试，等待下一次发布
+        if version == self.vector_store.snapshot_version or version == self._failed_version:
+            return False
+        if self.vector_store.activate_snapshot(version, snapshot_root(self.base_dir) / version):
+            return True
+        self._failed_version = version
+        return False
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"检查快照版本失败: {e}")
+    
+    def start(self) -> None:
+        """启动轮询线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="snapshot-watcher", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        """停止轮询线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
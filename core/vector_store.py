@@ -1,65 +1,176 @@
 """
 向量数据库核心模块
 """
+import json
 import os
-from typing import List, Dict, Any, Optional
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
 from pathlib import Path
 
-from langchain_community.vectorstores import Chroma, FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import numpy as np
 from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 from config.settings import settings
+from core.chunking import ParallelSplitter, make_text_splitter
+from core.embedding_cache import CachedEmbeddings, EmbeddingCacheStore
+from core.lexical_index import BM25Index, reciprocal_rank_fusion
+from core.metadata_index import MetadataIndex, to_chroma_where
+from core.mmr import maximal_marginal_relevance
+from core.raw_vectors import RAW_VECTORS_DIR, RawVectorStore
+from core.dedup import SeenStore
+from core.eviction import INGESTED_AT, EvictionWorker, find_expired_ids
+from core.snapshots import SnapshotWatcher, checkout, discard_working_copy, resolve_current
+from utils.cache import LRUCache
+from utils.text import content_hash, normalize_text, normalize_url, source_url
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 class VectorStore:
-    """向量数据库管理类"""
+    """向量数据库管理类
     
-    def __init__(self):
-        self.vector_db = None
+    root为空时加载VECTOR_DB_DIR下CURRENT指针指向的快照版本（尚无快照时使用VECTOR_DB_DIR本身），
+    并在后台轮询指针，新版本发布后不重启即可切换；构建快照时传入构建目录和共用的嵌入模型。
+    已发布的快照不可变，服务打开的是它的工作副本，之后的写入都落在副本中。
+    """
+    
+    def __init__(self, root: Optional[Path] = None, embeddings=None):
+        if root is None:
+            self.snapshot_version, self.root = resolve_current(settings.VECTOR_DB_DIR)
+            if self.snapshot_version is not None:
+                self.root = self._working_copy(self.root, resume=True)
+        else:
+            self.snapshot_version, self.root = None, Path(root)
+        self.snapshot_watcher = None
+        self.eviction_worker = None
+        # (向量库, 元数据索引, 原始向量存储)：后两者都按向量位置寻址，三者作为一个元组整体发布，
+        # 查询一次取出，不会用旧的元数据索引或原始向量解释新向量库的位置
+        self._view = (None, None, None)
+        # 实际使用的后端（"faiss"/"chroma"/"numpy"），Chroma失败回退到FAISS时与配置不同
+        self.backend = None
         self.embeddings = None
+        # 嵌入模型标识，记录在原始向量存储中，用于发现更换模型后的旧向量
+        self.embedding_key = None
         self.text_splitter = None
-        self._initialize()
+        self.parallel_splitter = None
+        self._faiss_log = None
+        self.read_only = False
+        self.lexical_index = None
+        self.seen_store = None
+        # 查询嵌入缓存与检索结果缓存；索引每次变更递增版本号，旧版本的结果不再命中
+        self.query_cache = LRUCache(settings.QUERY_CACHE_SIZE, settings.QUERY_CACHE_TTL)
+        self.result_cache = LRUCache(
+            settings.RESULT_CACHE_SIZE if settings.RESULT_CACHE_ENABLED else 0,
+            settings.RESULT_CACHE_TTL
+        )
+        self._index_version = 0
+        # 向量库对象被整体替换（切换快照、删除片段）后的回调，供持有vector_db引用的使用方刷新
+        self.on_replaced = None
+        # 写锁：保护索引修改与持久化快照
+        self._lock = threading.RLock()
+        self._initialize(embeddings)
+        
+        if root is None and settings.SNAPSHOT_POLL_SECONDS > 0:
+            self.snapshot_watcher = SnapshotWatcher(self, settings.VECTOR_DB_DIR, settings.SNAPSHOT_POLL_SECONDS)
+            self.snapshot_watcher.start()
+        if root is None and settings.EVICTION_INTERVAL_SECONDS > 0 and not self.read_only:
+            self.eviction_worker = EvictionWorker(self, settings.EVICTION_INTERVAL_SECONDS)
+            self.eviction_worker.start()
     
-    def _initialize(self):
+    def _initialize(self, embeddings=None):
         """初始化向量数据库"""
         try:
-            # 初始化嵌入模型
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=settings.EMBEDDING_MODEL,
-                cache_folder=str(settings.CACHE_DIR)
-            )
+            if embeddings is not None:
+                # 共用调用方的嵌入模型（已包装嵌入缓存）
+                self.embeddings = embeddings
+                self.embedding_key = getattr(embeddings, "model_name", None)
+            else:
+                # 初始化嵌入模型
+                self.embeddings, embedding_key = self._create_embeddings()
+                self.embedding_key = embedding_key
+                
+                # 包装嵌入缓存，重复片段不再重新计算嵌入
+                if settings.EMBEDDING_CACHE_ENABLED:
+                    self.embeddings = CachedEmbeddings(
+                        self.embeddings,
+                        model_name=embedding_key,
+                        store=EmbeddingCacheStore(
+                            settings.EMBEDDING_CACHE_PATH,
+                            max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES
+                        )
+                    )
             
             # 初始化文本分割器
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=settings.CHUNK_SIZE,
-                chunk_overlap=settings.CHUNK_OVERLAP,
-                length_function=len,
-                separators=["\n\n", "\n", " ", ""]
-            )
+            self.text_splitter = make_text_splitter(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+            if settings.SPLIT_WORKERS > 1:
+                self.parallel_splitter = ParallelSplitter(
+                    settings.CHUNK_SIZE,
+                    settings.CHUNK_OVERLAP,
+                    workers=settings.SPLIT_WORKERS,
+                    queue_size=settings.SPLIT_QUEUE_SIZE
+                )
             
             # 根据配置选择向量数据库类型
             if settings.VECTOR_DB_TYPE == "chroma":
                 self._init_chroma()
             elif settings.VECTOR_DB_TYPE == "faiss":
                 self._init_faiss()
+            elif settings.VECTOR_DB_TYPE == "numpy":
+                self._init_numpy()
             else:
                 raise ValueError(f"不支持的向量数据库类型: {settings.VECTOR_DB_TYPE}")
+            
+            if self.backend != "faiss" and settings.VECTOR_STORAGE_DTYPE != "float32":
+                logger.warning(f"{self.backend}后端不支持压缩向量存储，仍以float32保存")
+            
+            # 初始化与向量库并行维护的辅助索引
+            self._init_aux_indexes()
                 
-            logger.info(f"向量数据库初始化成功: {settings.VECTOR_DB_TYPE}")
+            logger.info(f"向量数据库初始化成功: {settings.VECTOR_DB_TYPE}（{self.snapshot_version or self.root}）")
             
         except Exception as e:
             logger.error(f"向量数据库初始化失败: {e}")
             raise
     
+    def _create_embeddings(self) -> tuple:
+        """按配置创建嵌入模型，返回(模型, 嵌入缓存命名空间)"""
+        if settings.EMBEDDING_BACKEND == "onnx":
+            from core.onnx_embeddings import OnnxEmbeddings
+            
+            embeddings = OnnxEmbeddings(
+                settings.EMBEDDING_MODEL,
+                settings.CACHE_DIR,
+                quantize=settings.EMBEDDING_ONNX_QUANTIZE,
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+                num_threads=settings.EMBEDDING_NUM_THREADS
+            )
+            # 量化模型的输出与PyTorch略有差异，嵌入缓存按后端区分
+            precision = "int8" if settings.EMBEDDING_ONNX_QUANTIZE else "fp32"
+            return embeddings, f"{settings.EMBEDDING_MODEL}#onnx-{precision}"
+        if settings.EMBEDDING_BACKEND != "torch":
+            raise ValueError(f"不支持的嵌入后端: {settings.EMBEDDING_BACKEND}")
+        
+        if settings.EMBEDDING_NUM_THREADS > 0:
+            import torch
+            torch.set_num_threads(settings.EMBEDDING_NUM_THREADS)
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        
+        embeddings = HuggingFaceEmbeddings(
+            model_name=settings.EMBEDDING_MODEL,
+            cache_folder=str(settings.CACHE_DIR),
+            encode_kwargs={"batch_size": settings.EMBEDDING_BATCH_SIZE}
+        )
+        return embeddings, settings.EMBEDDING_MODEL
+    
     def _init_chroma(self):
         """初始化Chroma向量数据库"""
-        persist_directory = str(settings.VECTOR_DB_DIR / "chroma")
+        persist_directory = str(self.root / "chroma")
         
         try:
+            from langchain_community.vectorstores import Chroma
+            
             if os.path.exists(persist_directory) and os.listdir(persist_directory):
                 # 尝试加载已存在的数据库
                 try:
@@ -67,6 +178,7 @@ class VectorStore:
                         persist_directory=persist_directory,
                         embedding_function=self.embeddings
                     )
+                    self.backend = "chroma"
                     logger.info("加载已存在的Chroma向量数据库")
                     return
                 except Exception as e:
@@ -87,6 +199,8 @@ class VectorStore:
     def _create_new_chroma(self, persist_directory: str):
         """创建新的Chroma数据库"""
         try:
+            from langchain_community.vectorstores import Chroma
+            
             # 确保目录存在
             os.makedirs(persist_directory, exist_ok=True)
             
@@ -95,6 +209,7 @@ class VectorStore:
                 embedding_function=self.embeddings,
                 persist_directory=persist_directory
             )
+            self.backend = "chroma"
             logger.info("创建新的Chroma向量数据库")
             
         except Exception as e:
@@ -113,9 +228,28 @@ class VectorStore:
     
     def _init_faiss(self):
         """初始化FAISS向量数据库"""
-        faiss_index_path = settings.VECTOR_DB_DIR / "faiss"
+        from langchain_community.vectorstores import FAISS
+        from core.faiss_mmap import has_serving_index, load_serving_index
+        
+        faiss_index_path = self.root / "faiss"
+        self.backend = "faiss"
         
         try:
+            if settings.FAISS_LOAD_MODE == "mmap":
+                serving_path = self.root / "faiss_serving"
+                if has_serving_index(serving_path):
+                    # 只读服务模式：内存映射加载，多个进程通过页缓存共享索引
+                    self.vector_db = load_serving_index(serving_path, self.embeddings)
+                    self.read_only = True
+                    self._attach_raw_vectors()
+                    logger.info("以内存映射方式加载FAISS只读服务索引")
+                    return
+                logger.warning(f"未找到只读服务索引{serving_path}，改为完整加载")
+            
+            if settings.FAISS_PERSIST_MODE == "incremental":
+                self._init_faiss_incremental(faiss_index_path)
+                return
+            
             if faiss_index_path.exists():
                 # 加载已存在的索引
                 self.vector_db = FAISS.load_local(
@@ -123,72 +257,775 @@ class VectorStore:
                     self.embeddings
                 )
                 logger.info("加载已存在的FAISS向量数据库")
+                with self._lock:
+                    self._attach_raw_vectors()
+                    self._prepare_loaded_faiss_index()
             else:
                 # 创建新的索引
                 self.vector_db = FAISS.from_texts(
                     ["初始化文档"],
                     self.embeddings
                 )
+                with self._lock:
+                    self._attach_raw_vectors()
                 logger.info("创建新的FAISS向量数据库")
                 
         except Exception as e:
             logger.error(f"FAISS初始化失败: {e}")
             raise
     
-    def add_documents(self, documents: List[Document]) -> None:
-        """添加文档到向量数据库"""
+    def _init_faiss_incremental(self, faiss_index_path: Path):
+        """以增量持久化模式初始化FAISS：加载基础索引并重放增量段"""
+        from langchain_community.vectorstores import FAISS
+        from core.faiss_persistence import FaissSegmentLog
+        
+        self._faiss_log = FaissSegmentLog(
+            faiss_index_path,
+            compact_threshold=settings.FAISS_COMPACT_THRESHOLD,
+            on_compacted=self.export_serving_index if settings.FAISS_SERVING_EXPORT else None
+        )
+        base_path = self._faiss_log.base_path()
+        
+        if base_path is not None:
+            self.vector_db = FAISS.load_local(str(base_path), self.embeddings)
+            self._faiss_log.replay(self.vector_db)
+            logger.info("加载已存在的FAISS向量数据库（增量模式）")
+            with self._lock:
+                self._attach_raw_vectors()
+                self._prepare_loaded_faiss_index()
+        else:
+            self.vector_db = FAISS.from_texts(
+                ["初始化文档"],
+                self.embeddings
+            )
+            with self._lock:
+                self._attach_raw_vectors()
+            # 立即写出基础索引，后续写入只追加增量段
+            self._faiss_log.compact(self.vector_db, self._lock, force=True)
+            logger.info("创建新的FAISS向量数据库（增量模式）")
+    
+    def _init_numpy(self):
+        """初始化纯NumPy向量存储（小语料，无需FAISS/Chroma）"""
+        from core.numpy_store import NumpyStore
+        
+        self.vector_db = NumpyStore(self.root / "numpy", self.embeddings)
+        self.backend = "numpy"
+    
+    def _init_aux_indexes(self):
+        """初始化BM25词法索引和去重集合；已有向量库但辅助索引缺失时从现有文档回填"""
+        if self.read_only:
+            lexical_path = self.root / "faiss_serving" / "lexical"
+        else:
+            lexical_path = self.root / "lexical"
+        self.lexical_index = BM25Index(
+            lexical_path,
+            journal_limit=settings.LEXICAL_JOURNAL_LIMIT,
+            max_df_ratio=settings.LEXICAL_MAX_DF_RATIO
+        )
+        if self.backend in ("faiss", "numpy"):
+            self._view = (self.vector_db, self._build_metadata_index(self.vector_db), self.raw_vectors)
+        if self.read_only:
+            return
+        
+        if settings.DEDUP_ENABLED:
+            self.seen_store = SeenStore(
+                self.root / "dedup",
+                capacity=settings.DEDUP_BLOOM_CAPACITY,
+                error_rate=settings.DEDUP_BLOOM_ERROR_RATE
+            )
+        
+        need_lexical = len(self.lexical_index) == 0
+        need_seen = self.seen_store is not None and len(self.seen_store) == 0
+        if not (need_lexical or need_seen):
+            return
+        
+        documents = list(self._iter_documents())
+        if not documents:
+            return
+        logger.info(f"从现有向量库回填辅助索引，共{len(documents)}个片段")
+        if need_lexical:
+            self.lexical_index.add((doc_id, doc.page_content) for doc_id, doc in documents)
+            self.lexical_index.save()
+        if need_seen:
+            self.seen_store.add_many(self._seen_entries(
+                [doc_id for doc_id, _ in documents],
+                [doc for _, doc in documents]
+            ))
+    
+    def _build_metadata_index(self, vector_db) -> MetadataIndex:
+        """按向量位置顺序为给定的向量库构建元数据索引（Chroma自带元数据索引，无需构建）
+        
+        只返回新索引，由调用方与向量库一起发布到_view。
+        """
+        metadata_index = MetadataIndex(settings.METADATA_INDEX_FIELDS)
+        ids, metadatas = [], []
+        if self.backend == "numpy":
+            for doc_id, doc in vector_db.iter_documents():
+                ids.append(doc_id)
+                metadatas.append(doc.metadata)
+        else:
+            deleted = []
+            for position in range(vector_db.index.ntotal):
+                doc_id = vector_db.index_to_docstore_id[position]
+                doc = vector_db.docstore.search(doc_id)
+                ids.append(str(doc_id))
+                metadatas.append(doc.metadata if isinstance(doc, Document) else {})
+                if not isinstance(doc, Document):
+                    # 文档已删除而向量尚未回收
+                    deleted.append(str(doc_id))
+        metadata_index.add(ids, metadatas)
+        if self.backend != "numpy":
+            metadata_index.tombstone(deleted)
+        logger.info(f"元数据索引构建完成，共{len(ids)}行")
+        return metadata_index
+    
+    @property
+    def vector_db(self):
+        """当前的向量库对象"""
+        return self._view[0]
+    
+    @vector_db.setter
+    def vector_db(self, vector_db) -> None:
+        # 单独替换向量库时旧的辅助结构不再对应，需随后重新构建并一起发布
+        self._view = (vector_db, None, None)
+    
+    @property
+    def metadata_index(self) -> Optional[MetadataIndex]:
+        """与当前向量库对应的元数据索引（Chroma后端为None）"""
+        return self._view[1]
+    
+    @property
+    def raw_vectors(self) -> Optional[RawVectorStore]:
+        """与当前FAISS索引按位置对应的float32原始向量（其他后端为None）"""
+        return self._view[2]
+    
+    def _attach_raw_vectors(self) -> None:
+        """打开原始向量存储并与刚加载的FAISS索引对齐，缺失的行补齐（调用方需持有写锁）
+        
+        只读服务模式使用导出时一起写出的副本，缺失或行数不符时不做精排。
+        """
+        from core.faiss_mmap import SERVING_RAW_DIR
+        
+        vector_db = self.vector_db
+        if self.read_only:
+            path = self.root / "faiss_serving" / SERVING_RAW_DIR
+            raw_vectors = RawVectorStore(path, read_only=True) if path.exists() else None
+            if raw_vectors is not None and len(raw_vectors) != vector_db.index.ntotal:
+                logger.warning(f"只读服务索引的原始向量行数不符，不做float32精排: {path}")
+                raw_vectors.close()
+                raw_vectors = None
+            self._view = (vector_db, None, raw_vectors)
+            return
+        
+        mapping = vector_db.index_to_docstore_id
+        ids = [str(mapping[position]) for position in range(vector_db.index.ntotal)]
+        raw_vectors = RawVectorStore(self.root / RAW_VECTORS_DIR, self.embedding_key)
+        raw_vectors = raw_vectors.aligned(ids, lambda positions: self._recover_raw_vectors(vector_db, positions))
+        self._view = (vector_db, None, raw_vectors)
+    
+    def _recover_raw_vectors(self, vector_db, positions: List[int]) -> np.ndarray:
+        """补齐原始向量存储缺少的行：无损索引按位置取回，压缩索引只能按片段内容重新嵌入（一次性迁移）"""
+        import faiss
+        from core.faiss_index import ensure_direct_map, is_compressed
+        
+        index = vector_db.index
+        vectors = np.zeros((len(positions), index.d), dtype=np.float32)
+        if not is_compressed(index):
+            ensure_direct_map(index)
+            for i, position in enumerate(positions):
+                vectors[i] = index.reconstruct(int(position))
+            return vectors
+        
+        logger.warning(f"压缩存储的索引缺少{len(positions)}个原始向量，按片段内容重新嵌入")
+        mapping = vector_db.index_to_docstore_id
+        texts = [vector_db.docstore.search(mapping[position]).page_content for position in positions]
+        batch_size = settings.INGEST_BATCH_SIZE
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            vectors[start:start + len(batch)] = np.asarray(self.embeddings.embed_documents(batch), dtype=np.float32)
+        if getattr(vector_db, "_normalize_L2", False):
+            faiss.normalize_L2(vectors)
+        return vectors
+    
+    @staticmethod
+    def _index_form(vector_db, vectors: List[List[float]]) -> np.ndarray:
+        """向量加入索引时的形式（索引做L2归一化时同样归一化），原始向量存储按此保存"""
+        vectors = np.array(vectors, dtype=np.float32)
+        if getattr(vector_db, "_normalize_L2", False):
+            import faiss
+            faiss.normalize_L2(vectors)
+        return vectors
+    
+    def _iter_documents(self):
+        """遍历向量库中的全部(片段ID, 文档)"""
+        if self.backend == "faiss":
+            for doc_id in list(self.vector_db.index_to_docstore_id.values()):
+                doc = self.vector_db.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    yield str(doc_id), doc
+        elif self.backend == "numpy":
+            yield from self.vector_db.iter_documents()
+        elif self.backend == "chroma":
+            collection = self.vector_db._collection
+            page_size = 1000
+            offset = 0
+            while True:
+                page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                if not page["ids"]:
+                    break
+                for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    yield doc_id, Document(page_content=text, metadata=metadata or {})
+                offset += page_size
+    
+    def _get_documents_by_ids(self, doc_ids: List[str]) -> Dict[str, Document]:
+        """按片段ID批量取回文档"""
+        if not doc_ids:
+            return {}
+        documents = {}
+        if self.backend == "faiss":
+            for doc_id in doc_ids:
+                doc = self.vector_db.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    documents[doc_id] = doc
+        elif self.backend == "numpy":
+            documents = self.vector_db.get_by_ids(doc_ids)
+        elif self.backend == "chroma":
+            page = self.vector_db._collection.get(ids=list(doc_ids), include=["documents", "metadatas"])
+            for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                documents[doc_id] = Document(page_content=text, metadata=metadata or {})
+        return documents
+    
+    def _persist_faiss(self, ids: List[str], texts: List[str],
+                       metadatas: List[Dict[str, Any]], vectors: List[List[float]]) -> None:
+        """持久化新增的FAISS向量（调用方需持有写锁）"""
+        if self._faiss_log is not None:
+            self._faiss_log.append(ids, texts, metadatas, vectors)
+            if self._faiss_log.should_compact():
+                self._faiss_log.compact_in_background(self.vector_db, self._lock)
+        else:
+            faiss_index_path = self.root / "faiss"
+            self.vector_db.save_local(str(faiss_index_path))
+    
+    def _prepare_loaded_faiss_index(self) -> None:
+        """为刚加载的索引建立直接映射，并检查是否需要按规模重建（调用方需持有写锁）"""
+        from core.faiss_index import ensure_direct_map
+        
+        ensure_direct_map(self.vector_db.index)
+        self._maybe_rebuild_faiss_index()
+    
+    def _faiss_source_vectors(self, positions: Optional[List[int]] = None) -> np.ndarray:
+        """按位置取回重建索引用的float32向量（调用方需持有写锁）
+        
+        从原始向量存储读取，不调用嵌入模型；压缩存储的索引重建时也不会叠加量化误差。
+        """
+        return self.raw_vectors.get(positions)
+    
+    def _maybe_rebuild_faiss_index(self) -> bool:
+        """语料规模跨过阈值时按配置重新选择并训练索引（调用方需持有写锁）"""
+        from core.faiss_index import build_index, choose_index_type, needs_rebuild
+        
+        index = self.vector_db.index
+        if self.read_only or not needs_rebuild(index):
+            return False
+        
+        index_type = choose_index_type(index.ntotal)
+        logger.info(f"FAISS语料规模达到{index.ntotal}，重建为{index_type}索引...")
+        # 按原位置顺序重新加入向量，index_to_docstore_id无需改动
+        self.vector_db.index = build_index(self._faiss_source_vectors(), index_type, index.metric_type)
+        self._invalidate_results()
+        
+        if self._faiss_log is not None:
+            self._faiss_log.compact_in_background(self.vector_db, self._lock, force=True)
+        else:
+            self.vector_db.save_local(str(self.root / "faiss"))
+        return True
+    
+    def compact(self) -> bool:
+        """把FAISS增量段合并进基础索引"""
+        if self._faiss_log is None:
+            return False
+        return self._faiss_log.compact(self.vector_db, self._lock)
+    
+    def activate_snapshot(self, version: str, directory: Path) -> bool:
+        """加载指定快照版本并原子切换，切换期间不阻塞查询
+        
+        新版本复制为工作副本后在锁外完整加载，随后只在写锁内替换引用；进行中的查询持有旧版本的引用，
+        直到完成前不受影响。旧版本的文件句柄在宽限期后关闭，其工作副本随之删除；
+        已发布的版本目录本身不会被写入，重新切换回该版本时得到的仍是发布时的内容。
+        """
+        working = None
         try:
-            # 分割文档
-            split_docs = self.text_splitter.split_documents(documents)
-            logger.info(f"文档分割完成，共{len(split_docs)}个片段")
+            working = self._working_copy(directory)
+            staged = VectorStore(root=working, embeddings=self.embeddings)
+        except Exception as e:
+            logger.error(f"加载快照版本{version}失败，继续使用当前版本: {e}")
+            if working is not None:
+                discard_working_copy(working)
+            return False
+        if staged._faiss_log is not None and staged._faiss_log.on_compacted is not None:
+            staged._faiss_log.on_compacted = self.export_serving_index
             
-            # 添加到向量数据库
-            if isinstance(self.vector_db, Chroma):
-                self.vector_db.add_documents(split_docs)
-                # 新版本Chroma自动持久化，不需要手动调用persist()
-                logger.info("文档已添加到Chroma数据库")
-            elif isinstance(self.vector_db, FAISS):
-                self.vector_db.add_documents(split_docs)
-                # 保存FAISS索引
-                faiss_index_path = settings.VECTOR_DB_DIR / "faiss"
-                self.vector_db.save_local(str(faiss_index_path))
-                logger.info("文档已添加到FAISS数据库")
+        with self._lock:
+            retired = (self._faiss_log, self.lexical_index, self.seen_store, self._closable_db(), self.raw_vectors)
+            retired_root = self.root
+            for name in ("_view", "backend", "_faiss_log", "read_only", "lexical_index", "seen_store", "root"):
+                setattr(self, name, getattr(staged, name))
+            self.snapshot_version = version
+            self._invalidate_results()
             
-            logger.info(f"成功添加{len(split_docs)}个文档片段到向量数据库")
+        timer = threading.Timer(settings.SNAPSHOT_SWAP_GRACE_SECONDS, self._retire, args=(retired, retired_root))
+        timer.daemon = True
+        timer.start()
+        logger.info(f"已切换到快照版本{version}")
+        self._notify_replaced()
+        return True
+    
+    @staticmethod
+    def _working_copy(directory: Path, resume: bool = False) -> Path:
+        """已发布快照的可写工作副本；只读服务模式不写入，直接使用快照目录"""
+        if settings.VECTOR_DB_TYPE == "faiss" and settings.FAISS_LOAD_MODE == "mmap":
+            from core.faiss_mmap import has_serving_index
+            if has_serving_index(Path(directory) / "faiss_serving"):
+                return Path(directory)
+        return checkout(directory, resume=resume)
+    
+    def _retire(self, resources: tuple, root: Path) -> None:
+        """关闭切换前版本的文件句柄，并删除其工作副本"""
+        self._release(*resources)
+        discard_working_copy(root)
+    
+    def _notify_replaced(self) -> None:
+        """通知使用方向量库对象已替换；回调失败只记录日志"""
+        if self.on_replaced is None:
+            return
+        try:
+            self.on_replaced()
+        except Exception as e:
+            logger.error(f"向量库替换回调失败: {e}")
+    
+    def _closable_db(self):
+        """需要随版本切换或关闭一起释放的向量库对象"""
+        return self.vector_db if self.backend == "numpy" else None
+    
+    @staticmethod
+    def _release(*resources) -> None:
+        """关闭文件句柄"""
+        for resource in resources:
+            if resource is None:
+                continue
+            try:
+                resource.close()
+            except Exception as e:
+                logger.warning(f"关闭索引文件失败: {e}")
+    
+    def close(self, compact: bool = False) -> None:
+        """停止快照轮询并关闭文件句柄；compact为True时先合并增量段并保存词法索引快照"""
+        if self.snapshot_watcher is not None:
+            self.snapshot_watcher.stop()
+            self.snapshot_watcher = None
+        if self.eviction_worker is not None:
+            self.eviction_worker.stop()
+            self.eviction_worker = None
+        if self.parallel_splitter is not None:
+            self.parallel_splitter.close()
+        if compact and not self.read_only:
+            if self._faiss_log is not None:
+                # 等待进行中的后台压缩结束，再把剩余增量段强制合并
+                self._faiss_log.wait()
+                self._faiss_log.compact(self.vector_db, self._lock, force=True)
+            if self.lexical_index is not None:
+                self.lexical_index.save()
+        self._release(self._faiss_log, self.lexical_index, self.seen_store, self._closable_db(), self.raw_vectors)
+    
+    def export_serving_index(self) -> None:
+        """导出供内存映射加载的只读服务索引"""
+        if self.backend != "faiss" or self.read_only:
+            return
+        import faiss
+        from core.faiss_index import build_index, choose_index_type
+        from core.faiss_mmap import export_serving_index
+        
+        try:
+            # 持锁复制索引和文档快照，写文件在锁外进行
+            with self._lock:
+                index = self.vector_db.index
+                live = self.metadata_index.select({})
+                documents = []
+                for position in live:
+                    doc_id = self.vector_db.index_to_docstore_id[int(position)]
+                    documents.append((doc_id, self.vector_db.docstore.search(doc_id)))
+                raw_vectors = self.raw_vectors.get(live)
+                metric = index.metric_type
+                index = faiss.clone_index(index) if len(live) == index.ntotal else None
+            if index is None:
+                # 服务索引按位置寻址，不能含已删除的向量：从原始向量构建只含剩余向量的索引
+                index = build_index(raw_vectors, choose_index_type(len(live)), metric)
+            serving_path = self.root / "faiss_serving"
+            export_serving_index(index, documents, serving_path, raw_vectors, self.embedding_key)
+            # 只读服务索引按位置寻址，词法索引的ID也随之改为位置
+            if self.lexical_index is not None:
+                self.lexical_index.remapped(
+                    {str(doc_id): str(position) for position, (doc_id, _) in enumerate(documents)},
+                    serving_path / "lexical"
+                )
+        except Exception as e:
+            logger.error(f"导出只读服务索引失败: {e}")
+    
+    def add_documents(self, documents: List[Document]) -> Dict[str, int]:
+        """添加文档到向量数据库，返回新增与跳过的片段数"""
+        try:
+            # 文档较多且启用并行分割时分批处理，分割与嵌入写入重叠进行
+            parallel = self.parallel_splitter is not None and len(documents) >= settings.SPLIT_PARALLEL_MIN_DOCS
+            if parallel:
+                size = settings.INGEST_READ_BATCH
+                batches = ((documents[i:i + size], None) for i in range(0, len(documents), size))
+            else:
+                batches = [(documents, None)]
+                
+            report = {"added": 0, "skipped": 0, "skipped_documents": 0}
+            split_count = 0
+            # 跳过来源URL已入库的文档并分割，再添加到向量数据库
+            for split_docs, skipped_documents, _ in self.prepare_batches(batches, parallel=parallel):
+                split_count += len(split_docs)
+                batch_report = self.add_chunks(split_docs)
+                report["added"] += batch_report["added"]
+                report["skipped"] += batch_report["skipped"]
+                report["skipped_documents"] += skipped_documents
+            logger.info(f"文档分割完成，共{split_count}个片段")
+            
+            logger.info(
+                f"成功添加{report['added']}个文档片段到向量数据库，"
+                f"跳过重复片段{report['skipped']}个、重复URL文档{report['skipped_documents']}个"
+            )
+            return report
             
         except Exception as e:
             logger.error(f"添加文档失败: {e}")
             raise
     
-    def add_texts(self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None) -> None:
-        """添加文本到向量数据库"""
+    def add_texts(self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None) -> Dict[str, int]:
+        """添加文本到向量数据库，返回新增与跳过的片段数
+        
+        与add_documents走同一路径：元数据中的来源URL已入库的文本整体跳过，并记录本次入库的URL。
+        """
         try:
-            # 分割文本
-            split_texts = self.text_splitter.split_texts(texts)
-            logger.info(f"文本分割完成，共{len(split_texts)}个片段")
-            
-            # 添加到向量数据库
-            if isinstance(self.vector_db, Chroma):
-                self.vector_db.add_texts(split_texts, metadatas)
-                logger.info("文本已添加到Chroma数据库")
-            elif isinstance(self.vector_db, FAISS):
-                self.vector_db.add_texts(split_texts, metadatas)
-                # 保存FAISS索引
-                faiss_index_path = settings.VECTOR_DB_DIR / "faiss"
-                self.vector_db.save_local(str(faiss_index_path))
-                logger.info("文本已添加到FAISS数据库")
-            
-            logger.info(f"成功添加{len(split_texts)}个文本片段到向量数据库")
+            metadatas = metadatas or [{} for _ in texts]
+            documents = [
+                Document(page_content=text, metadata=dict(metadata or {}))
+                for text, metadata in zip(texts, metadatas)
+            ]
+            return self.add_documents(documents)
             
         except Exception as e:
             logger.error(f"添加文本失败: {e}")
             raise
     
-    def similarity_search(self, query: str, k: int = None) -> List[Document]:
-        """相似性搜索"""
+    def prepare_batches(self, batches: Iterable[Tuple[List[Document], Any]],
+                        parallel: bool = True) -> Iterator[Tuple[List[Document], int, Any]]:
+        """过滤来源URL已入库的文档并分割，按输入顺序产出(片段列表, 跳过的文档数, 附带信息)
+        
+        启用并行分割时文档批次在进程池中分割，结果经有界队列交给调用方。URL在文档
+        送入进程池之前去重；前面批次的片段可能还未写入去重集合，本次已分发的URL单独记录。
+        """
+        submitted = set()
+        
+        def filtered():
+            for documents, tag in batches:
+                documents, skipped_documents = self._filter_indexed_urls(documents, submitted)
+                yield documents, (skipped_documents, tag)
+                
+        if parallel and self.parallel_splitter is not None:
+            stream = self.parallel_splitter.iter_split(filtered())
+        else:
+            stream = ((self.text_splitter.split_documents(documents), info) for documents, info in filtered())
+        for chunks, (skipped_documents, tag) in stream:
+            yield chunks, skipped_documents, tag
+    
+    def add_chunks(self, chunks: List[Document]) -> Dict[str, int]:
+        """把已分割的片段写入向量数据库，内容已入库的片段会被跳过"""
+        if self.read_only:
+            raise RuntimeError("只读服务模式下不能写入向量数据库")
+        chunks, skipped = self._filter_duplicate_chunks(chunks)
+        if not chunks:
+            return {"added": 0, "skipped": skipped}
+        
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [dict(chunk.metadata) for chunk in chunks]
+        # 记录入库时间，用于按TTL淘汰过期片段
+        ingested_at = time.time()
+        for metadata in metadatas:
+            metadata.setdefault(INGESTED_AT, ingested_at)
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        
+        if self.backend == "chroma":
+            self.vector_db.add_texts(texts, metadatas, ids=ids)
+            # 新版本Chroma自动持久化，不需要手动调用persist()
+            self.lexical_index.add(zip(ids, texts))
+            self._invalidate_results()
+            logger.info("片段已添加到Chroma数据库")
+        elif self.backend == "faiss":
+            # 在锁外计算嵌入，锁内只做索引写入和增量持久化
+            vectors = self.embeddings.embed_documents(texts)
+            with self._lock:
+                # 原始向量先于索引写入：查询看到的每个位置都能取到原始向量，
+                # 崩溃后多出的行在加载时按FAISS位置截断
+                raw_vectors = self.raw_vectors
+                start = self.vector_db.index.ntotal
+                raw_vectors.append(ids, self._index_form(self.vector_db, vectors))
+                try:
+                    self.vector_db.add_embeddings(
+                        list(zip(texts, vectors)),
+                        metadatas=metadatas,
+                        ids=ids
+                    )
+                except Exception:
+                    raw_vectors.truncate(start)
+                    raise
+                self.metadata_index.add(ids, metadatas)
+                self._persist_faiss(ids, texts, metadatas, vectors)
+                self._maybe_rebuild_faiss_index()
+                self.lexical_index.add(zip(ids, texts))
+                self._invalidate_results()
+            logger.info("片段已添加到FAISS数据库")
+        elif self.backend == "numpy":
+            vectors = self.embeddings.embed_documents(texts)
+            with self._lock:
+                self.vector_db.add_embeddings(ids, texts, metadatas, vectors)
+                self.metadata_index.add(ids, metadatas)
+                self.lexical_index.add(zip(ids, texts))
+                self._invalidate_results()
+            logger.info("片段已添加到NumPy向量存储")
+        
+        if self.seen_store is not None:
+            self.seen_store.add_many(self._seen_entries(ids, chunks))
+        return {"added": len(chunks), "skipped": skipped}
+    
+    def delete_documents(self, doc_ids: Iterable[str]) -> int:
+        """删除片段，返回实际删除的片段数
+        
+        FAISS后端先标记删除，已删除向量累计超过FAISS_TOMBSTONE_RATIO时才从原始向量重建紧凑的索引；
+        NumPy后端只保留剩余向量重写存储。重建在写锁内进行，只阻塞写入，
+        查询继续使用旧索引的引用直到切换。
+        """
+        if self.read_only:
+            raise RuntimeError("只读服务模式下不能删除片段")
+        doc_ids = {str(doc_id) for doc_id in doc_ids}
+        if not doc_ids:
+            return 0
+        
+        if self.backend == "faiss":
+            removed = self._delete_faiss(doc_ids)
+            if removed:
+                self._notify_replaced()
+        elif self.backend == "numpy":
+            removed = self._delete_numpy(doc_ids)
+            if removed:
+                self._notify_replaced()
+        else:
+            removed = list(self._get_documents_by_ids(list(doc_ids)))
+            if removed:
+                with self._lock:
+                    self.vector_db._collection.delete(ids=removed)
+                    self.lexical_index.remove(removed)
+                    self._invalidate_results()
+        
+        if removed and self.seen_store is not None:
+            # 删除去重记录，同一来源的新内容可以重新入库
+            self.seen_store.remove_doc_ids(removed)
+        logger.info(f"已删除{len(removed)}个片段")
+        return len(removed)
+    
+    def _delete_faiss(self, doc_ids: set) -> List[str]:
+        """从FAISS索引中删除片段
+        
+        通常只把片段标记为已删除：移出文档存储、元数据索引和词法索引，向量留在索引中，
+        持久化只追加一条删除记录。已删除向量的占比超过FAISS_TOMBSTONE_RATIO时，
+        才从原始向量存储重建只含剩余向量的索引（IVF同时重新训练）并写出新的基础索引。
+        """
+        with self._lock:
+            vector_db, metadata_index = self.vector_db, self.metadata_index
+            removed = [doc_id for doc_id in doc_ids if metadata_index.row_of(doc_id) is not None]
+            if not removed:
+                return []
+            if metadata_index.tombstones + len(removed) <= settings.FAISS_TOMBSTONE_RATIO * vector_db.index.ntotal:
+                metadata_index.tombstone(removed)
+                vector_db.docstore.delete(removed)
+                self.lexical_index.remove(removed)
+                self._invalidate_results()
+                if self._faiss_log is not None:
+                    self._faiss_log.append_deletes(removed)
+                else:
+                    vector_db.save_local(str(self.root / "faiss"))
+                return removed
+        # 重建在锁外发起：写出基础索引前要等待可能需要写锁的后台压缩结束
+        return self._compact_faiss(set(removed))
+    
+    def _compact_faiss(self, doc_ids: set) -> List[str]:
+        """删除片段并回收全部已删除的向量：重建只含剩余向量的索引并写出新的基础索引"""
+        import copy
+        from langchain.docstore.in_memory import InMemoryDocstore
+        from core.faiss_index import build_index, choose_index_type
+        
+        with self._lock:
+            old, metadata_index = self.vector_db, self.metadata_index
+            mapping = old.index_to_docstore_id
+            keep, removed = [], []
+            for position in range(old.index.ntotal):
+                doc_id = str(mapping[position])
+                if doc_id in doc_ids:
+                    removed.append(doc_id)
+                elif metadata_index.row_of(doc_id) == position:
+                    keep.append(position)
+            if not removed and not metadata_index.tombstones:
+                return []
+            
+            # 替换整个对象而不是修改字段，进行中的查询继续使用旧对象
+            old_raw_vectors = self.raw_vectors
+            vector_db = copy.copy(old)
+            vector_db.index = build_index(
+                self._faiss_source_vectors(keep), choose_index_type(len(keep)), old.index.metric_type
+            )
+            vector_db.index_to_docstore_id = {}
+            documents = {}
+            for new_position, position in enumerate(keep):
+                doc_id = mapping[position]
+                vector_db.index_to_docstore_id[new_position] = doc_id
+                documents[doc_id] = old.docstore.search(doc_id)
+            vector_db.docstore = InMemoryDocstore(documents)
+            
+            # 先为新的文档存储构建元数据索引、按新位置重写原始向量，再与向量库一起发布
+            raw_vectors = old_raw_vectors.rewritten(keep)
+            self._view = (vector_db, self._build_metadata_index(vector_db), raw_vectors)
+            self.lexical_index.remove(removed)
+            self._invalidate_results()
+            
+        timer = threading.Timer(settings.SNAPSHOT_SWAP_GRACE_SECONDS, self._release, args=(old_raw_vectors,))
+        timer.daemon = True
+        timer.start()
+        if self._faiss_log is not None:
+            # 已合并的基础索引和增量段中仍有被删除的向量：等待可能持有旧索引的后台压缩结束，
+            # 再强制写出新的基础索引
+            self._faiss_log.wait()
+            self._faiss_log.compact(self.vector_db, self._lock, force=True)
+        else:
+            with self._lock:
+                self.vector_db.save_local(str(self.root / "faiss"))
+        return removed
+    
+    def _delete_numpy(self, doc_ids: set) -> List[str]:
+        """从NumPy向量存储中删除片段：把剩余的行重写为紧凑的新文件"""
+        with self._lock:
+            old = self.vector_db
+            keep, removed = [], []
+            for position in range(len(old)):
+                doc_id = old.id_at(position)
+                if doc_id in doc_ids:
+                    removed.append(doc_id)
+                else:
+                    keep.append(position)
+            if not removed:
+                return []
+                
+            vector_db = old.rewritten(keep)
+            self._view = (vector_db, self._build_metadata_index(vector_db), None)
+            self.lexical_index.remove(removed)
+            self._invalidate_results()
+            
+        timer = threading.Timer(settings.SNAPSHOT_SWAP_GRACE_SECONDS, self._release, args=(old,))
+        timer.daemon = True
+        timer.start()
+        return removed
+    
+    def evict_expired(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """按EVICTION_TTL_*配置删除过期片段，返回淘汰的片段数等信息
+        
+        一次淘汰的全部过期片段合并为一次删除：FAISS后端只写一条删除记录，不重建索引。
+        """
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        if self.read_only:
+            return {"evicted": 0, "remaining": self._get_backend_stats().get("document_count"), "seconds": 0.0}
+        expired = find_expired_ids(
+            self._select_ids,
+            now,
+            settings.EVICTION_TTL_BY_TYPE,
+            settings.EVICTION_TTL_BY_CATEGORY,
+            settings.EVICTION_PINNED_TYPES
+        )
+        evicted = self.delete_documents(expired) if expired else 0
+        report = {
+            "evicted": evicted,
+            "remaining": self._get_backend_stats().get("document_count"),
+            "seconds": round(time.perf_counter() - start, 3)
+        }
+        if evicted:
+            logger.info(f"淘汰过期片段{evicted}个，剩余{report['remaining']}个，耗时{report['seconds']}秒")
+        return report
+    
+    def _select_ids(self, filter: Dict[str, Any]) -> List[str]:
+        """按元数据过滤条件返回全部满足条件的片段ID"""
+        if self.backend == "chroma":
+            return self.vector_db._collection.get(where=to_chroma_where(filter), include=[])["ids"]
+        metadata_index = self.metadata_index
+        return metadata_index.ids_at(metadata_index.select(filter))
+    
+    @staticmethod
+    def _seen_entries(ids: List[str], chunks: List[Document]) -> List[tuple]:
+        """生成去重集合的(键, 片段ID)记录：内容哈希，以及来源URL（如有）"""
+        entries = []
+        for doc_id, chunk in zip(ids, chunks):
+            entries.append(("c:" + content_hash(chunk.page_content), doc_id))
+            url = source_url(chunk.metadata)
+            if url:
+                entries.append(("u:" + normalize_url(url), doc_id))
+        return entries
+    
+    def _filter_duplicate_chunks(self, chunks: List[Document]) -> tuple:
+        """过滤内容已入库或在本批次内重复的片段"""
+        if self.seen_store is None or not chunks:
+            return chunks, 0
+        keys = ["c:" + content_hash(chunk.page_content) for chunk in chunks]
+        indexed = self.seen_store.contains_many(keys)
+        
+        kept = []
+        batch_keys = set()
+        for key, chunk in zip(keys, chunks):
+            if key in indexed or key in batch_keys:
+                continue
+            batch_keys.add(key)
+            kept.append(chunk)
+        return kept, len(chunks) - len(kept)
+    
+    def _filter_indexed_urls(self, documents: List[Document], submitted: Optional[set] = None) -> tuple:
+        """过滤来源URL已入库或已在submitted中（默认只在本批次内）的文档，保留的URL加入submitted"""
+        if self.seen_store is None:
+            return documents, 0
+        keys = [
+            "u:" + normalize_url(source_url(doc.metadata)) if source_url(doc.metadata) else None
+            for doc in documents
+        ]
+        indexed = self.seen_store.contains_many(key for key in keys if key)
+        
+        kept = []
+        batch_keys = set() if submitted is None else submitted
+        for key, doc in zip(keys, documents):
+            if key is not None:
+                if key in indexed or key in batch_keys:
+                    continue
+                batch_keys.add(key)
+            kept.append(doc)
+        return kept, len(documents) - len(kept)
+    
+    def similarity_search(self, query: str, k: int = None, nprobe: Optional[int] = None,
+                          ef_search: Optional[int] = None,
+                          filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """相似性搜索；nprobe/ef_search用于按查询调整近似索引的召回率与延迟
+        
+        filter按元数据预过滤，如{"category": "dating_tips"}或{"relevance_score": {"$gte": 0.5}}
+        """
         try:
             k = k or settings.TOP_K_RETRIEVAL
-            results = self.vector_db.similarity_search(query, k=k)
+            results = [doc for doc, _ in self._search_with_score(query, k, nprobe, ef_search, filter)]
             logger.info(f"相似性搜索完成，返回{len(results)}个结果")
             return results
             
@@ -196,11 +1033,13 @@ class VectorStore:
             logger.error(f"相似性搜索失败: {e}")
             return []
     
-    def similarity_search_with_score(self, query: str, k: int = None) -> List[tuple]:
+    def similarity_search_with_score(self, query: str, k: int = None, nprobe: Optional[int] = None,
+                                     ef_search: Optional[int] = None,
+                                     filter: Optional[Dict[str, Any]] = None) -> List[tuple]:
         """带分数的相似性搜索"""
         try:
             k = k or settings.TOP_K_RETRIEVAL
-            results = self.vector_db.similarity_search_with_score(query, k=k)
+            results = self._search_with_score(query, k, nprobe, ef_search, filter)
             logger.info(f"带分数的相似性搜索完成，返回{len(results)}个结果")
             return results
             
@@ -208,10 +1047,395 @@ class VectorStore:
             logger.error(f"带分数的相似性搜索失败: {e}")
             return []
     
+    def similarity_search_batch(self, queries: List[str], k: int = None, nprobe: Optional[int] = None,
+                                ef_search: Optional[int] = None,
+                                filter: Optional[Dict[str, Any]] = None) -> List[List[tuple]]:
+        """批量相似性搜索：一次批量嵌入 + 一次矩阵搜索，返回每条查询的(文档, 分数)列表"""
+        try:
+            if not queries:
+                return []
+            k = k or settings.TOP_K_RETRIEVAL
+            query_vectors = self._embed_queries(queries)
+            
+            if self.backend == "faiss":
+                hits = self._faiss_search(query_vectors, k, nprobe, ef_search, filter)
+            elif self.backend == "numpy":
+                hits = self._numpy_search(query_vectors, k, filter)
+            else:
+                hits = self._chroma_search(query_vectors, k, filter)
+            
+            results = [[(doc, score) for _, doc, score in row] for row in hits]
+            logger.info(f"批量相似性搜索完成，共{len(queries)}条查询")
+            return results
+            
+        except Exception as e:
+            logger.error(f"批量相似性搜索失败: {e}")
+            return [[] for _ in queries]
+    
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """批量嵌入查询文本，只对查询缓存未命中的文本做一次批量前向计算"""
+        keys = [normalize_text(query) for query in queries]
+        texts = {}
+        for key, query in zip(keys, queries):
+            texts.setdefault(key, query)
+        vectors = {key: self.query_cache.get(key) for key in texts}
+        missing = [key for key, vector in vectors.items() if vector is None]
+        if missing:
+            texts = [texts[key] for key in missing]
+            if isinstance(self.embeddings, CachedEmbeddings):
+                computed = self.embeddings.embed_queries(texts)
+            else:
+                computed = self.embeddings.embed_documents(texts)
+            for key, vector in zip(missing, computed):
+                self.query_cache.put(key, vector)
+                vectors[key] = vector
+        return [vectors[key] for key in keys]
+    
+    def retrieve(self, query: str, k: int = None, mode: Optional[str] = None,
+                 filter: Optional[Dict[str, Any]] = None, mmr: Optional[bool] = None) -> List[Document]:
+        """按检索模式召回文档：vector（稠密）/ lexical（BM25）/ hybrid（倒数排名融合）"""
+        return [doc for doc, _ in self.retrieve_with_score(query, k, mode, filter, mmr)]
+    
+    def retrieve_with_score(self, query: str, k: int = None, mode: Optional[str] = None,
+                            filter: Optional[Dict[str, Any]] = None,
+                            mmr: Optional[bool] = None) -> List[tuple]:
+        """按检索模式召回(文档, 分数)；hybrid模式的分数为RRF分数
+        
+        mmr为True时先召回MMR_FETCH_K个候选，再按最大边际相关性选出k个，去掉近似重复的片段；
+        为None时使用MMR_ENABLED配置。
+        """
+        try:
+            k = k or settings.TOP_K_RETRIEVAL
+            mode = mode or settings.RETRIEVAL_MODE
+            mmr = settings.MMR_ENABLED if mmr is None else mmr
+            if mmr:
+                fetch_k = max(settings.MMR_FETCH_K, k)
+                hits = self._cached_hits(
+                    ("retrieve", mode, normalize_text(query), k, self._filter_key(filter),
+                     "mmr", fetch_k, settings.MMR_LAMBDA),
+                    lambda: self._mmr_select(
+                        query, self._retrieve_hits(query, fetch_k, mode, filter), k, settings.MMR_LAMBDA
+                    )
+                )
+            else:
+                hits = self._cached_hits(
+                    ("retrieve", mode, normalize_text(query), k, self._filter_key(filter)),
+                    lambda: self._retrieve_hits(query, k, mode, filter)
+                )
+            return [(doc, score) for _, doc, score in hits]
+            
+        except Exception as e:
+            logger.error(f"检索失败: {e}")
+            return []
+    
+    def max_marginal_relevance_search(self, query: str, k: int = None, fetch_k: Optional[int] = None,
+                                      lambda_mult: Optional[float] = None,
+                                      filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """最大边际相关性搜索：先取fetch_k个稠密候选，再兼顾相关性与多样性选出k个
+        
+        lambda_mult为1时等同于普通相似性搜索，越小越偏向多样性。
+        """
+        try:
+            k = k or settings.TOP_K_RETRIEVAL
+            fetch_k = max(fetch_k or settings.MMR_FETCH_K, k)
+            lambda_mult = settings.MMR_LAMBDA if lambda_mult is None else lambda_mult
+            hits = self._cached_hits(
+                ("mmr", normalize_text(query), k, fetch_k, lambda_mult, self._filter_key(filter)),
+                lambda: self._mmr_select(query, self._vector_search(query, fetch_k, filter=filter), k, lambda_mult)
+            )
+            logger.info(f"MMR搜索完成，从{fetch_k}个候选中选出{len(hits)}个结果")
+            return [doc for _, doc, _ in hits]
+            
+        except Exception as e:
+            logger.error(f"MMR搜索失败: {e}")
+            return []
+    
+    def _mmr_select(self, query: str, hits: List[tuple], k: int, lambda_mult: float) -> List[tuple]:
+        """对(片段ID, 文档, 分数)候选做MMR多样化，保留原分数"""
+        if len(hits) <= k:
+            return hits
+        candidates = self._stored_vectors([doc_id for doc_id, _, _ in hits])
+        if candidates is None:
+            # 后端取不到向量时通过嵌入缓存取回（入库时已计算）
+            texts = [doc.page_content for _, doc, _ in hits]
+            candidates = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        query_vector = np.asarray(self._embed_query(query), dtype=np.float32)
+        order = maximal_marginal_relevance(query_vector, candidates, k, lambda_mult)
+        return [hits[i] for i in order]
+    
+    def _stored_vectors(self, doc_ids: List[str]) -> Optional[np.ndarray]:
+        """从向量库中取回片段已保存的向量（FAISS取自原始向量存储，与入库值一致），有片段取不到时返回None"""
+        vector_db, metadata_index, raw_vectors = self._view
+        if self.backend == "numpy":
+            return vector_db.vectors_for_ids(doc_ids)
+        if self.backend == "chroma":
+            page = vector_db._collection.get(ids=list(doc_ids), include=["embeddings"])
+            vectors = dict(zip(page["ids"], page["embeddings"] or []))
+            if any(doc_id not in vectors for doc_id in doc_ids):
+                return None
+            return np.asarray([vectors[doc_id] for doc_id in doc_ids], dtype=np.float32)
+        
+        index = vector_db.index
+        positions = []
+        for doc_id in doc_ids:
+            position = metadata_index.row_of(doc_id)
+            # 候选来自切换之前的查询时，片段在当前版本中可能已不存在或换了位置
+            if position is None or position >= index.ntotal or str(vector_db.index_to_docstore_id[position]) != doc_id:
+                return None
+            positions.append(position)
+        if raw_vectors is not None:
+            return raw_vectors.get(positions)
+        vectors = np.zeros((len(doc_ids), index.d), dtype=np.float32)
+        for i, position in enumerate(positions):
+            try:
+                vectors[i] = index.reconstruct(position)
+            except RuntimeError:
+                # 不支持按位置重建的索引类型
+                return None
+        return vectors
+    
+    def _retrieve_hits(self, query: str, k: int, mode: str,
+                       filter: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        """按检索模式召回(片段ID, 文档, 分数)"""
+        if mode == "vector":
+            return self._vector_search(query, k, filter=filter)
+        
+        lexical_hits = self._lexical_search(query, settings.HYBRID_LEXICAL_K if mode == "hybrid" else k, filter)
+        if mode == "lexical":
+            documents = self._get_documents_by_ids([doc_id for doc_id, _ in lexical_hits])
+            return [(doc_id, documents[doc_id], score) for doc_id, score in lexical_hits if doc_id in documents]
+        
+        if mode != "hybrid":
+            raise ValueError(f"不支持的检索模式: {mode}")
+        
+        # 词法召回廉价，稠密召回只取较小的top-k
+        vector_hits = self._vector_search(query, settings.HYBRID_VECTOR_K, filter=filter)
+        fused = reciprocal_rank_fusion(
+            [[doc_id for doc_id, _, _ in vector_hits], [doc_id for doc_id, _ in lexical_hits]],
+            k=settings.HYBRID_RRF_K
+        )[:k]
+        
+        documents = {doc_id: doc for doc_id, doc, _ in vector_hits}
+        documents.update(self._get_documents_by_ids(
+            [doc_id for doc_id, _ in fused if doc_id not in documents]
+        ))
+        results = [(doc_id, documents[doc_id], score) for doc_id, score in fused if doc_id in documents]
+        logger.info(f"混合检索完成，稠密{len(vector_hits)}个，词法{len(lexical_hits)}个，融合后{len(results)}个")
+        return results
+    
+    @staticmethod
+    def _filter_key(filter: Optional[Dict[str, Any]]) -> Optional[str]:
+        """过滤条件的规范化表示，用作缓存键"""
+        return json.dumps(filter, sort_keys=True, ensure_ascii=False, default=str) if filter else None
+    
+    def _cached_hits(self, key: tuple, compute) -> List[tuple]:
+        """检索结果缓存：只缓存(片段ID, 分数)，命中时按ID取回文档"""
+        if self.result_cache.max_entries <= 0:
+            return compute()
+        # 键中带上索引版本号，写入后旧结果自然失效，且不会被变更前开始的查询写回
+        key = (self._index_version,) + key
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            documents = self._get_documents_by_ids([doc_id for doc_id, _ in cached])
+            if len(documents) == len(cached):
+                return [(doc_id, documents[doc_id], score) for doc_id, score in cached]
+        hits = compute()
+        self.result_cache.put(key, [(doc_id, score) for doc_id, _, score in hits])
+        return hits
+    
+    def _invalidate_results(self) -> None:
+        """索引内容变更后使检索结果缓存失效"""
+        self._index_version += 1
+        self.result_cache.clear()
+    
+    def _embed_query(self, query: str) -> List[float]:
+        """嵌入单条查询，按规范化文本缓存"""
+        key = normalize_text(query)
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(query)
+            self.query_cache.put(key, vector)
+        return vector
+    
+    def _lexical_search(self, query: str, k: int, filter: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        """BM25检索，有过滤条件时在取top-k之前排除不满足条件的片段"""
+        if not filter:
+            return self.lexical_index.search(query, k)
+        # 两种后端都先得到满足条件的片段ID集合
+        if self.backend in ("faiss", "numpy"):
+            metadata_index = self.metadata_index
+            allowed_ids = set(metadata_index.ids_at(metadata_index.select(filter)))
+        else:
+            where = to_chroma_where(filter)
+            allowed_ids = set(self.vector_db._collection.get(where=where, include=[])["ids"])
+        return self.lexical_index.search(query, k, allowed=allowed_ids.__contains__)
+    
+    def _search_with_score(self, query: str, k: int, nprobe: Optional[int] = None,
+                           ef_search: Optional[int] = None,
+                           filter: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        """按后端执行单条稠密查询，返回(文档, 分数)列表"""
+        hits = self._cached_hits(
+            ("vector", normalize_text(query), k, nprobe, ef_search, self._filter_key(filter)),
+            lambda: self._vector_search(query, k, nprobe, ef_search, filter)
+        )
+        return [(doc, score) for _, doc, score in hits]
+    
+    def _vector_search(self, query: str, k: int, nprobe: Optional[int] = None,
+                       ef_search: Optional[int] = None,
+                       filter: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        """单条稠密查询，返回(片段ID, 文档, 距离)列表"""
+        query_vector = self._embed_query(query)
+        if self.backend == "faiss":
+            return self._faiss_search([query_vector], k, nprobe, ef_search, filter)[0]
+        if self.backend == "numpy":
+            return self._numpy_search([query_vector], k, filter)[0]
+        return self._chroma_search([query_vector], k, filter)[0]
+    
+    def _faiss_search(self, query_vectors: List[List[float]], k: int, nprobe: Optional[int] = None,
+                      ef_search: Optional[int] = None,
+                      filter: Optional[Dict[str, Any]] = None) -> List[List[tuple]]:
+        """在FAISS索引上执行矩阵搜索，每条查询返回(文档ID, 文档, 距离)列表"""
+        import faiss
+        from core.faiss_index import is_compressed, search_parameters, subset_search
+        
+        # 取一次引用，索引重建或替换不会影响进行中的查询
+        vector_db, metadata_index, raw_vectors = self._view
+        index = vector_db.index
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        if getattr(vector_db, "_normalize_L2", False):
+            faiss.normalize_L2(queries)
+        
+        # 元数据预过滤：得到允许返回的向量位置
+        selection = None
+        candidates = index.ntotal
+        if filter or metadata_index.tombstones:
+            # 已删除但尚未回收的向量同样通过候选位置排除
+            selection = metadata_index.select(filter or {})
+            selection = selection[selection < index.ntotal]
+            candidates = len(selection)
+        
+        # 压缩存储的索引多取候选，再用float32向量精排
+        rescoring = settings.VECTOR_RESCORE and raw_vectors is not None and is_compressed(index)
+        fetch_k = min(k * settings.VECTOR_RESCORE_FACTOR if rescoring else k, candidates)
+        if fetch_k <= 0:
+            return [[] for _ in range(len(queries))]
+        
+        if selection is not None and len(selection) <= settings.METADATA_FILTER_EXACT_MAX:
+            # 候选很少时直接在子集上精确计算
+            distances, positions = subset_search(index, queries, selection, fetch_k)
+        else:
+            # 过滤条件作为ID选择器传入ANN搜索，在遍历过程中跳过不满足条件的向量
+            params = search_parameters(index, nprobe, ef_search, selection)
+            if params is not None:
+                distances, positions = index.search(queries, fetch_k, params=params)
+            else:
+                distances, positions = index.search(queries, fetch_k)
+        
+        results = []
+        hit_positions = []
+        for row_distances, row_positions in zip(distances, positions):
+            hits = []
+            kept = []
+            for distance, position in zip(row_distances, row_positions):
+                if position == -1:
+                    continue
+                doc_id = vector_db.index_to_docstore_id[int(position)]
+                doc = vector_db.docstore.search(doc_id)
+                if isinstance(doc, Document):
+                    hits.append((str(doc_id), doc, float(distance)))
+                    kept.append(int(position))
+            results.append(hits)
+            hit_positions.append(kept)
+        
+        if rescoring:
+            results = self._rescore_hits(queries, results, hit_positions, raw_vectors, k, index.metric_type)
+        return results
+    
+    @staticmethod
+    def _rescore_hits(queries: np.ndarray, results: List[List[tuple]], hit_positions: List[List[int]],
+                      raw_vectors: RawVectorStore, k: int, metric: int) -> List[List[tuple]]:
+        """按FAISS位置取回候选片段的原始float32向量并重新计算精确分数"""
+        from core.faiss_index import rescore
+        
+        rescored = []
+        for query, hits, positions in zip(queries, results, hit_positions):
+            if not hits:
+                rescored.append(hits)
+                continue
+            order, scores = rescore(query, raw_vectors.get(positions), k, metric)
+            rescored.append([(hits[i][0], hits[i][1], float(score)) for i, score in zip(order, scores)])
+        return rescored
+    
+    def _numpy_search(self, query_vectors: List[List[float]], k: int,
+                      filter: Optional[Dict[str, Any]] = None) -> List[List[tuple]]:
+        """在NumPy向量存储上执行精确矩阵搜索，每条查询返回(文档ID, 文档, 距离)列表"""
+        vector_db, metadata_index, _ = self._view
+        selection = metadata_index.select(filter) if filter else None
+        distances, positions = vector_db.search(np.asarray(query_vectors, dtype=np.float32), k, selection)
+        return [
+            [
+                (vector_db.id_at(int(position)), vector_db.document_at(int(position)), float(distance))
+                for distance, position in zip(row_distances, row_positions)
+            ]
+            for row_distances, row_positions in zip(distances, positions)
+        ]
+    
+    def _chroma_search(self, query_vectors: List[List[float]], k: int,
+                       filter: Optional[Dict[str, Any]] = None) -> List[List[tuple]]:
+        """在Chroma集合上执行批量查询，每条查询返回(文档ID, 文档, 距离)列表
+        
+        过滤条件转换为where子句，由Chroma的元数据索引在HNSW搜索前确定候选集合。
+        """
+        collection = self.vector_db._collection
+        k = min(k, collection.count())
+        if k <= 0:
+            return [[] for _ in query_vectors]
+        
+        response = collection.query(
+            query_embeddings=query_vectors,
+            n_results=k,
+            where=to_chroma_where(filter) if filter else None,
+            include=["documents", "metadatas", "distances"]
+        )
+        results = []
+        for ids, texts, metadatas, distances in zip(
+            response["ids"], response["documents"], response["metadatas"], response["distances"]
+        ):
+            results.append([
+                (doc_id, Document(page_content=text, metadata=metadata or {}), float(distance))
+                for doc_id, text, metadata, distance in zip(ids, texts, metadatas, distances)
+            ])
+        return results
+    
+    @property
+    def index_version(self) -> int:
+        """索引内容版本号，每次写入、删除或切换快照后递增"""
+        return self._index_version
+    
+    def embed_query(self, query: str) -> List[float]:
+        """用检索所用的嵌入模型嵌入查询（与检索共用查询嵌入缓存）"""
+        return self._embed_query(query)
+    
     def get_collection_stats(self) -> Dict[str, Any]:
         """获取集合统计信息"""
+        stats = self._get_backend_stats()
+        stats["snapshot_version"] = self.snapshot_version
+        if isinstance(self.embeddings, CachedEmbeddings):
+            stats["embedding_cache"] = self.embeddings.get_stats()
+        if self.seen_store is not None:
+            stats["dedup"] = self.seen_store.get_stats()
+        if self.metadata_index is not None:
+            stats["metadata_index"] = self.metadata_index.get_stats()
+        if self.eviction_worker is not None:
+            stats["eviction"] = self.eviction_worker.get_stats()
+        stats["query_cache"] = self.query_cache.get_stats()
+        stats["result_cache"] = self.result_cache.get_stats()
+        return stats
+    
+    def _get_backend_stats(self) -> Dict[str, Any]:
+        """获取向量数据库后端的统计信息"""
         try:
-            if isinstance(self.vector_db, Chroma):
+            if self.backend == "chroma":
                 try:
                     collection = self.vector_db._collection
                     if collection and hasattr(collection, 'count'):
@@ -234,12 +1458,13 @@ class VectorStore:
                         "document_count": "error",
                         "embedding_dimension": "error"
                     }
-            elif isinstance(self.vector_db, FAISS):
+            elif self.backend == "faiss":
                 try:
                     index = self.vector_db.index
+                    metadata_index = self.metadata_index
                     return {
                         "type": "faiss",
-                        "document_count": index.ntotal,
+                        "document_count": index.ntotal - (metadata_index.tombstones if metadata_index else 0),
                         "embedding_dimension": index.d
                     }
                 except Exception as e:
@@ -249,6 +1474,12 @@ class VectorStore:
                         "document_count": "error",
                         "embedding_dimension": "error"
                     }
+            elif self.backend == "numpy":
+                return {
+                    "type": "numpy",
+                    "document_count": len(self.vector_db),
+                    "embedding_dimension": self.vector_db.dimension or "unknown"
+                }
             else:
                 return {
                     "type": "unknown",
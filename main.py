@@ -5,8 +5,8 @@ import asyncio
 import sys
 from pathlib import Path
 
-from config.settings import settings
-from utils.logger import get_logger
+from config.settings import settings, ensure_directories
+from utils.logger import get_logger, setup_logger
 
 logger = get_logger(__name__)
 
@@ -49,8 +49,8 @@ def check_environment():
         settings.MODEL_CACHE_DIR
     ]
     
+    ensure_directories()
     for directory in required_dirs:
-        directory.mkdir(parents=True, exist_ok=True)
         logger.info(f"✅ 目录就绪: {directory}")
     
     logger.info("✅ 系统环境检查完成")
@@ -87,13 +87,16 @@ def start_cli_mode():
     logger.info("💻 启动命令行模式...")
     
     try:
-        from agents.dating_agent import DatingAgent
+        from utils.startup import log_startup_report, timed_import
+        
+        DatingAgent = timed_import("agents.dating_agent").DatingAgent
         
         # 初始化智能体
         logger.info("正在初始化智能体...")
         agent = DatingAgent()
         
         logger.info("智能体初始化完成！")
+        log_startup_report(logger)
         logger.info("输入 'quit' 或 'exit' 退出")
         logger.info("-" * 50)
         
@@ -143,11 +146,75 @@ def start_cli_mode():
         logger.error(f"启动命令行模式失败: {e}")
         raise
 
+def start_ingest_mode(argv):
+    """批量入库模式：流式导入JSONL文件或文本目录"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog="main.py ingest", description="流式批量导入文档到向量数据库")
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument("--jsonl", type=str, help="JSONL文件路径，每行一个JSON对象")
+    source_group.add_argument("--dir", type=str, help="文本目录路径，每个文件一篇文档")
+    parser.add_argument("--text-field", type=str, default="content", help="JSONL中的正文字段名")
+    parser.add_argument("--pattern", type=str, default="**/*.txt", help="文本目录的文件匹配模式")
+    parser.add_argument("--batch-size", type=int, default=None, help="每个嵌入/写入批次的片段数")
+    parser.add_argument("--no-resume", action="store_true", help="忽略断点，从头开始导入")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="构建新的索引版本快照并发布，运行中的服务自动切换（不修改当前版本）")
+    args = parser.parse_args(argv)
+    
+    try:
+        from core.vector_store import VectorStore
+        from core.ingest import JsonlSource, StreamingIngestor, TextDirectorySource
+        
+        if args.jsonl:
+            source = JsonlSource(args.jsonl, text_field=args.text_field)
+        else:
+            source = TextDirectorySource(args.dir, pattern=args.pattern)
+            
+        if args.snapshot:
+            from core.snapshots import SnapshotBuilder
+            
+            info = SnapshotBuilder().build(source)
+            print("\n" + "=" * 50)
+            print(f"📦 快照版本{info['version']}已发布:")
+            print("=" * 50)
+            print(f"文档: {info['documents']}篇，片段: {info['chunks']}个，耗时: {info['build_seconds']}秒")
+            return
+            
+        vector_store = VectorStore()
+        try:
+            report = StreamingIngestor(vector_store, batch_size=args.batch_size).run(
+                source, resume=not args.no_resume
+            )
+        finally:
+            # 关闭并行分割进程池、后台线程和索引文件
+            vector_store.close()
+        
+        print("\n" + "=" * 50)
+        print("📥 入库完成:")
+        print("=" * 50)
+        print(f"本次处理文档: {report['documents']}篇（累计{report['total_documents']}篇）")
+        print(f"新增片段: {report['chunks_added']}个，跳过重复片段: {report['chunks_skipped']}个")
+        print(f"跳过重复URL文档: {report['skipped_documents']}篇")
+        print(f"耗时: {report['elapsed_seconds']}秒，速度: {report['docs_per_second']}篇/秒")
+        
+    except KeyboardInterrupt:
+        logger.info("用户中断，已写入的批次已记录断点，重新执行同一命令即可继续")
+    except Exception as e:
+        logger.error(f"批量入库失败: {e}")
+        raise
+
 if __name__ == "__main__":
+    setup_logger()
+    ensure_directories()
+    
     # 检查命令行参数
     if len(sys.argv) > 1 and sys.argv[1] == "--cli":
         # 命令行模式
         start_cli_mode()
+    elif len(sys.argv) > 1 and sys.argv[1] == "ingest":
+        # 批量入库模式
+        start_ingest_mode(sys.argv[2:])
     else:
         # Web模式（默认）
         main()
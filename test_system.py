@@ -119,8 +119,1557 @@ def test_basic_functionality():
         traceback.print_exc()
         return False
 
+def test_embedding_cache():
+    """测试嵌入缓存"""
+    print("\n🔍 测试嵌入缓存...")
+    
+    try:
+        import tempfile
+        from core.embedding_cache import CachedEmbeddings, EmbeddingCacheStore
+        
+        class CountingEmbeddings:
+            """记录调用次数的假嵌入模型"""
+            def __init__(self):
+                self.calls = 0
+            
+            def embed_documents(self, texts):
+                self.calls += len(texts)
+                return [[float(len(text)), 1.0] for text in texts]
+            
+            def embed_query(self, text):
+                return [float(len(text)), 1.0]
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            base = CountingEmbeddings()
+            store = EmbeddingCacheStore(Path(tmp_dir) / "cache.sqlite3", max_entries=2)
+            cached = CachedEmbeddings(base, model_name="test-model", store=store)
+            
+            cached.embed_documents(["七夕", "约会 ", "七夕"])
+            cached.embed_documents(["七夕", " 约会"])
+            assert base.calls == 2, f"重复文本不应重新嵌入: {base.calls}"
+            
+            cached.embed_documents(["烛光晚餐"])
+            stats = cached.get_stats()
+            assert stats["entries"] == 2 and stats["evictions"] == 1, stats
+            store.close()
+        
+        print("✅ 嵌入缓存正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 嵌入缓存测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_faiss_persistence():
+    """测试FAISS增量段的重放与压缩"""
+    print("\n💾 测试FAISS增量持久化...")
+    
+    try:
+        import tempfile
+        import threading
+        import faiss
+        from langchain.docstore.in_memory import InMemoryDocstore
+        from langchain.schema.embeddings import Embeddings
+        from langchain_community.vectorstores import FAISS
+        from core.faiss_persistence import FaissSegmentLog
+        
+        class FakeEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [[float(len(text)), 1.0, 0.0, 0.0] for text in texts]
+            
+            def embed_query(self, text):
+                return self.embed_documents([text])[0]
+        
+        embeddings = FakeEmbeddings()
+        lock = threading.RLock()
+        
+        def add(vector_db, log, ids):
+            texts = [f"片段{doc_id}" for doc_id in ids]
+            vectors = embeddings.embed_documents(texts)
+            vector_db.add_embeddings(list(zip(texts, vectors)), metadatas=[{} for _ in ids], ids=ids)
+            log.append(ids, texts, [{} for _ in ids], vectors)
+        
+        def reload(directory):
+            log = FaissSegmentLog(directory)
+            vector_db = FAISS.load_local(str(log.base_path()), embeddings)
+            return log, vector_db, log.replay(vector_db)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            directory = Path(tmp_dir)
+            vector_db = FAISS(embeddings, faiss.IndexFlatL2(4), InMemoryDocstore({}), {})
+            log = FaissSegmentLog(directory)
+            assert log.compact(vector_db, lock, force=True)
+            add(vector_db, log, ["a", "b"])
+            add(vector_db, log, ["c", "d"])
+            log.close()
+            
+            # 模拟写入中途崩溃：增量段末尾只有一半的记录
+            segment = log._segment_path(log._list_segments()[-1])
+            with open(segment, "ab") as f:
+                f.write((1000).to_bytes(8, "little") + b"half")
+            log, vector_db, replayed = reload(directory)
+            assert replayed == 4 and vector_db.index.ntotal == 4, f"重放结果错误: {replayed}"
+            assert vector_db.docstore.search("d").page_content == "片段d"
+            
+            # 压缩后增量段被删除，重新加载时全部来自基础索引
+            assert log.compact(vector_db, lock, force=True)
+            assert log._list_segments() == []
+            log.close()
+            log, vector_db, replayed = reload(directory)
+            assert replayed == 0 and vector_db.index.ntotal == 4
+            
+            # 后台压缩进行中收到的强制压缩不会被丢弃
+            running, resume = threading.Event(), threading.Event()
+            log.on_compacted = lambda: running.set() or resume.wait(5)
+            log.compact_in_background(vector_db, lock, force=True)
+            running.wait(5)
+            with lock:
+                add(vector_db, log, ["e"])
+            log.compact_in_background(vector_db, lock, force=True)
+            resume.set()
+            log.wait()
+            assert log._list_segments() == [], "排队的强制压缩未执行"
+            log.close()
+            log, vector_db, replayed = reload(directory)
+            assert replayed == 0 and vector_db.index.ntotal == 5
+            log.close()
+        
+        print("✅ FAISS增量持久化正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ FAISS增量持久化测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_faiss_mmap():
+    """测试只读服务索引的导出与内存映射加载"""
+    print("\n🗺️ 测试内存映射服务索引...")
+    
+    try:
+        import tempfile
+        import faiss
+        import numpy as np
+        from langchain.schema import Document
+        from core.faiss_mmap import SERVING_RAW_DIR, export_serving_index, has_serving_index, load_serving_index
+        from core.raw_vectors import RawVectorStore
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((300, 16)).astype(np.float32)
+        queries = rng.standard_normal((10, 16)).astype(np.float32)
+        index = faiss.IndexFlatL2(16)
+        index.add(vectors)
+        documents = [(f"doc-{i}", Document(page_content=f"片段{i}", metadata={"i": i})) for i in range(300)]
+        expected_distances, expected_positions = index.search(queries, 5)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            directory = Path(tmp_dir) / "serving"
+            export_serving_index(index, documents, directory, raw_vectors=vectors)
+            assert has_serving_index(directory)
+            # 原始向量按位置一起导出，供只读服务精排
+            raw_vectors = RawVectorStore(directory / SERVING_RAW_DIR, read_only=True)
+            assert raw_vectors.ids[:2] == ["0", "1"] and np.array_equal(raw_vectors.get([5, 7]), vectors[[5, 7]])
+            raw_vectors.close()
+            
+            serving = load_serving_index(directory, embeddings=None)
+            distances, positions = serving.index.search(queries, 5)
+            # 平坦索引转换为单倒排表IVF后仍是精确搜索
+            assert np.array_equal(positions, expected_positions), "映射后的搜索结果不一致"
+            assert np.allclose(distances, expected_distances, atol=1e-4)
+            
+            position = int(positions[0][0])
+            doc = serving.docstore.search(serving.index_to_docstore_id[position])
+            assert doc.page_content == f"片段{position}" and doc.metadata == {"i": position}
+            serving.docstore.close()
+        
+        print("✅ 内存映射服务索引正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 内存映射服务索引测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_faiss_index():
+    """测试FAISS索引类型选择、重建条件与无损重建"""
+    print("\n📐 测试FAISS索引选择...")
+    
+    from config.settings import settings
+    
+    saved = {name: getattr(settings, name) for name in (
+        "FAISS_INDEX_TYPE", "FAISS_ANN_THRESHOLD", "FAISS_ANN_TYPE", "FAISS_PQ_THRESHOLD", "FAISS_NLIST"
+    )}
+    try:
+        import faiss
+        import numpy as np
+        from langchain.docstore.in_memory import InMemoryDocstore
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from langchain_community.vectorstores import FAISS
+        from core.faiss_index import (
+            build_index, choose_index_type, needs_rebuild, reconstruct_all, subset_search
+        )
+        from core.vector_store import VectorStore
+        
+        settings.FAISS_INDEX_TYPE = "auto"
+        settings.FAISS_ANN_THRESHOLD = 100
+        settings.FAISS_ANN_TYPE = "hnsw"
+        settings.FAISS_PQ_THRESHOLD = 1000
+        settings.FAISS_NLIST = 0
+        assert choose_index_type(99) == "flat"
+        assert choose_index_type(100) == "hnsw"
+        assert choose_index_type(999) == "hnsw"
+        assert choose_index_type(1000) == "ivf_pq"
+        settings.FAISS_INDEX_TYPE = "ivf_flat"
+        assert choose_index_type(10) == "ivf_flat", "显式配置的索引类型应优先"
+        
+        settings.FAISS_INDEX_TYPE = "auto"
+        settings.FAISS_ANN_TYPE = "ivf_flat"
+        settings.FAISS_PQ_THRESHOLD = 100000
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((4000, 16)).astype(np.float32)
+        flat = faiss.IndexFlatL2(16)
+        flat.add(vectors[:99])
+        assert not needs_rebuild(flat)
+        flat.add(vectors[99:100])
+        assert needs_rebuild(flat), "跨过ANN阈值后应重建"
+        
+        # 2000个向量时聚类数为min(4*sqrt(n), n/39)=51，规模翻倍后建议值达到102，需要重建
+        ivf = build_index(vectors[:2000], "ivf_flat")
+        assert ivf.nlist == 51 and not needs_rebuild(ivf)
+        ivf.add(vectors[2000:])
+        assert needs_rebuild(ivf), "聚类数明显偏小时应重建"
+        # 直接映射在构建时建立，追加的向量也能按位置取回
+        assert np.array_equal(reconstruct_all(ivf), vectors)
+        
+        # 未建立直接映射的索引不会在查询路径上被修改
+        unmapped = faiss.IndexIVFFlat(faiss.IndexFlatL2(16), 16, 4)
+        unmapped.train(vectors[:1000])
+        unmapped.add(vectors[:1000])
+        try:
+            subset_search(unmapped, vectors[:1], np.arange(10), 3)
+            raise AssertionError("未建立直接映射时应报错")
+        except RuntimeError:
+            pass
+        assert unmapped.direct_map.type == faiss.DirectMap.NoMap
+        
+        # 压缩索引缺少原始向量时（迁移旧数据）按内容重新嵌入补齐，而不是取有损的重建值
+        texts = [f"片段{i}" for i in range(2000)]
+        lookup = dict(zip(texts, vectors[:2000].tolist()))
+        
+        class LookupEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [lookup[text] for text in texts]
+            
+            def embed_query(self, text):
+                return lookup[text]
+        
+        ids = [str(i) for i in range(2000)]
+        vector_db = FAISS(
+            LookupEmbeddings(),
+            build_index(vectors[:2000], "flat", dtype="int8"),
+            InMemoryDocstore({doc_id: Document(page_content=text) for doc_id, text in zip(ids, texts)}),
+            dict(enumerate(ids))
+        )
+        store = VectorStore.__new__(VectorStore)
+        store.embeddings = vector_db.embedding_function
+        keep = [5, 1, 1999]
+        assert not np.array_equal(reconstruct_all(vector_db.index)[keep], vectors[keep])
+        assert np.array_equal(store._recover_raw_vectors(vector_db, keep), vectors[keep]), "补齐使用了有损向量"
+        
+        print("✅ FAISS索引选择正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ FAISS索引选择测试失败: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+def test_batch_search():
+    """测试批量相似性搜索与逐条搜索结果一致"""
+    print("\n📦 测试批量相似性搜索...")
+    
+    from config.settings import settings
+    
+    saved = settings.VECTOR_DB_TYPE
+    try:
+        import tempfile
+        import zlib
+        import numpy as np
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from core.vector_store import VectorStore
+        
+        class SeededEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [
+                    np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(16).tolist()
+                    for text in texts
+                ]
+            
+            def embed_query(self, text):
+                return self.embed_documents([text])[0]
+        
+        settings.VECTOR_DB_TYPE = "faiss"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = VectorStore(root=Path(tmp_dir), embeddings=SeededEmbeddings())
+            store.add_chunks([
+                Document(page_content=f"约会建议第{i}条", metadata={"category": "tips" if i % 2 else "places"})
+                for i in range(60)
+            ])
+            queries = ["七夕去哪里", "烛光晚餐", "看电影", "七夕去哪里"]
+            for filter in (None, {"category": "tips"}):
+                batch = store.similarity_search_batch(queries, k=5, filter=filter)
+                assert len(batch) == len(queries)
+                for query, hits in zip(queries, batch):
+                    single = store.similarity_search_with_score(query, k=5, filter=filter)
+                    assert len(hits) == 5, hits
+                    assert [doc.page_content for doc, _ in hits] == [doc.page_content for doc, _ in single]
+                    assert np.allclose([score for _, score in hits], [score for _, score in single], atol=1e-5)
+                    if filter:
+                        assert all(doc.metadata["category"] == "tips" for doc, _ in hits)
+            assert store.similarity_search_batch([]) == []
+            store.close()
+        
+        print("✅ 批量相似性搜索正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 批量相似性搜索测试失败: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        settings.VECTOR_DB_TYPE = saved
+
+def test_compressed_rescoring():
+    """测试int8压缩存储下float32精排恢复精确排序"""
+    print("\n🗜️ 测试压缩存储精排...")
+    
+    from config.settings import settings
+    
+    saved = {name: getattr(settings, name) for name in (
+        "VECTOR_DB_TYPE", "FAISS_INDEX_TYPE", "VECTOR_STORAGE_DTYPE", "VECTOR_INT8_MIN_TRAIN", "VECTOR_RESCORE"
+    )}
+    try:
+        import tempfile
+        import numpy as np
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from core.faiss_index import index_dtype_of
+        from core.vector_store import VectorStore
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+        queries = rng.standard_normal((20, 16)).astype(np.float32)
+        lookup = {f"片段{i}": vector for i, vector in enumerate(vectors)}
+        lookup.update({f"查询{i}": vector for i, vector in enumerate(queries)})
+        
+        class LookupEmbeddings(Embeddings):
+            def __init__(self):
+                self.document_calls = 0
+            
+            def embed_documents(self, texts):
+                # 查询文本也按批量嵌入，只统计片段
+                self.document_calls += sum(not text.startswith("查询") for text in texts)
+                # 初始化占位文档放在远处，不会进入前k
+                return [lookup.get(text, np.full(16, 100.0)).tolist() for text in texts]
+            
+            def embed_query(self, text):
+                return lookup[text].tolist()
+        
+        # float32暴力搜索得到的精确排序
+        distances = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+        expected = [[f"片段{i}" for i in row] for row in np.argsort(distances, axis=1)[:, :10]]
+        
+        settings.VECTOR_DB_TYPE = "faiss"
+        settings.FAISS_INDEX_TYPE = "flat"
+        settings.VECTOR_STORAGE_DTYPE = "int8"
+        settings.VECTOR_INT8_MIN_TRAIN = 1000
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            embeddings = LookupEmbeddings()
+            store = VectorStore(root=Path(tmp_dir), embeddings=embeddings)
+            store.add_chunks([Document(page_content=text) for text in lookup if text.startswith("片段")])
+            assert index_dtype_of(store.vector_db.index) == "int8", "未切换为int8存储"
+            # 之后的精排、删除重建和重新加载都从原始向量存储读取，不再调用嵌入模型
+            embeddings.document_calls = 0
+            
+            query_texts = [f"查询{i}" for i in range(20)]
+            settings.VECTOR_RESCORE = False
+            raw = store.similarity_search_batch(query_texts, k=10)
+            raw = [[doc.page_content for doc, _ in hits] for hits in raw]
+            assert raw != expected, "量化误差应改变部分查询的排序"
+            
+            settings.VECTOR_RESCORE = True
+            rescored = store.similarity_search_batch(query_texts, k=10)
+            assert [[doc.page_content for doc, _ in hits] for hits in rescored] == expected, "精排后排序不一致"
+            assert np.allclose(
+                [score for _, score in rescored[0]], np.sort(distances[0])[:10], atol=1e-4
+            ), "精排分数应为float32距离"
+            
+            # 删除每条查询的最近邻后，剩余片段的精确排序不变
+            nearest = {hits[0] for hits in expected}
+            doc_ids = [doc_id for doc_id, doc in store.vector_db.docstore._dict.items() if doc.page_content in nearest]
+            assert store.delete_documents(doc_ids) == len(nearest)
+            expected = [[text for text in row if text not in nearest] for row in
+                        [[f"片段{i}" for i in row] for row in np.argsort(distances, axis=1)[:, :20]]]
+            rescored = store.similarity_search_batch(query_texts, k=10)
+            assert [[doc.page_content for doc, _ in hits] for hits in rescored] == [row[:10] for row in expected], \
+                "删除后精排排序不一致"
+            assert len(store.raw_vectors) == store.vector_db.index.ntotal, "原始向量与索引行数不一致"
+            store.close()
+            
+            store = VectorStore(root=Path(tmp_dir), embeddings=embeddings)
+            rescored = store.similarity_search_batch(query_texts, k=10)
+            assert [[doc.page_content for doc, _ in hits] for hits in rescored] == [row[:10] for row in expected], \
+                "重新加载后精排排序不一致"
+            assert embeddings.document_calls == 0, f"精排或删除时调用了嵌入模型{embeddings.document_calls}次"
+            store.close()
+        
+        print("✅ 压缩存储精排正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 压缩存储精排测试失败: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+def test_lexical_index():
+    """测试BM25词法索引"""
+    print("\n🔍 测试BM25词法索引...")
+    
+    try:
+        import random
+        import tempfile
+        import time
+        from core.lexical_index import BM25Index, tokenize
+        
+        assert tokenize("烛光晚餐 Dinner") == ["烛光", "光晚", "晚餐", "dinner"]
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = BM25Index(Path(tmp_dir), journal_limit=1)
+            index.add([("a", "七夕烛光晚餐推荐"), ("b", "电影约会和户外野餐")])
+            index.add([("c", "北京浪漫餐厅")])
+            index.remove(["b"])
+            index.close()
+            
+            reloaded = BM25Index(Path(tmp_dir))
+            hits = reloaded.search("烛光晚餐", 3)
+            assert len(reloaded) == 2 and hits[0][0] == "a", hits
+            reloaded.close()
+        
+        # 几乎每个片段都含有的高频词不参与打分，只有高频词时仍然可以检索
+        words = ["七夕", "烛光", "晚餐", "攻略", "北京", "电影", "野餐", "浪漫", "礼物", "餐厅", "公园", "咖啡"]
+        rng = random.Random(0)
+        index = BM25Index(max_df_ratio=0.5)
+        index.add((f"d{i}", "约会" + "".join(rng.choice(words) for _ in range(20))) for i in range(30000))
+        index.add([("rare", "约会烛光")])
+        assert index.search("约会", 1), "只有高频词的查询应返回结果"
+        hits = index.search("七夕烛光晚餐约会攻略", 10, allowed=lambda doc_id: doc_id != "d0")
+        assert len(hits) == 10 and all(doc_id != "d0" for doc_id, _ in hits)
+        
+        # 打分在锁外用NumPy完成，高频词二元组遍布语料时单次查询仍在毫秒级
+        start = time.perf_counter()
+        for _ in range(10):
+            index.search("七夕烛光晚餐约会攻略", 10)
+        elapsed = (time.perf_counter() - start) / 10
+        assert elapsed < 0.05, f"BM25查询耗时{elapsed * 1000:.1f}ms"
+        
+        print("✅ BM25词法索引正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ BM25词法索引测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_streaming_ingest():
+    """测试流式批量入库的断点恢复"""
+    print("\n🔍 测试流式批量入库...")
+    
+    try:
+        import json
+        import tempfile
+        from core.ingest import JsonlSource, StreamingIngestor
+        
+        class FakeStore:
+            """按文档原样作为片段，第二个批次写入时模拟中断"""
+            def __init__(self, fail_at=None):
+                self.added = []
+                self.fail_at = fail_at
+            
+            def prepare_batches(self, batches):
+                for documents, tag in batches:
+                    yield list(documents), 0, tag
+            
+            def add_chunks(self, chunks):
+                if self.fail_at is not None and len(self.added) >= self.fail_at:
+                    raise KeyboardInterrupt
+                self.added.extend(chunk.page_content for chunk in chunks)
+                return {"added": len(chunks), "skipped": 0}
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "docs.jsonl"
+            with open(path, "w", encoding="utf-8") as f:
+                for i in range(10):
+                    f.write(json.dumps({"content": f"文档{i}", "category": "test"}, ensure_ascii=False) + "\n")
+            source = JsonlSource(path)
+            
+            first = FakeStore(fail_at=4)
+            try:
+                StreamingIngestor(first, batch_size=4, read_batch=2, checkpoint_dir=Path(tmp_dir)).run(source)
+            except KeyboardInterrupt:
+                pass
+            
+            second = FakeStore()
+            report = StreamingIngestor(second, batch_size=4, read_batch=2, checkpoint_dir=Path(tmp_dir)).run(source)
+            assert first.added + second.added == [f"文档{i}" for i in range(10)], (first.added, second.added)
+            assert report["total_documents"] == 10, report
+        
+        print("✅ 流式批量入库正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 流式批量入库测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_dedup():
+    """测试入库去重：重复URL、重复内容、布隆过滤器重建与删除后重新入库"""
+    print("\n🧹 测试入库去重...")
+    
+    from config.settings import settings
+    
+    saved = settings.VECTOR_DB_TYPE
+    try:
+        import tempfile
+        import zlib
+        import numpy as np
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from core.dedup import SeenStore
+        from core.vector_store import VectorStore
+        
+        class SeededEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [
+                    np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(8).tolist()
+                    for text in texts
+                ]
+            
+            def embed_query(self, text):
+                return self.embed_documents([text])[0]
+        
+        settings.VECTOR_DB_TYPE = "faiss"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = VectorStore(root=Path(tmp_dir) / "store", embeddings=SeededEmbeddings())
+            first = Document(page_content="七夕烛光晚餐攻略", metadata={"url": "https://Example.com/a/"})
+            assert store.add_chunks([first]) == {"added": 1, "skipped": 0}
+            
+            # 规范化后相同的URL在分割前被跳过，本批次内重复的URL也只保留一个
+            documents = [
+                Document(page_content="另一篇文章", metadata={"url": "https://example.com/a"}),
+                Document(page_content="新文章", metadata={"url": "https://example.com/b"}),
+                Document(page_content="新文章的转载", metadata={"url": "https://example.com/b"})
+            ]
+            (chunks, skipped_documents, _), = store.prepare_batches([(documents, None)], parallel=False)
+            assert skipped_documents == 2, skipped_documents
+            assert [chunk.page_content for chunk in chunks] == ["新文章"]
+            
+            # 内容已入库或本批次内重复的片段被跳过
+            duplicate = Document(page_content="七夕烛光晚餐攻略", metadata={"source": "copy"})
+            fresh = Document(page_content="户外野餐清单")
+            assert store.add_chunks([duplicate, fresh, fresh]) == {"added": 1, "skipped": 2}
+            
+            # 删除片段后去重记录随之删除，同一内容可以重新入库
+            doc_ids = [
+                doc_id for doc_id, doc in store.vector_db.docstore._dict.items()
+                if doc.page_content == "七夕烛光晚餐攻略"
+            ]
+            assert store.delete_documents(doc_ids) == 1
+            assert store.add_chunks([first]) == {"added": 1, "skipped": 0}, "删除后应允许重新入库"
+            
+            # add_texts同样记录并检查source字段中的来源URL
+            page = {"source": "https://example.com/page"}
+            assert store.add_texts(["海边日落散步路线"], [page])["added"] == 1
+            report = store.add_texts(["海边日落散步路线（更新版）"], [{"source": "https://Example.com/page/"}])
+            assert report == {"added": 0, "skipped": 0, "skipped_documents": 1}, report
+            store.close()
+            
+            # 进程在布隆过滤器落盘前退出：重新打开时过滤器落后于精确存储，需要重建
+            directory = Path(tmp_dir) / "seen"
+            seen = SeenStore(directory, capacity=100, flush_interval=1000)
+            seen.add_many([("c:a", "1")])
+            seen.close()
+            crashed = SeenStore(directory, capacity=100, flush_interval=1000)
+            crashed.add_many([("c:b", "2"), ("u:x", "2")])
+            reopened = SeenStore(directory, capacity=100, flush_interval=1000)
+            assert "c:b" in reopened.bloom and "u:x" in reopened.bloom, "布隆过滤器未重建"
+            assert reopened.contains_many(["c:a", "c:b", "u:x", "c:z"]) == {"c:a", "c:b", "u:x"}
+            reopened.remove_doc_ids(["2"])
+            assert reopened.contains_many(["c:b", "u:x"]) == set()
+            crashed.close()
+            reopened.close()
+        
+        print("✅ 入库去重正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 入库去重测试失败: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        settings.VECTOR_DB_TYPE = saved
+
+def test_parallel_split():
+    """测试并行分割入库：跨批次URL去重与进程池关闭"""
+    print("\n🔀 测试并行分割入库...")
+    
+    from config.settings import settings
+    
+    saved = {name: getattr(settings, name) for name in (
+        "VECTOR_DB_TYPE", "SPLIT_WORKERS", "SPLIT_PARALLEL_MIN_DOCS", "INGEST_READ_BATCH"
+    )}
+    try:
+        import tempfile
+        import zlib
+        import numpy as np
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from core.vector_store import VectorStore
+        
+        class SeededEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [
+                    np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(8).tolist()
+                    for text in texts
+                ]
+            
+            def embed_query(self, text):
+                return self.embed_documents([text])[0]
+        
+        settings.VECTOR_DB_TYPE = "faiss"
+        settings.SPLIT_WORKERS = 2
+        settings.SPLIT_PARALLEL_MIN_DOCS = 4
+        settings.INGEST_READ_BATCH = 2
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = VectorStore(root=Path(tmp_dir), embeddings=SeededEmbeddings())
+            # 同一URL分散在不同批次中，前面的批次还在进程池中分割时后面的批次就已过滤
+            documents = [
+                Document(page_content=f"约会文章{i}", metadata={"url": f"https://example.com/{i % 3}"})
+                for i in range(8)
+            ]
+            report = store.add_documents(documents)
+            assert report == {"added": 3, "skipped": 0, "skipped_documents": 5}, report
+            assert store.parallel_splitter._pool is not None
+            
+            store.close()
+            assert store.parallel_splitter._pool is None, "关闭后进程池未释放"
+        
+        print("✅ 并行分割入库正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 并行分割入库测试失败: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+def test_metadata_index():
+    """测试元数据二级索引"""
+    print("\n🔍 测试元数据索引...")
+    
+    try:
+        from core.metadata_index import MetadataIndex, to_chroma_where
+        
+        index = MetadataIndex(["category", "relevance_score"])
+        index.add(
+            ["a", "b", "c", "d"],
+            [
+                {"category": "dating_tips", "relevance_score": 0.9},
+                {"category": "dating_ideas", "relevance_score": 0.4},
+                {"category": "dating_tips"},
+                {"category": "dating_ideas", "relevance_score": 0.7}
+            ]
+        )
+        assert index.select({"category": "dating_tips"}).tolist() == [0, 2]
+        assert index.select({"relevance_score": {"$gte": 0.5}}).tolist() == [0, 3]
+        assert index.select({"category": ["dating_ideas"], "relevance_score": {"$gt": 0.5}}).tolist() == [3]
+        assert to_chroma_where({"category": "dating_tips", "relevance_score": {"$gte": 0.5}}) == {
+            "$and": [{"category": {"$eq": "dating_tips"}}, {"relevance_score": {"$gte": 0.5}}]
+        }
+        
+        print("✅ 元数据索引正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 元数据索引测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_lru_cache():
+    """测试进程内LRU缓存"""
+    print("\n🔍 测试LRU缓存...")
+    
+    try:
+        import time
+        from utils.cache import LRUCache
+        
+        cache = LRUCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+        
+        expiring = LRUCache(max_entries=10, ttl_seconds=0.05)
+        expiring.put("a", 1)
+        time.sleep(0.1)
+        assert expiring.get("a") is None
+        
+        stats = cache.get_stats()
+        assert stats["evictions"] == 1 and stats["hits"] == 3, stats
+        
+        print("✅ LRU缓存正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ LRU缓存测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_snapshots():
+    """测试索引版本快照的发布、切换与回收"""
+    print("\n🔍 测试索引版本快照...")
+    
+    try:
+        import tempfile
+        from pathlib import Path
+        from core.snapshots import (
+            SnapshotBuilder, SnapshotWatcher, checkout, collect_garbage, list_versions, publish, resolve_current,
+            snapshot_root
+        )
+        
+        class FakeStore:
+            snapshot_version = None
+            
+            def activate_snapshot(self, version, directory):
+                self.snapshot_version = version
+                return directory.is_dir()
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            base = Path(tmp)
+            assert resolve_current(base) == (None, base)
+            
+            builder = SnapshotBuilder(base, keep=2)
+            for _ in range(3):
+                version, building = builder._claim_version()
+                building.rename(snapshot_root(base) / version)
+            assert list_versions(base) == ["v-000001", "v-000002", "v-000003"]
+            
+            publish(base, "v-000002")
+            assert resolve_current(base) == ("v-000002", snapshot_root(base) / "v-000002")
+            store = FakeStore()
+            watcher = SnapshotWatcher(store, base, interval=1)
+            assert watcher.check() and store.snapshot_version == "v-000002"
+            assert not watcher.check()
+            
+            # 工作副本与已发布的版本分开；重启时沿用最新的副本，切换时总是复制新的副本
+            (snapshot_root(base) / "v-000001" / "data.txt").write_text("发布时", encoding="utf-8")
+            working = checkout(snapshot_root(base) / "v-000001")
+            (working / "data.txt").write_text("运行中写入", encoding="utf-8")
+            assert (snapshot_root(base) / "v-000001" / "data.txt").read_text(encoding="utf-8") == "发布时"
+            assert checkout(snapshot_root(base) / "v-000001", resume=True) == working
+            fresh = checkout(snapshot_root(base) / "v-000001")
+            assert fresh != working and (fresh / "data.txt").read_text(encoding="utf-8") == "发布时"
+            
+            # 只保留最新版本，CURRENT指向的旧版本同样不会被回收；被回收版本的工作副本一起删除
+            collect_garbage(base, keep=1)
+            assert list_versions(base) == ["v-000002", "v-000003"]
+            assert not working.exists() and not fresh.exists()
+        
+        print("✅ 索引版本快照正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 索引版本快照测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_snapshot_activation():
+    """测试切换快照和删除片段后通知使用方刷新vector_db引用"""
+    print("\n🔁 测试快照切换回调...")
+    
+    from config.settings import settings
+    
+    saved = {name: getattr(settings, name) for name in ("VECTOR_DB_TYPE", "SNAPSHOT_SWAP_GRACE_SECONDS")}
+    try:
+        import tempfile
+        import zlib
+        import numpy as np
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from core.vector_store import VectorStore
+        
+        class SeededEmbeddings(Embeddings):
+            def embed_documents(self, texts):
+                return [
+                    np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(8).tolist()
+                    for text in texts
+                ]
+            
+            def embed_query(self, text):
+                return self.embed_documents([text])[0]
+        
+        settings.VECTOR_DB_TYPE = "faiss"
+        settings.SNAPSHOT_SWAP_GRACE_SECONDS = 0
+        embeddings = SeededEmbeddings()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            building = VectorStore(root=Path(tmp_dir) / "v-000001", embeddings=embeddings)
+            building.add_chunks([Document(page_content="新版本的约会攻略")])
+            building.close(compact=True)
+            published_dir = Path(tmp_dir) / "v-000001"
+            contents = lambda directory: {
+                str(path.relative_to(directory)): path.read_bytes() for path in directory.rglob("*") if path.is_file()
+            }
+            published = contents(published_dir)
+            
+            store = VectorStore(root=Path(tmp_dir) / "current", embeddings=embeddings)
+            # 模拟问答链：每次回调时用当前的vector_db重建检索器
+            retrievers = [store.vector_db]
+            store.on_replaced = lambda: retrievers.append(store.vector_db)
+            
+            assert store.activate_snapshot("v-000001", published_dir)
+            assert len(retrievers) == 2 and retrievers[-1] is store.vector_db, "切换快照后未刷新检索器"
+            assert retrievers[-1] is not retrievers[0]
+            assert store.root.parent.name == "working", "应在快照的工作副本上写入"
+            hits = store.similarity_search("新版本的约会攻略", k=1)
+            assert hits and hits[0].page_content == "新版本的约会攻略"
+            store.add_chunks([Document(page_content="切换后新增的约会攻略")])
+            
+            doc_ids = [
+                doc_id for doc_id, doc in store.vector_db.docstore._dict.items()
+                if doc.page_content == "新版本的约会攻略"
+            ]
+            # 新的元数据索引在发布前构建：构建期间查询看到的仍是旧向量库
+            build = store._build_metadata_index
+            published_early = []
+            store._build_metadata_index = lambda vector_db: published_early.append(store.vector_db is vector_db) or build(vector_db)
+            assert store.delete_documents(doc_ids) == 1
+            del store._build_metadata_index
+            assert published_early == [False], "元数据索引构建完成前向量库已发布"
+            vector_db, metadata_index, _ = store._view
+            assert metadata_index.ids_at(range(vector_db.index.ntotal)) == [
+                str(vector_db.index_to_docstore_id[position]) for position in range(vector_db.index.ntotal)
+            ]
+            assert len(retrievers) == 3 and retrievers[-1] is store.vector_db, "删除片段后未刷新检索器"
+            assert contents(published_dir) == published, "切换后的写入修改了已发布的快照"
+            
+            # 回调失败不影响切换本身；重新切换回该版本得到的是发布时的内容
+            store.on_replaced = lambda: 1 / 0
+            assert store.activate_snapshot("v-000001", published_dir)
+            texts = [doc.page_content for doc in store.similarity_search("新版本的约会攻略", k=5)]
+            assert "新版本的约会攻略" in texts and "切换后新增的约会攻略" not in texts, f"快照内容被修改: {texts}"
+            store.close()
+        
+        print("✅ 快照切换回调正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 快照切换回调测试失败: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+def test_mmr():
+    """测试MMR多样化"""
+    print("\n🔍 测试MMR多样化...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from config.settings import settings
+        from core.mmr import maximal_marginal_relevance
+        from core.vector_store import VectorStore
+        
+        query = np.array([1.0, 0.0, 0.0])
+        candidates = np.array([
+            [1.0, 0.1, 0.0],
+            [1.0, 0.11, 0.0],  # 与第一个几乎相同
+            [0.7, 0.0, 0.7]
+        ])
+        assert maximal_marginal_relevance(query, candidates, k=2, lambda_mult=0.5) == [0, 2]
+        assert maximal_marginal_relevance(query, candidates, k=2, lambda_mult=1.0) == [0, 1]
+        assert maximal_marginal_relevance(query, candidates[:0], k=2) == []
+        
+        # 候选向量从向量库取回，MMR搜索不再重新计算片段嵌入
+        lookup = {"烛光晚餐": [1.0, 0.1, 0.0], "烛光晚餐推荐": [1.0, 0.11, 0.0], "户外野餐": [0.7, 0.0, 0.7]}
+        
+        class CountingEmbeddings(Embeddings):
+            def __init__(self):
+                self.documents = 0
+            
+            def embed_documents(self, texts):
+                self.documents += len(texts)
+                return [lookup.get(text, [0.0, 0.0, -1.0]) for text in texts]
+            
+            def embed_query(self, text):
+                return [1.0, 0.0, 0.0]
+        
+        saved = settings.VECTOR_DB_TYPE
+        try:
+            for backend in ("faiss", "numpy"):
+                settings.VECTOR_DB_TYPE = backend
+                embeddings = CountingEmbeddings()
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    store = VectorStore(root=Path(tmp_dir), embeddings=embeddings)
+                    store.add_chunks([Document(page_content=text) for text in lookup])
+                    embeddings.documents = 0
+                    results = store.max_marginal_relevance_search("七夕约会", k=2, fetch_k=3, lambda_mult=0.5)
+                    assert [doc.page_content for doc in results] == ["烛光晚餐", "户外野餐"], (backend, results)
+                    assert embeddings.documents == 0, f"{backend}后端的MMR重新计算了{embeddings.documents}个嵌入"
+                    store.close()
+        finally:
+            settings.VECTOR_DB_TYPE = saved
+        
+        print("✅ MMR多样化正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ MMR多样化测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_reranker():
+    """测试交叉编码器重排序（使用假模型）"""
+    print("\n🔍 测试重排序...")
+    
+    try:
+        import threading
+        import time
+        from langchain.schema import Document
+        from core.reranker import CrossEncoderReranker
+        
+        class FakeModel:
+            calls = 0
+            
+            def predict(self, pairs, batch_size, show_progress_bar):
+                self.calls += 1
+                return [float(len(text)) for _, text in pairs]
+        
+        reranker = CrossEncoderReranker("fake", max_concurrency=1)
+        reranker._model = FakeModel()
+        documents = [Document(page_content=text) for text in ["短", "最长的片段", "中等片段"]]
+        
+        top = reranker.rerank("查询", documents, top_n=2)
+        assert [doc.page_content for doc in top] == ["最长的片段", "中等片段"]
+        reranker.rerank("查询", documents, top_n=2)
+        assert reranker._model.calls == 1, "分数应命中缓存"
+        
+        # 并发已满时跳过重排序，保留召回顺序
+        reranker._slots.acquire()
+        assert reranker.rerank("另一个查询", documents, top_n=2) == documents[:2]
+        assert reranker.get_stats()["skipped_busy"] == 1
+        reranker._slots.release()
+        
+        class SlowModel:
+            """每次打分耗时20ms；blocked被设置时阻塞到released"""
+            def __init__(self):
+                self.blocked = threading.Event()
+                self.entered = threading.Event()
+                self.released = threading.Event()
+            
+            def predict(self, pairs, batch_size, show_progress_bar):
+                if self.blocked.is_set():
+                    self.entered.set()
+                    self.released.wait(5)
+                time.sleep(0.02)
+                return [float(len(text)) for _, text in pairs]
+        
+        # 实测耗时远超预算，但服务器空闲时仍然每次都重排序
+        reranker = CrossEncoderReranker("fake", latency_budget_ms=5, max_concurrency=4)
+        reranker._model = SlowModel()
+        for i in range(5):
+            top = reranker.rerank(f"空闲查询{i}", documents, top_n=2)
+            assert [doc.page_content for doc in top] == ["最长的片段", "中等片段"], f"空闲时第{i}次未重排序"
+        stats = reranker.get_stats()
+        assert stats["reranked"] == 5 and stats["skipped_budget"] == 0, stats
+        assert stats["latency_p95_ms"] >= 20
+        
+        # 已有重排序在进行时，按实测p95预估排队后的耗时超过预算则跳过
+        reranker._model.blocked.set()
+        worker = threading.Thread(target=reranker.rerank, args=("进行中的查询", documents, 2))
+        worker.start()
+        assert reranker._model.entered.wait(5)
+        reranker._model.blocked.clear()
+        assert reranker.rerank("排队的查询", documents, top_n=2) == documents[:2]
+        assert reranker.get_stats()["skipped_budget"] == 1
+        # 分数已缓存的查询不需要模型计算，不受预算限制
+        top = reranker.rerank("空闲查询0", documents, top_n=2)
+        assert [doc.page_content for doc in top] == ["最长的片段", "中等片段"]
+        reranker._model.released.set()
+        worker.join()
+        assert reranker.get_stats()["active"] == 0
+        
+        print("✅ 重排序正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 重排序测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_numpy_store():
+    """测试NumPy向量存储"""
+    print("\n🧮 测试NumPy向量存储...")
+    
+    try:
+        import tempfile
+        import numpy as np
+        from core.numpy_store import NumpyStore
+        
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(50, 8)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyStore(Path(tmp))
+            store.add_embeddings(
+                [f"id-{i}" for i in range(50)],
+                [f"片段{i}" for i in range(50)],
+                [{"i": i} for i in range(50)],
+                vectors
+            )
+            
+            # 与暴力计算的最近邻一致
+            query = vectors[7] + 0.01
+            distances, positions = store.search(query, 5)
+            expected = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+            assert positions[0].tolist() == expected.tolist(), "top-k结果错误"
+            assert store.document_at(int(positions[0][0])).page_content == "片段7"
+            
+            # 只在预过滤的行上搜索
+            _, positions = store.search(query, 3, selection=np.arange(20, 30))
+            assert all(20 <= p < 30 for p in positions[0])
+            store.close()
+            
+            # 重新加载后数据完整
+            store = NumpyStore(Path(tmp))
+            assert len(store) == 50 and store.dimension == 8
+            assert store.get_by_ids(["id-3"])["id-3"].metadata == {"i": 3}
+            store.close()
+        
+        print("✅ NumPy向量存储正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ NumPy向量存储测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_eviction():
+    """测试过期片段淘汰规则"""
+    print("\n🧹 测试过期片段淘汰...")
+    
+    try:
+        from core.eviction import find_expired_ids
+        from core.metadata_index import MetadataIndex
+        
+        day = 86400
+        index = MetadataIndex(["type", "category", "ingested_at"])
+        index.add(["old-web", "new-web", "old-news", "pinned", "legacy"], [
+            {"type": "web_search", "category": "dating_ideas", "ingested_at": 0},
+            {"type": "web_search", "category": "dating_ideas", "ingested_at": 9 * day},
+            {"type": "web_search", "category": "news", "ingested_at": 8 * day},
+            {"type": "basic_knowledge", "category": "news", "ingested_at": 0},
+            {"type": "web_search", "category": "dating_ideas"}
+        ])
+        select_ids = lambda filter: index.ids_at(index.select(filter))
+        
+        expired = find_expired_ids(select_ids, 10 * day, {"web_search": 7 * day}, {"news": day}, ["basic_knowledge"])
+        # news按category的1天TTL过期；置顶和无时间戳的片段保留
+        assert expired == {"old-web", "old-news"}, f"淘汰结果错误: {expired}"
+        assert find_expired_ids(select_ids, 10 * day, {}, {}, []) == set()
+        
+        print("✅ 过期片段淘汰正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 过期片段淘汰测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_tombstone_eviction():
+    """测试FAISS淘汰只做删除标记，超过比例才重建索引"""
+    print("\n🪦 测试淘汰删除标记...")
+    
+    from config.settings import settings
+    
+    saved = {name: getattr(settings, name) for name in (
+        "VECTOR_DB_TYPE", "FAISS_TOMBSTONE_RATIO", "EVICTION_TTL_BY_TYPE", "EVICTION_TTL_BY_CATEGORY",
+        "SNAPSHOT_SWAP_GRACE_SECONDS"
+    )}
+    try:
+        import tempfile
+        import zlib
+        import numpy as np
+        from langchain.schema import Document
+        from langchain.schema.embeddings import Embeddings
+        from core.vector_store import VectorStore
+        
+        class CountingEmbeddings(Embeddings):
+            def __init__(self):
+                self.document_calls = 0
+            
+            def embed_documents(self, texts):
+                self.document_calls += len(texts)
+                return [
+                    np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(8).tolist()
+                    for text in texts
+                ]
+            
+            def embed_query(self, text):
+                return np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(8).tolist()
+        
+        day = 86400
+        settings.VECTOR_DB_TYPE = "faiss"
+        settings.FAISS_TOMBSTONE_RATIO = 0.15
+        settings.EVICTION_TTL_BY_TYPE = {"web_search": 7 * day}
+        settings.EVICTION_TTL_BY_CATEGORY = {}
+        settings.SNAPSHOT_SWAP_GRACE_SECONDS = 0
+        embeddings = CountingEmbeddings()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = VectorStore(root=Path(tmp_dir), embeddings=embeddings)
+            store.add_chunks([
+                Document(page_content=f"约会建议第{i}条", metadata={"type": "web_search", "ingested_at": day * i})
+                for i in range(100)
+            ])
+            ntotal = store.vector_db.index.ntotal
+            embeddings.document_calls = 0
+            rebuilds = []
+            compact = store._compact_faiss
+            store._compact_faiss = lambda doc_ids: rebuilds.append(len(doc_ids)) or compact(doc_ids)
+            
+            # 第一次淘汰10%：只做删除标记，不重建、不调用嵌入模型
+            assert store.evict_expired(now=17 * day)["evicted"] == 10
+            assert rebuilds == [] and store.vector_db.index.ntotal == ntotal, "少量淘汰不应重建索引"
+            assert store.get_collection_stats()["document_count"] == ntotal - 10
+            texts = lambda docs: {doc.page_content for doc in docs}
+            hits = store.similarity_search("约会建议第3条", k=100)
+            assert len(hits) == ntotal - 10 and "约会建议第3条" not in texts(hits), "已删除的片段仍被召回"
+            assert store.similarity_search("约会建议第3条", k=5, filter={"type": "web_search"})[0].page_content \
+                != "约会建议第3条"
+            store.close()
+            
+            # 删除记录随增量段持久化，重新加载后仍然生效
+            store = VectorStore(root=Path(tmp_dir), embeddings=embeddings)
+            assert store.metadata_index.tombstones == 10
+            assert "约会建议第3条" not in texts(store.similarity_search("约会建议第3条", k=100))
+            
+            # 累计超过比例后重建，回收全部已删除的向量
+            compact = store._compact_faiss
+            store._compact_faiss = lambda doc_ids: rebuilds.append(len(doc_ids)) or compact(doc_ids)
+            assert store.evict_expired(now=27 * day)["evicted"] == 10
+            del store._compact_faiss
+            assert rebuilds == [10], "超过比例后应重建索引"
+            assert store.vector_db.index.ntotal == ntotal - 20 and store.metadata_index.tombstones == 0
+            assert len(store.similarity_search("约会建议第3条", k=100)) == ntotal - 20
+            assert embeddings.document_calls == 0, f"淘汰时调用了嵌入模型{embeddings.document_calls}次"
+            store.close()
+        
+        print("✅ 淘汰删除标记正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 淘汰删除标记测试失败: {e}")
+        traceback.print_exc()
+        return False
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+
+def test_startup():
+    """测试延迟导入与启动耗时统计"""
+    print("\n⏱️ 测试启动耗时统计...")
+    
+    try:
+        import subprocess
+        from utils.startup import startup_report, timed, timed_import
+        
+        # 导入智能体模块时不应加载模型和向量库后端
+        code = (
+            "import sys; import agents.dating_agent; "
+            "print(','.join(m for m in ('torch', 'transformers', 'chromadb', 'faiss') if m in sys.modules))"
+        )
+        loaded = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            cwd=str(Path(__file__).parent)
+        ).stdout.strip().splitlines()[-1:]
+        assert loaded in ([], [""]), f"导入时加载了重型依赖: {loaded}"
+        
+        timed_import("json")
+        with timed("测试组件"):
+            pass
+        report = startup_report()
+        assert any(item["component"] == "测试组件" and item["ok"] for item in report["components"])
+        assert "heavy_modules_loaded" in report
+        
+        print("✅ 启动耗时统计正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 启动耗时统计测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_async_generation():
+    """测试异步生成不阻塞事件循环"""
+    print("\n⚡ 测试异步生成...")
+    
+    try:
+        import asyncio
+        import threading
+        import time
+        from core.llm_manager import LLMManager
+        
+        # 不加载真实模型，用耗时的假推理代替本地模型
+        manager = LLMManager.__new__(LLMManager)
+        manager.llm = object()
+        manager.use_openai = False
+        manager.response_cache = None
+        manager._executor = None
+        manager._executor_lock = threading.Lock()
+        manager.batch_scheduler = None
+        manager._generate_with_local_llama = lambda prompt, max_length, temperature: time.sleep(0.2) or f"回答:{prompt}"
+        
+        async def run():
+            ticks = 0
+            
+            async def ticker():
+                nonlocal ticks
+                for _ in range(10):
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+            
+            answers = await asyncio.gather(manager.agenerate("a"), manager.agenerate("b"), ticker())
+            return answers[:2], ticks
+        
+        answers, ticks = asyncio.run(run())
+        assert answers == ["回答:a", "回答:b"], f"异步生成结果错误: {answers}"
+        # 推理期间事件循环仍在调度其他协程
+        assert ticks == 10, f"事件循环被阻塞: {ticks}"
+        manager._executor.shutdown()
+        
+        print("✅ 异步生成正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 异步生成测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_streaming():
+    """测试流式生成事件顺序"""
+    print("\n📡 测试流式生成...")
+    
+    try:
+        import asyncio
+        import threading
+        from core.llm_manager import LLMManager
+        from langchain.schema import Document
+        from agents.dating_agent import DatingAgent
+        
+        # 用假的本地流式推理代替真实模型
+        manager = LLMManager.__new__(LLMManager)
+        manager.llm = object()
+        manager.use_openai = False
+        manager.response_cache = None
+        manager._executor = None
+        manager._executor_lock = threading.Lock()
+        manager._stream_with_local_llama = lambda full_prompt, max_length, temperature: iter(["七夕", "快乐"])
+        
+        agent = DatingAgent.__new__(DatingAgent)
+        agent.llm_manager = manager
+        agent.semantic_cache = None
+        agent._retrieve_context = lambda query: [Document(page_content="看电影", metadata={"type": "basic_knowledge"})]
+        agent.web_search = type("FakeSearch", (), {"search_dating_ideas": lambda self, query: []})()
+        
+        async def collect():
+            return [event async for event in agent.astream_plan_dating("七夕约会")]
+        
+        events = asyncio.run(collect())
+        names = [event["event"] for event in events]
+        assert names == ["retrieval", "token", "token", "done"], f"事件顺序错误: {names}"
+        assert events[0]["data"]["rag_used"] and len(events[0]["data"]["source_documents"]) == 1
+        assert "".join(event["data"]["text"] for event in events if event["event"] == "token") == "七夕快乐"
+        
+        print("✅ 流式生成正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 流式生成测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_response_cache():
+    """测试LLM响应缓存"""
+    print("\n💾 测试LLM响应缓存...")
+    
+    try:
+        import tempfile
+        from core.llm_manager import LLMManager
+        from core.response_cache import ResponseCache, ResponseCacheStore
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "responses.sqlite3"
+            calls = []
+            params = []
+            
+            def fake_generate(prompt, max_length, temperature):
+                calls.append(prompt)
+                params.append((max_length, temperature))
+                if prompt == "失败":
+                    raise RuntimeError("模型错误")
+                return f"回答:{prompt}"
+            
+            manager = LLMManager.__new__(LLMManager)
+            manager.llm = object()
+            manager.use_openai = False
+            manager.model_name = "fake-model"
+            manager.tokenizer = None
+            manager.model = None
+            manager.batch_scheduler = None
+            manager.response_cache = ResponseCache(8, store=ResponseCacheStore(path, max_entries=2))
+            manager._generate_with_local_llama = fake_generate
+            
+            assert manager.generate("七夕 约会") == "回答:七夕 约会"
+            # 规范化后相同的提示命中缓存
+            assert manager.generate("七夕  约会 ") == "回答:七夕 约会"
+            assert len(calls) == 1, f"缓存未命中: {calls}"
+            manager.generate("七夕 约会", use_cache=False)
+            manager.generate("七夕 约会", temperature=0.2)
+            assert len(calls) == 3, f"跳过缓存或不同参数时应重新生成: {calls}"
+            # 缓存键中的生成参数实际传给了模型
+            assert params[-1] == (512, 0.2), params
+            manager.generate("七夕 约会", max_length=64, temperature=0.2)
+            assert params[-1] == (64, 0.2) and len(calls) == 4, params
+            
+            # 失败的生成不写入缓存
+            assert manager.generate("失败").startswith("生成失败")
+            manager.generate("失败")
+            assert calls.count("失败") == 2
+            
+            info = manager.get_model_info()["response_cache"]
+            assert info["hits"] == 1 and info["disk"]["entries"] == 2, f"缓存统计错误: {info}"
+            
+            manager.response_cache.close()
+            
+            # 新进程从磁盘缓存读取
+            manager.response_cache = ResponseCache(8, store=ResponseCacheStore(path))
+            manager.generate("七夕 约会", max_length=64, temperature=0.2)
+            assert len(calls) == 6 and manager.response_cache.get_stats()["disk"]["hits"] == 1
+            
+            # 流式生成按各自的生成参数缓存，不同参数不会命中
+            manager._stream_with_local_llama = lambda full_prompt, max_length, temperature: iter([f"回答{max_length}"])
+            assert list(manager.stream("流式", max_length=32)) == ["回答32"]
+            assert list(manager.stream("流式", max_length=32)) == ["回答32"]
+            assert list(manager.stream("流式", max_length=16)) == ["回答16"]
+            assert manager.response_cache.hits == 2, manager.response_cache.get_stats()
+            manager.response_cache.close()
+        
+        print("✅ LLM响应缓存正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ LLM响应缓存测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_semantic_cache():
+    """测试语义缓存"""
+    print("\n🧠 测试语义缓存...")
+    
+    try:
+        from core.semantic_cache import SemanticCache, plan_params
+        
+        cache = SemanticCache(max_entries=2, threshold=0.9)
+        cache.put("七夕浪漫约会建议", [1.0, 0.0, 0.0], "方案A", version=1)
+        
+        # 相近的查询命中，不相近的查询未命中
+        hit = cache.get([0.95, 0.05, 0.0], version=1)
+        assert hit is not None and hit[0] == "方案A" and hit[2] == "七夕浪漫约会建议"
+        assert cache.get([0.0, 1.0, 0.0], version=1) is None
+        
+        # 容量满时淘汰最久未命中的条目
+        cache.put("查询B", [0.0, 1.0, 0.0], "方案B", version=1)
+        cache.get([1.0, 0.0, 0.0], version=1)
+        cache.put("查询C", [0.0, 0.0, 1.0], "方案C", version=1)
+        assert cache.get([0.0, 1.0, 0.0], version=1) is None, "最久未命中的条目应被淘汰"
+        assert cache.get([1.0, 0.0, 0.0], version=1)[0] == "方案A"
+        
+        # 知识库版本变化时失效
+        assert cache.get([1.0, 0.0, 0.0], version=2) is None
+        assert len(cache) == 0 and cache.get_stats()["invalidations"] == 1
+        
+        # 过期条目不再命中
+        expiring = SemanticCache(max_entries=4, threshold=0.9, ttl_seconds=1e-6)
+        expiring.put("查询", [1.0, 0.0], "方案")
+        assert expiring.get([1.0, 0.0]) is None and expiring.get_stats()["expirations"] == 1
+        
+        # 只差城市的查询即使嵌入相同也不命中；预算和日期同样参与比较
+        assert plan_params("北京七夕约会，预算500元") == (("北京",), (500.0,), ("七夕",))
+        assert plan_params("去温州市玩，预算2千") == (("温州",), (2000.0,), None)
+        cities = SemanticCache(max_entries=4, threshold=0.9)
+        cities.put("北京七夕约会", [1.0, 0.0], "北京方案", params=plan_params("北京七夕约会"))
+        assert cities.get([1.0, 0.0], params=plan_params("上海七夕约会")) is None, "不同城市不应命中"
+        assert cities.get([1.0, 0.0], params=plan_params("北京七夕约会300元")) is None, "不同预算不应命中"
+        assert cities.get([1.0, 0.0], params=plan_params("北京情人节约会")) is None, "不同日期不应命中"
+        assert cities.get([1.0, 0.0], params=plan_params("七夕在北京怎么约会"))[0] == "北京方案"
+        
+        print("✅ 语义缓存正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 语义缓存测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_semantic_cache_failures():
+    """测试生成失败的规划不写入语义缓存"""
+    print("\n🚫 测试生成失败不缓存...")
+    
+    try:
+        import asyncio
+        import threading
+        from core.llm_manager import LLMManager
+        from core.semantic_cache import SemanticCache
+        from langchain.schema import Document
+        from agents.dating_agent import DatingAgent
+        
+        state = {"enhance_fails": True}
+        
+        def fake_generate(prompt, max_length, temperature):
+            if "搜索结果" in prompt and state["enhance_fails"]:
+                raise RuntimeError("模型错误")
+            return "七夕快乐"
+        
+        def fake_stream(full_prompt, max_length, temperature):
+            yield "七夕"
+            raise RuntimeError("连接中断")
+        
+        manager = LLMManager.__new__(LLMManager)
+        manager.llm = object()
+        manager.use_openai = False
+        manager.batch_scheduler = None
+        manager.response_cache = None
+        manager._executor = None
+        manager._executor_lock = threading.Lock()
+        manager._generate_with_local_llama = fake_generate
+        manager._stream_with_local_llama = fake_stream
+        
+        agent = DatingAgent.__new__(DatingAgent)
+        agent.llm_manager = manager
+        agent.semantic_cache = SemanticCache(max_entries=4, threshold=0.9)
+        agent.vector_store = type("FakeStore", (), {"index_version": 1, "embed_query": lambda self, text: [1.0, 0.0]})()
+        agent._retrieve_context = lambda query: [Document(page_content="看电影", metadata={"type": "basic_knowledge"})]
+        search_result = {"title": "七夕约会", "snippet": "看电影", "url": "https://example.com"}
+        agent.web_search = type("FakeSearch", (), {"search_dating_ideas": lambda self, query: [search_result]})()
+        
+        # 补充建议生成失败：保留主回答，不拼接错误信息，也不写入缓存
+        result = agent.plan_dating("七夕约会")
+        assert result["answer"] == "七夕快乐", f"回答错误: {result['answer']}"
+        assert len(agent.semantic_cache) == 0, "补充建议失败的结果不应写入缓存"
+        
+        # 异步接口同样不缓存
+        result = asyncio.run(agent.aplan_dating("七夕约会"))
+        assert result["answer"] == "七夕快乐", f"回答错误: {result['answer']}"
+        assert len(agent.semantic_cache) == 0
+        
+        # 流式生成中途失败：已产出的token保留，错误信息作为最后一段，不写入缓存
+        async def collect():
+            return [event async for event in agent.astream_plan_dating("七夕约会")]
+        
+        events = asyncio.run(collect())
+        texts = [event["data"]["text"] for event in events if event["event"] == "token"]
+        assert texts[0] == "七夕" and texts[1].startswith("生成失败"), f"流式输出错误: {texts}"
+        assert events[-1] == {"event": "done", "data": {"cached": False}}
+        assert len(agent.semantic_cache) == 0, "流式生成失败的结果不应写入缓存"
+        
+        # 全部成功时写入缓存，之后的相近查询直接命中
+        state["enhance_fails"] = False
+        result = agent.plan_dating("七夕约会")
+        assert "💡 补充建议" in result["answer"] and len(agent.semantic_cache) == 1
+        assert agent.plan_dating("七夕怎么约会")["cached"]
+        
+        # 嵌入相同但城市不同的查询不复用别人的规划
+        agent.plan_dating("北京七夕约会")
+        assert not agent.plan_dating("上海七夕约会")["cached"], "不同城市的查询不应命中缓存"
+        assert agent.plan_dating("北京七夕怎么约会")["cached"]
+        
+        print("✅ 生成失败不缓存正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 生成失败不缓存测试失败: {e}")
+        traceback.print_exc()
+        return False
+
+def test_llm_batching():
+    """测试动态批处理调度"""
+    print("\n📦 测试动态批处理...")
+    
+    try:
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from core.llm_batching import BatchScheduler
+        
+        batches = []
+        
+        def fake_generate_batch(prompts, max_new_tokens, temperature):
+            batches.append(list(prompts))
+            time.sleep(0.05)
+            return [f"{prompt}:{max_new_tokens}" for prompt in prompts]
+        
+        scheduler = BatchScheduler(fake_generate_batch, max_batch_size=4, max_wait_ms=50)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda i: scheduler.generate(f"p{i}", 16), range(8)))
+        # 每个调用方拿回自己的结果，并发请求被合并
+        assert results == [f"p{i}:16" for i in range(8)], f"结果错误: {results}"
+        assert max(len(batch) for batch in batches) > 1 and all(len(batch) <= 4 for batch in batches)
+        
+        # 生成参数不同的请求分组执行；失败只影响同组请求
+        failing = BatchScheduler(lambda prompts, n, t: 1 / 0 if n == 1 else [p for p in prompts], max_wait_ms=50)
+        bad, good = failing.submit("a", 1), failing.submit("b", 2)
+        assert good.result() == "b" and isinstance(bad.exception(), ZeroDivisionError)
+        
+        stats = scheduler.get_stats()
+        assert stats["requests"] == 8 and stats["batches"] == len(batches), f"统计错误: {stats}"
+        scheduler.stop()
+        failing.stop()
+        
+        print("✅ 动态批处理正常")
+        return True
+        
+    except Exception as e:
+        print(f"❌ 动态批处理测试失败: {e}")
+        traceback.print_exc()
+        return False
+
 def main():
     """主测试函数"""
+    from utils.logger import setup_logger
+    
+    setup_logger()
     print("🧪 七夕约会指南RAG智能体 - 系统测试")
     print("=" * 50)
     
@@ -128,7 +1677,33 @@ def main():
         ("模块导入", test_imports),
         ("配置系统", test_config),
         ("目录结构", test_directories),
-        ("基本功能", test_basic_functionality)
+        ("基本功能", test_basic_functionality),
+        ("嵌入缓存", test_embedding_cache),
+        ("FAISS增量持久化", test_faiss_persistence),
+        ("内存映射服务索引", test_faiss_mmap),
+        ("FAISS索引选择", test_faiss_index),
+        ("批量相似性搜索", test_batch_search),
+        ("压缩存储精排", test_compressed_rescoring),
+        ("BM25词法索引", test_lexical_index),
+        ("流式批量入库", test_streaming_ingest),
+        ("入库去重", test_dedup),
+        ("并行分割入库", test_parallel_split),
+        ("元数据索引", test_metadata_index),
+        ("LRU缓存", test_lru_cache),
+        ("索引版本快照", test_snapshots),
+        ("快照切换回调", test_snapshot_activation),
+        ("MMR多样化", test_mmr),
+        ("交叉编码器重排序", test_reranker),
+        ("NumPy向量存储", test_numpy_store),
+        ("过期片段淘汰", test_eviction),
+        ("淘汰删除标记", test_tombstone_eviction),
+        ("启动耗时统计", test_startup),
+        ("异步生成", test_async_generation),
+        ("流式生成", test_streaming),
+        ("LLM响应缓存", test_response_cache),
+        ("语义缓存", test_semantic_cache),
+        ("生成失败不缓存", test_semantic_cache_failures),
+        ("动态批处理", test_llm_batching)
     ]
     
     passed = 0
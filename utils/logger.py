@@ -7,8 +7,16 @@ from loguru import logger
 
 from config.settings import settings
 
+_configured = False
+
 def setup_logger():
-    """设置日志配置"""
+    """设置日志配置（由程序入口调用，重复调用无副作用）"""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    settings.LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    
     # 移除默认的日志处理器
     logger.remove()
     
@@ -33,6 +41,3 @@ def setup_logger():
 def get_logger(name: str):
     """获取指定名称的日志器"""
     return logger.bind(name=name)
-
-# 初始化日志配置
-setup_logger()
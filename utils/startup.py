@@ -0,0 +1,88 @@
+"""
+启动耗时统计模块
+
+记录模块导入耗时和组件初始化耗时，供启动日志和/api/status输出；
+需要逐个模块的完整导入耗时时可使用 python -X importtime 运行。
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+# 可能被按需导入的重型依赖，报告中列出当前进程实际加载了哪些
+HEAVY_MODULES = [
+    "torch", "transformers", "sentence_transformers", "onnxruntime", "chromadb", "faiss",
+    "langchain", "langchain_community"
+]
+
+_STARTED_AT = time.perf_counter()
+_imports: List[Dict[str, Any]] = []
+_components: List[Dict[str, Any]] = []
+_lock = threading.Lock()
+
+def timed_import(module_name: str):
+    """导入模块并记录耗时（含其依赖的首次导入）；已导入的模块不重复记录"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    with _lock:
+        _imports.append({"module": module_name, "seconds": round(time.perf_counter() - start, 4)})
+    return module
+
+@contextmanager
+def timed(component: str):
+    """记录代码块（通常是一个组件的初始化）的耗时，失败时同样记录"""
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        with _lock:
+            _components.append({
+                "component": component,
+                "seconds": round(time.perf_counter() - start, 4),
+                "ok": ok
+            })
+
+def _process_uptime() -> Optional[float]:
+    """进程自创建以来的秒数，包含解释器启动；无法读取/proc时返回None"""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # 进程名可能含空格，从最后一个右括号之后开始分割；starttime是第22个字段
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return round(uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"), 3)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def startup_report() -> Dict[str, Any]:
+    """返回启动耗时报告"""
+    with _lock:
+        imports = list(_imports)
+        components = list(_components)
+    return {
+        "process_uptime_seconds": _process_uptime(),
+        "seconds_since_import": round(time.perf_counter() - _STARTED_AT, 3),
+        "imports": imports,
+        "components": components,
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules]
+    }
+
+def log_startup_report(logger) -> None:
+    """把启动耗时报告写入日志"""
+    report = startup_report()
+    for item in report["imports"]:
+        logger.info(f"⏱️ 导入 {item['module']}: {item['seconds']}秒")
+    for item in report["components"]:
+        status = "" if item["ok"] else "（失败）"
+        logger.info(f"⏱️ 初始化 {item['component']}: {item['seconds']}秒{status}")
+    logger.info(
+        f"⏱️ 启动耗时: 进程已运行{report['process_uptime_seconds']}秒，"
+        f"已加载重型依赖: {', '.join(report['heavy_modules_loaded']) or '无'}"
+    )
@@ -0,0 +1,39 @@
+"""
+文本处理工具模块
+"""
+import hashlib
+import re
+import unicodedata
+from urllib.parse import urlsplit, urlunsplit
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全半角统一、合并空白、去除首尾空白"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+def content_hash(text: str, namespace: str = "") -> str:
+    """计算规范化文本的内容哈希，可选命名空间（如模型名）"""
+    digest = hashlib.sha256()
+    if namespace:
+        digest.update(namespace.encode("utf-8"))
+        digest.update(b"\x00")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+def normalize_url(url: str) -> str:
+    """规范化URL：协议和域名小写，去掉片段标识和末尾斜杠"""
+    parts = urlsplit((url or "").strip())
+    path = parts.path.rstrip("/")
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+def source_url(metadata: dict) -> str:
+    """取文档元数据中的来源URL：优先url字段，其次是http(s)链接形式的source字段"""
+    url = metadata.get("url")
+    if url:
+        return url
+    source = metadata.get("source")
+    if isinstance(source, str) and source.startswith(("http://", "https://")):
+        return source
+    return ""
@@ -3,14 +3,15 @@ Web应用界面
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
+import json
 import uvicorn
 
-from agents.dating_agent import DatingAgent
-from config.settings import settings
-from utils.logger import get_logger
+from config.settings import settings, ensure_directories
+from utils.logger import get_logger, setup_logger
+from utils.startup import log_startup_report, startup_report, timed, timed_import
 
 logger = get_logger(__name__)
 
@@ -41,6 +42,7 @@ class DatingResponse(BaseModel):
     source_documents: List[Dict[str, Any]]
     search_results: List[Dict[str, Any]]
     status: str
+    cached: bool = False
 
 # 全局智能体实例
 dating_agent = None
@@ -49,13 +51,19 @@ dating_agent = None
 async def startup_event():
     """应用启动事件"""
     global dating_agent
+    setup_logger()
+    ensure_directories()
     try:
         logger.info("正在初始化约会指南智能体...")
-        dating_agent = DatingAgent()
+        # 智能体及其模型依赖在启动事件中才导入，导入web.app本身保持轻量
+        DatingAgent = timed_import("agents.dating_agent").DatingAgent
+        with timed("DatingAgent"):
+            dating_agent = DatingAgent()
         logger.info("智能体初始化完成")
     except Exception as e:
         logger.error(f"智能体初始化失败: {e}")
         dating_agent = None
+    log_startup_report(logger)
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -143,27 +151,48 @@ async def plan_dating(request: DatingRequest):
         logger.info(f"收到约会规划请求: {request.query}")
         
         # 调用智能体规划约会
-        result = dating_agent.plan_dating(request.query)
+        result = await dating_agent.aplan_dating(request.query)
         
         return DatingResponse(
             answer=result["answer"],
             source_documents=result["source_documents"],
             search_results=result["search_results"],
-            status="success"
+            status="success",
+            cached=result.get("cached", False)
         )
         
     except Exception as e:
         logger.error(f"规划约会失败: {e}")
         raise HTTPException(status_code=500, detail=f"规划约会失败: {str(e)}")
 
+@app.post("/api/plan-dating/stream")
+async def plan_dating_stream(request: DatingRequest):
+    """流式规划约会API（Server-Sent Events）：先发送检索到的源文档，再逐段发送生成的回答"""
+    if not dating_agent:
+        raise HTTPException(status_code=503, detail="智能体未初始化")
+    
+    logger.info(f"收到流式约会规划请求: {request.query}")
+    
+    async def events():
+        async for event in dating_agent.astream_plan_dating(request.query):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # 禁止缓存和反向代理缓冲，保证每段文本立即送达客户端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/status")
 async def get_status():
     """获取系统状态"""
     try:
         if not dating_agent:
-            return {"status": "not_initialized"}
+            return {"status": "not_initialized", "startup": startup_report()}
         
         status = dating_agent.get_agent_status()
+        status["startup"] = startup_report()
         return {"status": "ready", "details": status}
         
     except Exception as e: